@@ -0,0 +1,38 @@
+"""Add indexes on foreign keys used to look up submissions and grades
+
+Revision ID: 9fd8e9c0b2f1
+Revises: e43177bfe90b
+Create Date: 2026-10-18 10:12:43.120915
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9fd8e9c0b2f1'
+down_revision = 'e43177bfe90b'
+branch_labels = None
+depends_on = None
+
+
+# (index name, table, columns). The foreign keys that are the leading column
+# of a unique constraint (grade.cell_id, comment.cell_id,
+# submitted_assignment.assignment_id and submitted_notebook.notebook_id) are
+# already indexed by that constraint.
+INDEXES = [
+    ('ix_base_cell_notebook_id', 'base_cell', ['notebook_id']),
+    ('ix_submitted_assignment_student_id', 'submitted_assignment', ['student_id']),
+    ('ix_submitted_notebook_assignment_id', 'submitted_notebook', ['assignment_id']),
+    ('ix_grade_notebook_id', 'grade', ['notebook_id']),
+    ('ix_comment_notebook_id', 'comment', ['notebook_id']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,38 @@
+"""Add a table with a counter of the changes to the gradebook
+
+Revision ID: af37c6ae87ac
+Revises: d5c2a3b19f0e
+Create Date: 2026-10-18 16:02:31.418207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'af37c6ae87ac'
+down_revision = 'd5c2a3b19f0e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Add the gradebook_version table, unless the gradebook already created it,
+    and make sure it has its single row.
+    """
+    connection = op.get_bind()
+    if 'gradebook_version' not in sa.inspect(connection).get_table_names():
+        op.create_table(
+            'gradebook_version',
+            sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('version', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('id'))
+
+    table = sa.table('gradebook_version', sa.column('id'), sa.column('version'))
+    if connection.execute(sa.select([sa.func.count()]).select_from(table)).scalar() == 0:
+        op.bulk_insert(table, [{'id': 1, 'version': 0}])
+
+
+def downgrade():
+    op.drop_table('gradebook_version')
@@ -0,0 +1,125 @@
+"""Store the scores of submissions and the maximum scores of notebooks and assignments
+
+Revision ID: d5c2a3b19f0e
+Revises: 9fd8e9c0b2f1
+Create Date: 2026-10-18 13:41:07.552381
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5c2a3b19f0e'
+down_revision = '9fd8e9c0b2f1'
+branch_labels = None
+depends_on = None
+
+
+AGGREGATES = {
+    'notebook': [
+        'max_score_gradecell', 'max_score_taskcell', 'max_code_score',
+        'max_written_score', 'max_task_score'],
+    'assignment': [
+        'max_score_gradecell', 'max_score_taskcell', 'max_code_score',
+        'max_written_score', 'max_task_score'],
+    'submitted_notebook': [
+        'score', 'code_score', 'written_score', 'task_score'],
+    'submitted_assignment': [
+        'score', 'code_score', 'written_score', 'task_score',
+        'late_submission_penalty'],
+}
+
+
+def _table(name, *columns):
+    return sa.table(name, *[sa.column(x) for x in columns])
+
+
+def _sum(column, *where):
+    return sa.select([sa.func.coalesce(sa.func.sum(column), 0.0)])\
+        .where(sa.and_(*where)).as_scalar()
+
+
+def upgrade():
+    """
+    Add a column for each score that used to be computed whenever it was
+    loaded, and fill them in with the current scores.
+    """
+    for table, columns in sorted(AGGREGATES.items()):
+        with op.batch_alter_table(table) as batch_op:
+            for column in columns:
+                batch_op.add_column(sa.Column(
+                    column, sa.Float(), nullable=False, server_default='0'))
+
+    connection = op.get_bind()
+    base_cell = _table('base_cell', 'id', 'notebook_id')
+    grade_cells = _table('grade_cells', 'id', 'max_score', 'cell_type')
+    task_cells = _table('task_cells', 'id', 'max_score', 'cell_type')
+    notebook = _table('notebook', 'id', 'assignment_id', *AGGREGATES['notebook'])
+    assignment = _table('assignment', 'id', *AGGREGATES['assignment'])
+    submitted_notebook = _table(
+        'submitted_notebook', 'id', 'assignment_id', 'late_submission_penalty',
+        *AGGREGATES['submitted_notebook'])
+    submitted_assignment = _table(
+        'submitted_assignment', 'id', *AGGREGATES['submitted_assignment'])
+    grade = _table(
+        'grade', 'notebook_id', 'cell_id', 'auto_score', 'manual_score',
+        'extra_credit')
+
+    # databases created before task cells were added do not have the
+    # task_cells table until it is created by the gradebook, in which case
+    # there are no task cells to count
+    has_task_cells = 'task_cells' in sa.inspect(connection).get_table_names()
+
+    def max_score(cell, cell_type=None):
+        if cell is task_cells and not has_task_cells:
+            return 0.0
+        where = [cell.c.id == base_cell.c.id, base_cell.c.notebook_id == notebook.c.id]
+        if cell_type is not None:
+            where.append(cell.c.cell_type == cell_type)
+        return _sum(cell.c.max_score, *where)
+
+    connection.execute(notebook.update().values(
+        max_score_gradecell=max_score(grade_cells),
+        max_score_taskcell=max_score(task_cells),
+        max_code_score=max_score(grade_cells, 'code'),
+        max_written_score=max_score(grade_cells, 'markdown'),
+        max_task_score=max_score(task_cells, 'markdown')))
+
+    connection.execute(assignment.update().values(**dict(
+        (x, _sum(notebook.c[x], notebook.c.assignment_id == assignment.c.id))
+        for x in AGGREGATES['assignment'])))
+
+    # the same as the score of a grade in the gradebook: the manual score if
+    # there is one, otherwise the automatic score, plus any extra credit
+    extra_credit = sa.func.coalesce(grade.c.extra_credit, 0.0)
+    score = sa.case([
+        (grade.c.manual_score != None, grade.c.manual_score + extra_credit),
+        (grade.c.auto_score != None, grade.c.auto_score + extra_credit)],
+        else_=0.0)
+
+    def grade_score(cell=None, cell_type=None):
+        if cell is task_cells and not has_task_cells:
+            return 0.0
+        where = [grade.c.notebook_id == submitted_notebook.c.id]
+        if cell is not None:
+            where.extend([cell.c.id == grade.c.cell_id, cell.c.cell_type == cell_type])
+        return _sum(score, *where)
+
+    connection.execute(submitted_notebook.update().values(
+        score=grade_score(),
+        code_score=grade_score(grade_cells, 'code'),
+        written_score=grade_score(grade_cells, 'markdown'),
+        task_score=grade_score(task_cells, 'markdown')))
+
+    connection.execute(submitted_assignment.update().values(**dict(
+        (x, _sum(submitted_notebook.c[x],
+                 submitted_notebook.c.assignment_id == submitted_assignment.c.id))
+        for x in AGGREGATES['submitted_assignment'])))
+
+
+def downgrade():
+    for table, columns in sorted(AGGREGATES.items()):
+        with op.batch_alter_table(table) as batch_op:
+            for column in columns:
+                batch_op.drop_column(column)
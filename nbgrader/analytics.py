@@ -0,0 +1,323 @@
+"""Statistics about the grades of an assignment: score distributions of the
+assignment, its notebooks and its cells, and item statistics (difficulty and
+discrimination) of the cells.
+
+All statistics are computed with NumPy over a matrix of scores with one row
+per submission and one column per grade or task cell, which is loaded from
+the gradebook with a single query.
+
+"""
+
+import numpy as np
+
+from sqlalchemy import func
+
+from .api import (Grade, GradeCell, TaskCell, BaseCell, Notebook, Assignment,
+                  SubmittedNotebook, SubmittedAssignment)
+
+#: The percentiles that are computed by default
+DEFAULT_PERCENTILES = (0, 10, 25, 50, 75, 90, 100)
+
+
+class GradeTable(object):
+    """The scores of all submissions of an assignment.
+
+    Attributes
+    ----------
+    assignment : string
+        the name of the assignment
+    students : numpy array of strings
+        the ids of the students who submitted the assignment, one per row of
+        ``scores``
+    notebooks : numpy array of strings
+        the names of the notebooks of the assignment
+    cells : numpy array of strings
+        the names of the grade and task cells, one per column of ``scores``
+    cell_notebooks : numpy array of integers
+        the index (in ``notebooks``) of the notebook of each cell
+    max_scores : numpy array of floats
+        the maximum score of each cell
+    scores : 2D numpy array of floats
+        the score of each student (rows) on each cell (columns)
+
+    """
+
+    def __init__(self, assignment, students, notebooks, cells, cell_notebooks,
+                 max_scores, scores):
+        self.assignment = assignment
+        self.students = students
+        self.notebooks = notebooks
+        self.cells = cells
+        self.cell_notebooks = cell_notebooks
+        self.max_scores = max_scores
+        self.scores = scores
+
+    @property
+    def notebook_membership(self):
+        """A matrix with one row per cell and one column per notebook, which
+        is 1 where the cell belongs to the notebook and 0 otherwise. The
+        notebook scores are the product of the scores and this matrix."""
+        membership = np.zeros((len(self.cells), len(self.notebooks)))
+        membership[np.arange(len(self.cells)), self.cell_notebooks] = 1
+        return membership
+
+    @property
+    def notebook_scores(self):
+        """The score of each student (rows) on each notebook (columns)."""
+        return self.scores.dot(self.notebook_membership)
+
+    @property
+    def notebook_max_scores(self):
+        """The maximum score of each notebook."""
+        return self.max_scores.dot(self.notebook_membership)
+
+    @property
+    def total_scores(self):
+        """The score of each student on the whole assignment."""
+        return self.scores.sum(axis=1)
+
+
+def load_grades(gradebook, assignment_id):
+    """Load the scores of all submissions of an assignment into a
+    :class:`~nbgrader.analytics.GradeTable`, with one query.
+
+    Parameters
+    ----------
+    gradebook : :class:`~nbgrader.api.Gradebook`
+        the gradebook
+    assignment_id : string
+        the name of the assignment
+
+    Returns
+    -------
+    grades : :class:`~nbgrader.analytics.GradeTable`
+
+    """
+    # raises MissingEntry if the assignment does not exist
+    gradebook.find_assignment(assignment_id)
+
+    grade_cells = GradeCell.__table__.alias()
+    task_cells = TaskCell.__table__.alias()
+    query = gradebook.db.query(
+        SubmittedAssignment.student_id, Grade.cell_id, Notebook.name, BaseCell.name,
+        func.coalesce(grade_cells.c.max_score, task_cells.c.max_score, 0.0),
+        Grade.score
+    ).select_from(Grade)\
+     .join(SubmittedNotebook, SubmittedNotebook.id == Grade.notebook_id)\
+     .join(SubmittedAssignment, SubmittedAssignment.id == SubmittedNotebook.assignment_id)\
+     .join(BaseCell, BaseCell.id == Grade.cell_id)\
+     .join(Notebook, Notebook.id == BaseCell.notebook_id)\
+     .join(Assignment, Assignment.id == Notebook.assignment_id)\
+     .outerjoin(grade_cells, grade_cells.c.id == Grade.cell_id)\
+     .outerjoin(task_cells, task_cells.c.id == Grade.cell_id)\
+     .filter(Assignment.name == assignment_id)
+
+    # the rows are plain values, so they are fetched without going through
+    # the ORM, which would take longer than everything else together
+    rows = gradebook.db.execute(query.statement).fetchall()
+    if rows:
+        students, cell_ids, notebook_names, cell_names, max_scores, scores = zip(*rows)
+    else:
+        students = cell_ids = notebook_names = cell_names = max_scores = scores = ()
+
+    students, student_index = np.unique(np.array(students, dtype=object), return_inverse=True)
+    _, first, cell_index = np.unique(
+        np.array(cell_ids, dtype=object), return_index=True, return_inverse=True)
+
+    # sort the cells by notebook and name
+    cell_notebooks = np.array(notebook_names, dtype=object)[first]
+    cells = np.array(cell_names, dtype=object)[first]
+    order = np.lexsort((cells.astype(str), cell_notebooks.astype(str)))
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+    notebooks, cell_notebooks = np.unique(cell_notebooks[order], return_inverse=True)
+
+    score_matrix = np.zeros((len(students), len(first)))
+    score_matrix[student_index, position[cell_index]] = np.array(scores, dtype=float)
+
+    return GradeTable(
+        assignment=assignment_id,
+        students=students.astype(str),
+        notebooks=notebooks.astype(str),
+        cells=cells[order].astype(str),
+        cell_notebooks=np.asarray(cell_notebooks, dtype=int),
+        max_scores=np.array(max_scores, dtype=float)[first][order],
+        scores=score_matrix)
+
+
+def describe(scores, max_scores, bins=10, percentiles=DEFAULT_PERCENTILES):
+    """Compute the distribution of each column of a score matrix.
+
+    Parameters
+    ----------
+    scores : 2D numpy array
+        the scores, with one row per student and one column per item
+    max_scores : numpy array
+        the maximum score of each item
+    bins : integer
+        the number of (equally wide) histogram bins between zero and the
+        maximum score of each item; scores outside this range (e.g. because of
+        extra credit) are counted in the first or last bin
+    percentiles : sequence of numbers
+        the percentiles to compute
+
+    Returns
+    -------
+    stats : dict
+        A dictionary of arrays with one entry per item: ``mean``, ``std``,
+        ``min``, ``max``, ``percentiles`` (with one row per percentile) and
+        ``histogram`` (with one row per item and one column per bin)
+
+    """
+    num_students, num_items = scores.shape
+    if num_students == 0:
+        nan = np.full(num_items, np.nan)
+        return {
+            "mean": nan, "std": nan, "min": nan, "max": nan,
+            "percentiles": np.full((len(percentiles), num_items), np.nan),
+            "histogram": np.zeros((num_items, bins), dtype=int)
+        }
+
+    # bin all items at once: the bin of every score, offset by the item it
+    # belongs to, is counted with a single bincount
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fractions = np.where(max_scores > 0, scores / max_scores, 0.0)
+    bin_index = np.clip(np.floor(fractions * bins).astype(int), 0, bins - 1)
+    bin_index += np.arange(num_items) * bins
+    histogram = np.bincount(bin_index.ravel(), minlength=num_items * bins)
+
+    return {
+        "mean": scores.mean(axis=0),
+        "std": scores.std(axis=0),
+        "min": scores.min(axis=0),
+        "max": scores.max(axis=0),
+        "percentiles": np.percentile(scores, percentiles, axis=0),
+        "histogram": histogram.reshape(num_items, bins)
+    }
+
+
+def item_statistics(scores, max_scores):
+    """Compute the difficulty and discrimination of each item (column) of a
+    score matrix.
+
+    The difficulty of an item is its average score as a fraction of its
+    maximum score, so easy items have a high difficulty index. Its
+    discrimination is the point-biserial correlation between the scores on
+    the item and the total scores on all other items. For items that are not
+    scored right/wrong, this is the corresponding Pearson correlation.
+
+    Parameters
+    ----------
+    scores : 2D numpy array
+        the scores, with one row per student and one column per item
+    max_scores : numpy array
+        the maximum score of each item
+
+    Returns
+    -------
+    stats : dict
+        A dictionary of arrays with one entry per item: ``difficulty`` and
+        ``point_biserial``. Both are NaN where they are undefined, e.g. when
+        all students have the same score.
+
+    """
+    num_students, num_items = scores.shape
+    if num_students == 0:
+        nan = np.full(num_items, np.nan)
+        return {"difficulty": nan, "point_biserial": nan}
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        difficulty = np.where(
+            max_scores > 0, scores.mean(axis=0) / max_scores, np.nan)
+
+        rest = scores.sum(axis=1)[:, np.newaxis] - scores
+        item_dev = scores - scores.mean(axis=0)
+        rest_dev = rest - rest.mean(axis=0)
+        point_biserial = (item_dev * rest_dev).sum(axis=0) / np.sqrt(
+            (item_dev ** 2).sum(axis=0) * (rest_dev ** 2).sum(axis=0))
+
+    point_biserial[~np.isfinite(point_biserial)] = np.nan
+    return {"difficulty": difficulty, "point_biserial": point_biserial}
+
+
+def _to_list(values):
+    # NaN is not valid JSON, so undefined statistics become None
+    return [None if np.isnan(x) else float(x) for x in values]
+
+
+def _distributions(names, scores, max_scores, bins, percentiles):
+    stats = describe(scores, max_scores, bins=bins, percentiles=percentiles)
+    mean = _to_list(stats["mean"])
+    std = _to_list(stats["std"])
+    minimum = _to_list(stats["min"])
+    maximum = _to_list(stats["max"])
+    keys = [str(p) for p in percentiles]
+
+    distributions = []
+    for i, name in enumerate(names):
+        distributions.append({
+            "name": str(name),
+            "max_score": float(max_scores[i]),
+            "mean": mean[i],
+            "std": std[i],
+            "min": minimum[i],
+            "max": maximum[i],
+            "percentiles": dict(zip(keys, _to_list(stats["percentiles"][:, i]))),
+            "histogram": {
+                "counts": [int(x) for x in stats["histogram"][i]],
+                "edges": [float(x) for x in np.linspace(0, max_scores[i], bins + 1)]
+            }
+        })
+    return distributions
+
+
+def assignment_analytics(gradebook, assignment_id, bins=10, percentiles=DEFAULT_PERCENTILES):
+    """Compute the score distributions of an assignment, its notebooks and
+    its cells, as well as the item statistics of its cells.
+
+    Parameters
+    ----------
+    gradebook : :class:`~nbgrader.api.Gradebook`
+        the gradebook
+    assignment_id : string
+        the name of the assignment
+    bins : integer
+        the number of histogram bins
+    percentiles : sequence of numbers
+        the percentiles to compute
+
+    Returns
+    -------
+    analytics : dict
+        A JSON-friendly dictionary with the ``assignment``,
+        ``num_submissions`` and the distributions of the ``total`` scores,
+        the ``notebooks`` and the ``cells``. The distribution of each cell
+        also includes its ``notebook``, ``difficulty`` and ``point_biserial``.
+
+    """
+    grades = load_grades(gradebook, assignment_id)
+
+    total, = _distributions(
+        [assignment_id], grades.total_scores[:, np.newaxis],
+        np.array([grades.max_scores.sum()]), bins, percentiles)
+    notebooks = _distributions(
+        grades.notebooks, grades.notebook_scores, grades.notebook_max_scores,
+        bins, percentiles)
+    cells = _distributions(
+        grades.cells, grades.scores, grades.max_scores, bins, percentiles)
+
+    items = item_statistics(grades.scores, grades.max_scores)
+    difficulty = _to_list(items["difficulty"])
+    point_biserial = _to_list(items["point_biserial"])
+    for i, cell in enumerate(cells):
+        cell["notebook"] = str(grades.notebooks[grades.cell_notebooks[i]])
+        cell["difficulty"] = difficulty[i]
+        cell["point_biserial"] = point_biserial[i]
+
+    return {
+        "assignment": assignment_id,
+        "num_submissions": len(grades.students),
+        "total": total,
+        "notebooks": notebooks,
+        "cells": cells
+    }
@@ -2,23 +2,37 @@ from __future__ import division
 
 from . import utils
 
+import os
+import six
 import datetime
+import binascii
+import itertools
+import threading
+import contextlib
 import subprocess as sp
 
 from sqlalchemy import (create_engine, ForeignKey, Column, String, Text,
-                        DateTime, Interval, Float, Enum, UniqueConstraint,
-                        Boolean)
+                        DateTime, Interval, Float, Integer, Enum, UniqueConstraint,
+                        Index, Boolean, MetaData, Table, event, inspect)
 from sqlalchemy.orm import (sessionmaker, scoped_session, relationship,
-                            column_property, aliased)
+                            column_property)
 from sqlalchemy.orm.exc import NoResultFound, FlushError
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.orm.util import identity_key
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.sql import and_, or_
-from sqlalchemy import select, func, exists, case, literal_column, union_all
+from sqlalchemy import select, func, exists, case, literal_column, bindparam, true
+from sqlalchemy.util import LRUCache
 from sqlalchemy.ext.declarative import declared_attr
 from uuid import uuid4
 from .dbutil import _temp_alembic_ini
+# defined with the other helpers, so that the course directory can build
+# its settings without importing the database models
+from .utils import sqlite_concurrency_pragmas
 
 Base = declarative_base()
 
@@ -34,6 +48,31 @@ def get_alembic_version():
         return head
 
 
+class QueryCounter(object):
+    """Context manager counting the SQL statements that the current thread
+    executes on a database engine. Only statements executed while the context
+    manager is active are counted.
+
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self._thread = None
+
+    def _before_cursor_execute(self, *args, **kwargs):
+        if threading.current_thread() is self._thread:
+            self.count += 1
+
+    def __enter__(self):
+        self._thread = threading.current_thread()
+        event.listen(self.engine, "before_cursor_execute", self._before_cursor_execute)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event.remove(self.engine, "before_cursor_execute", self._before_cursor_execute)
+
+
 class InvalidEntry(ValueError):
     pass
 
@@ -201,7 +240,9 @@ class BaseCell(Base):
     """Database representation of a cell. It is meant as a base class for cells where additional behavior is added through mixin classes."""
 
     __tablename__ = "base_cell"
-    __table_args__ = (UniqueConstraint('name', 'notebook_id', 'type'),)
+    __table_args__ = (
+        UniqueConstraint('name', 'notebook_id', 'type'),
+        Index('ix_base_cell_notebook_id', 'notebook_id'))
 
     #: Unique id of the grade cell (automatically generated)
     id = Column(String(32), primary_key=True, default=new_uuid)
@@ -489,7 +530,9 @@ class SubmittedAssignment(Base):
     """Database representation of an assignment submitted by a student."""
 
     __tablename__ = "submitted_assignment"
-    __table_args__ = (UniqueConstraint('assignment_id', 'student_id'),)
+    __table_args__ = (
+        UniqueConstraint('assignment_id', 'student_id'),
+        Index('ix_submitted_assignment_student_id', 'student_id'))
 
     #: Unique id of the submitted assignment (automatically generated)
     id = Column(String(32), primary_key=True, default=new_uuid)
@@ -626,7 +669,9 @@ class SubmittedNotebook(Base):
     """Database representation of a notebook submitted by a student."""
 
     __tablename__ = "submitted_notebook"
-    __table_args__ = (UniqueConstraint('notebook_id', 'assignment_id'),)
+    __table_args__ = (
+        UniqueConstraint('notebook_id', 'assignment_id'),
+        Index('ix_submitted_notebook_assignment_id', 'assignment_id'))
 
     #: Unique id of the submitted notebook (automatically generated)
     id = Column(String(32), primary_key=True, default=new_uuid)
@@ -741,7 +786,9 @@ class Grade(Base):
     """
 
     __tablename__ = "grade"
-    __table_args__ = (UniqueConstraint('cell_id', 'notebook_id'),)
+    __table_args__ = (
+        UniqueConstraint('cell_id', 'notebook_id'),
+        Index('ix_grade_notebook_id', 'notebook_id'))
 
     #: Unique id of the grade (automatically generated)
     id = Column(String(32), primary_key=True, default=new_uuid)
@@ -875,7 +922,9 @@ class Comment(Base):
     """Database representation of a comment on a cell in a submitted notebook."""
 
     __tablename__ = "comment"
-    __table_args__ = (UniqueConstraint('cell_id', 'notebook_id'),)
+    __table_args__ = (
+        UniqueConstraint('cell_id', 'notebook_id'),
+        Index('ix_comment_notebook_id', 'notebook_id'))
 
     #: Unique id of the comment (automatically generated)
     id = Column(String(32), primary_key=True, default=new_uuid)
@@ -985,6 +1034,30 @@ class Course(Base):
     def __repr__(self):
         return "Course<{}>".format(self.id)
 
+
+class GradebookVersion(Base):
+    """Table with a single row holding a counter that is incremented after
+    anything in the gradebook was changed, unless the gradebook is stored in
+    SQLite (see :func:`~nbgrader.api.Gradebook.version`)."""
+
+    __tablename__ = "gradebook_version"
+
+    id = Column(Integer(), primary_key=True, autoincrement=False)
+    version = Column(Integer(), nullable=False, default=0)
+
+
+@event.listens_for(GradebookVersion.__table__, "after_create")
+def _create_gradebook_version(table, connection, **kwargs):
+    connection.execute(table.insert().values(id=1, version=0))
+
+
+def bump_gradebook_version(connection):
+    """Increment the change counter of the gradebook, which is part of its
+    version for databases other than SQLite (see
+    :func:`~nbgrader.api.Gradebook.version`)."""
+    table = GradebookVersion.__table__
+    connection.execute(table.update().values(version=table.c.version + 1))
+
 ## Needs manual grade
 
 SubmittedNotebook.needs_manual_grade = column_property(
@@ -1008,264 +1081,457 @@ Notebook.needs_manual_grade = column_property(
     .correlate_except(Grade), deferred=True)
 
 
-# Overall scores
+# Score aggregates
+#
+# The total scores of submitted notebooks and assignments, and the maximum
+# scores of notebooks and assignments, are stored in the database rather
+# than computed by correlated subqueries whenever they are loaded. They are
+# updated after every flush that changes grades, cells, notebooks or late
+# penalties (see _update_score_aggregates below), and can be checked and
+# rebuilt with Gradebook.check_score_aggregates and
+# Gradebook.rebuild_score_aggregates.
 
-SubmittedNotebook.score = column_property(
-    select([func.coalesce(func.sum(Grade.score), 0.0)])
-    .where(Grade.notebook_id == SubmittedNotebook.id)
-    .correlate_except(Grade), deferred=True)
+def _aggregate_column():
+    return Column(Float(), nullable=False, default=0.0, server_default="0")
 
-SubmittedAssignment.score = column_property(
-    select([func.coalesce(func.sum(Grade.score), 0.0)])
-    .where(and_(
-        SubmittedNotebook.assignment_id == SubmittedAssignment.id,
-        Grade.notebook_id == SubmittedNotebook.id))
-    .correlate_except(Grade), deferred=True)
 
-Student.score = column_property(
-    select([func.coalesce(func.sum(Grade.score), 0.0)])
-    .where(and_(
-        SubmittedAssignment.student_id == Student.id,
-        SubmittedNotebook.assignment_id == SubmittedAssignment.id,
-        Grade.notebook_id == SubmittedNotebook.id))
-    .correlate_except(Grade), deferred=True)
+Notebook.max_score_gradecell = _aggregate_column()
+Notebook.max_score_taskcell = _aggregate_column()
+Notebook.max_code_score = _aggregate_column()
+Notebook.max_written_score = _aggregate_column()
+Notebook.max_task_score = _aggregate_column()
+Notebook.max_score = column_property(
+    Notebook.max_score_gradecell + Notebook.max_score_taskcell)
 
+Assignment.max_score_gradecell = _aggregate_column()
+Assignment.max_score_taskcell = _aggregate_column()
+Assignment.max_code_score = _aggregate_column()
+Assignment.max_written_score = _aggregate_column()
+Assignment.max_task_score = _aggregate_column()
+Assignment.max_score = column_property(
+    Assignment.max_score_gradecell + Assignment.max_score_taskcell)
 
-# Overall max scores
+SubmittedNotebook.score = _aggregate_column()
+SubmittedNotebook.code_score = _aggregate_column()
+SubmittedNotebook.written_score = _aggregate_column()
+SubmittedNotebook.task_score = _aggregate_column()
 
-Grade.max_score_gradecell = column_property(
-    select([func.coalesce(GradeCell.max_score, 0.0)])
-    .select_from(GradeCell)
-    .where(Grade.cell_id == GradeCell.id)
-    .correlate_except(GradeCell), deferred=True)
+SubmittedAssignment.score = _aggregate_column()
+SubmittedAssignment.code_score = _aggregate_column()
+SubmittedAssignment.written_score = _aggregate_column()
+SubmittedAssignment.task_score = _aggregate_column()
+SubmittedAssignment.late_submission_penalty = _aggregate_column()
 
-Grade.max_score_taskcell = column_property(
-    select([func.coalesce(TaskCell.max_score, 0.0)])
-    .select_from(TaskCell)
-    .where(Grade.cell_id == TaskCell.id)
-    .correlate_except(TaskCell), deferred=True)
-# a grade is either from a grade cell or a task cell , so only one will not be none
-Grade.max_score = column_property(func.coalesce(Grade.max_score_gradecell, Grade.max_score_taskcell, 0.0), deferred=True)
 
-# try defining the cell_type_**** as athe result of a search as for the max_score
-# and not through the relationship
+def _sum_of(column, *where):
+    return select([func.coalesce(func.sum(column), 0.0)]).where(and_(*where)).as_scalar()
 
-Grade.cell_type_from_taskcell = column_property(
-    select([TaskCell.cell_type])
-    .select_from(TaskCell)
-    .where(Grade.cell_id == TaskCell.id)
-    .correlate_except(TaskCell), deferred=True)
 
-Grade.cell_type_from_gradecell = column_property(
-    select([GradeCell.cell_type])
-    .select_from(GradeCell)
-    .where(Grade.cell_id == GradeCell.id)
-    .correlate_except(GradeCell), deferred=True)
+def _max_score_of(cell, *where):
+    return select([func.coalesce(func.sum(cell.max_score), 0.0)])\
+        .select_from(cell)\
+        .where(and_(cell.notebook_id == Notebook.id, *where))\
+        .as_scalar()
 
-Grade.cell_type = column_property(
-    select([func.coalesce(Grade.cell_type_from_gradecell, Grade.cell_type_from_taskcell)])
-)
 
+def _notebook_aggregates():
+    return {
+        "max_score_gradecell": _max_score_of(GradeCell),
+        "max_score_taskcell": _max_score_of(TaskCell),
+        "max_code_score": _max_score_of(GradeCell, GradeCell.cell_type == "code"),
+        "max_written_score": _max_score_of(GradeCell, GradeCell.cell_type == "markdown"),
+        "max_task_score": _max_score_of(TaskCell, TaskCell.cell_type == "markdown"),
+    }
 
-Notebook.max_score_gradecell = column_property(
-    select([func.coalesce(func.sum(GradeCell.max_score), 0.0)])
-        .select_from(GradeCell)
-        .where(GradeCell.notebook_id == Notebook.id)
-        .correlate_except(GradeCell), deferred=True)
 
-Notebook.max_score_taskcell = column_property(
-    select([func.coalesce(func.sum(TaskCell.max_score), 0.0)])
-        .select_from(TaskCell)
-        .where(TaskCell.notebook_id == Notebook.id)
-        .correlate_except(TaskCell), deferred=True)
+def _assignment_aggregates():
+    return {
+        name: _sum_of(getattr(Notebook, name), Notebook.assignment_id == Assignment.id)
+        for name in _notebook_aggregates()
+    }
 
-Notebook.max_score = column_property(
-    Notebook.max_score_gradecell + Notebook.max_score_taskcell
-)
 
-SubmittedNotebook.max_score = column_property(
-    select([Notebook.max_score])
-    .where(SubmittedNotebook.notebook_id == Notebook.id)
-    .correlate_except(Notebook), deferred=True)
+def _submitted_notebook_aggregates():
+    return {
+        "score": _sum_of(
+            Grade.score,
+            Grade.notebook_id == SubmittedNotebook.id),
+        "code_score": _sum_of(
+            Grade.score,
+            Grade.notebook_id == SubmittedNotebook.id,
+            GradeCell.id == Grade.cell_id,
+            GradeCell.cell_type == "code"),
+        "written_score": _sum_of(
+            Grade.score,
+            Grade.notebook_id == SubmittedNotebook.id,
+            GradeCell.id == Grade.cell_id,
+            GradeCell.cell_type == "markdown"),
+        "task_score": _sum_of(
+            Grade.score,
+            Grade.notebook_id == SubmittedNotebook.id,
+            TaskCell.id == Grade.cell_id,
+            TaskCell.cell_type == "markdown"),
+    }
 
-Assignment.max_score_gradecell = column_property(
-    select([func.coalesce(func.sum(GradeCell.max_score), 0.0)])
-    .select_from(GradeCell)
-    .where(and_(
-        Notebook.assignment_id == Assignment.id,
-        GradeCell.notebook_id == Notebook.id))
-    .correlate_except(GradeCell), deferred=True)
 
-Assignment.max_score_taskcell = column_property(
-    select([func.coalesce(func.sum(TaskCell.max_score), 0.0)])
-    .select_from(TaskCell)
-    .where(and_(
-        Notebook.assignment_id == Assignment.id,
-        TaskCell.notebook_id == Notebook.id))
-    .correlate_except(TaskCell), deferred=True)
+def _submitted_assignment_aggregates():
+    aggregates = {
+        name: _sum_of(
+            getattr(SubmittedNotebook, name),
+            SubmittedNotebook.assignment_id == SubmittedAssignment.id)
+        for name in _submitted_notebook_aggregates()
+    }
+    aggregates["late_submission_penalty"] = _sum_of(
+        SubmittedNotebook.late_submission_penalty,
+        SubmittedNotebook.assignment_id == SubmittedAssignment.id)
+    return aggregates
+
+
+# The aggregates of each model, in the order in which they need to be
+# updated (the aggregates of assignments are computed from the aggregates of
+# their notebooks).
+_score_aggregates = [
+    (Notebook, _notebook_aggregates),
+    (SubmittedNotebook, _submitted_notebook_aggregates),
+    (Assignment, _assignment_aggregates),
+    (SubmittedAssignment, _submitted_assignment_aggregates),
+]
+
+_score_aggregate_names = dict(
+    (model, sorted(aggregates())) for model, aggregates in _score_aggregates)
+
+# maximum number of ids per "IN" clause, to stay below SQLite's limit on the
+# number of variables in a statement
+_max_ids_per_statement = 500
+
+# The statements updating the aggregates are run after almost every flush,
+# so they are only built (and compiled) once.
+_aggregate_statements = {}
+_compiled_cache = LRUCache(100)
+
+
+def _chunks(ids):
+    ids = sorted(ids)
+    for i in range(0, len(ids), _max_ids_per_statement):
+        yield ids[i:i + _max_ids_per_statement]
+
+
+def _select_ids(connection, column, where_column, ids):
+    key = (column, where_column)
+    if key not in _aggregate_statements:
+        _aggregate_statements[key] = select([column])\
+            .where(where_column.in_(bindparam("ids", expanding=True)))
+    stmt = _aggregate_statements[key]
+
+    result = set()
+    connection = connection.execution_options(compiled_cache=_compiled_cache)
+    for chunk in _chunks(ids):
+        result.update(x for x, in connection.execute(stmt, ids=chunk))
+    result.discard(None)
+    return result
+
+
+def _ids_clause(stack, session, ids):
+    """The values of an ``IN`` clause with the given ids. If there are more
+    ids than fit in one statement, they are inserted in chunks into a
+    temporary table (which only exists on the connection of the session, and
+    is dropped again when `stack` is closed), and the clause selects them
+    from it.
 
-Assignment.max_score = column_property(
-    Assignment.max_score_gradecell + Assignment.max_score_taskcell
-)
+    """
+    ids = set(ids)
+    if len(ids) <= _max_ids_per_statement:
+        return sorted(ids)
 
+    connection = session.connection()
+    table = Table(
+        "nbgrader_ids_{}".format(uuid4().hex), MetaData(),
+        Column("id", String(128), primary_key=True),
+        prefixes=["TEMPORARY"])
+    table.create(connection)
 
-SubmittedAssignment.max_score = column_property(
-    select([Assignment.max_score])
-    .where(SubmittedAssignment.assignment_id == Assignment.id)
-    .correlate_except(Assignment), deferred=True)
+    def drop():
+        # the session may have been closed already, e.g. if a generator
+        # using the table is only closed when it is garbage collected
+        if not connection.closed:
+            table.drop(connection)
 
-Student.max_score = column_property(
-    select([func.coalesce(func.sum(Assignment.max_score), 0.0)])
-    .correlate_except(Assignment), deferred=True)
+    stack.callback(drop)
+    for chunk in _chunks(ids):
+        connection.execute(table.insert(), [{"id": x} for x in chunk])
+    return select([table.c.id])
 
 
-# Written scores
+def _update_aggregates(connection, model, aggregates, ids=None):
+    table = model.__table__
+    if ids is None:
+        connection.execute(table.update().values(**aggregates()))
+        return
 
-SubmittedNotebook.written_score = column_property(
-    select([func.coalesce(func.sum(Grade.score), 0.0)])
-    .where(and_(
-        Grade.notebook_id == SubmittedNotebook.id,
-        GradeCell.id == Grade.cell_id,
-        GradeCell.cell_type == "markdown"))
-    .correlate_except(Grade), deferred=True)
+    if model not in _aggregate_statements:
+        _aggregate_statements[model] = table.update()\
+            .where(table.c.id.in_(bindparam("ids", expanding=True)))\
+            .values(**aggregates())
+    stmt = _aggregate_statements[model]
 
-SubmittedAssignment.written_score = column_property(
-    select([func.coalesce(func.sum(Grade.score), 0.0)])
-    .where(and_(
-        SubmittedNotebook.assignment_id == SubmittedAssignment.id,
-        Grade.notebook_id == SubmittedNotebook.id,
-        GradeCell.id == Grade.cell_id,
-        GradeCell.cell_type == "markdown"))
-    .correlate_except(Grade), deferred=True)
+    connection = connection.execution_options(compiled_cache=_compiled_cache)
+    for chunk in _chunks(ids):
+        connection.execute(stmt, ids=chunk)
 
 
-# Written max scores
+def rebuild_score_aggregates(connection):
+    """Recompute all the stored scores and maximum scores."""
+    for model, aggregates in _score_aggregates:
+        _update_aggregates(connection, model, aggregates)
 
-Notebook.max_written_score = column_property(
-    select([func.coalesce(func.sum(GradeCell.max_score), 0.0)])
-    .select_from(GradeCell)
-    .where(and_(
-        GradeCell.notebook_id == Notebook.id,
-        GradeCell.cell_type == "markdown"))
-    .correlate_except(GradeCell), deferred=True)
 
-SubmittedNotebook.max_written_score = column_property(
-    select([Notebook.max_written_score])
-    .where(Notebook.id == SubmittedNotebook.notebook_id)
-    .correlate_except(Notebook), deferred=True)
+def check_score_aggregates(connection):
+    """Compare the stored scores and maximum scores with the scores computed
+    from the grades and cells, and return a list of ``(table, id, column,
+    stored value, computed value)`` tuples for the ones that differ.
 
-Assignment.max_written_score = column_property(
-    select([func.coalesce(func.sum(GradeCell.max_score), 0.0)])
-    .select_from(GradeCell)
-    .where(and_(
-        Notebook.assignment_id == Assignment.id,
-        GradeCell.notebook_id == Notebook.id,
-        GradeCell.cell_type == "markdown"))
-    .correlate_except(GradeCell), deferred=True)
+    """
+    errors = []
+    for model, aggregates in _score_aggregates:
+        table = model.__table__
+        aggregates = aggregates()
+        names = sorted(aggregates)
+        rows = connection.execute(select(
+            [table.c.id] +
+            [table.c[name] for name in names] +
+            [aggregates[name].label("expected_" + name) for name in names]))
+        for row in rows:
+            for name in names:
+                stored = row[table.c[name]]
+                expected = row["expected_" + name]
+                if stored is None or abs(stored - expected) > 1e-9:
+                    errors.append((table.name, row[table.c.id], name, stored, expected))
+    return errors
+
+
+def _loaded_value(obj, key):
+    # don't trigger a lazy load from within the flush
+    return inspect(obj).dict.get(key, None)
+
+
+def _update_score_aggregates(session, flush_context):
+    """Update the score aggregates affected by the objects that were just
+    flushed.
 
-SubmittedAssignment.max_written_score = column_property(
-    select([Assignment.max_written_score])
-    .where(Assignment.id == SubmittedAssignment.assignment_id)
-    .correlate_except(Assignment), deferred=True)
+    """
+    notebooks = set()
+    notebook_submissions = set()
+    assignments = set()
+    submitted_notebooks = set()
+    submitted_assignments = set()
+
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Grade):
+            submitted_notebooks.add(_loaded_value(obj, "notebook_id"))
+        elif isinstance(obj, (GradeCell, TaskCell)):
+            notebooks.add(_loaded_value(obj, "notebook_id"))
+            # the code and written scores of submissions depend on the cell
+            # type as well
+            if obj not in session.dirty or get_history(obj, "cell_type").has_changes():
+                notebook_submissions.add(_loaded_value(obj, "notebook_id"))
+        elif isinstance(obj, SubmittedNotebook):
+            submitted_notebooks.add(_loaded_value(obj, "id"))
+            submitted_assignments.add(_loaded_value(obj, "assignment_id"))
+        elif isinstance(obj, Notebook):
+            notebooks.add(_loaded_value(obj, "id"))
+            assignments.add(_loaded_value(obj, "assignment_id"))
+        elif isinstance(obj, SubmittedAssignment):
+            submitted_assignments.add(_loaded_value(obj, "id"))
+        elif isinstance(obj, Assignment):
+            assignments.add(_loaded_value(obj, "id"))
+
+    for ids in (notebooks, notebook_submissions, submitted_notebooks):
+        ids.discard(None)
+    if not (notebooks or submitted_notebooks or assignments or submitted_assignments):
+        return
+
+    connection = session.connection()
+    if notebooks:
+        _update_aggregates(connection, Notebook, _notebook_aggregates, notebooks)
+        assignments.update(_select_ids(
+            connection, Notebook.assignment_id, Notebook.id, notebooks))
+    if notebook_submissions:
+        submitted_notebooks.update(_select_ids(
+            connection, SubmittedNotebook.id, SubmittedNotebook.notebook_id,
+            notebook_submissions))
+    if submitted_notebooks:
+        _update_aggregates(
+            connection, SubmittedNotebook, _submitted_notebook_aggregates,
+            submitted_notebooks)
+        submitted_assignments.update(_select_ids(
+            connection, SubmittedNotebook.assignment_id, SubmittedNotebook.id,
+            submitted_notebooks))
+
+    assignments.discard(None)
+    submitted_assignments.discard(None)
+    if assignments:
+        _update_aggregates(connection, Assignment, _assignment_aggregates, assignments)
+    if submitted_assignments:
+        _update_aggregates(
+            connection, SubmittedAssignment, _submitted_assignment_aggregates,
+            submitted_assignments)
+
+    session.info.setdefault("nbgrader_updated_aggregates", []).extend([
+        (Notebook, notebooks),
+        (SubmittedNotebook, submitted_notebooks),
+        (Assignment, assignments),
+        (SubmittedAssignment, submitted_assignments),
+    ])
+
+
+def _mark_gradebook_changed(session, flush_context=None):
+    """Remember that the session changed the gradebook if the flush changed
+    anything, so that its version changes once the session is committed (see
+    :func:`_count_gradebook_changes`).
 
+    """
+    changed = flush_context is None or session.new or session.deleted or any(
+        session.is_modified(obj) for obj in session.dirty)
+    if changed:
+        session.info["nbgrader_changed"] = True
 
-# Code scores
 
-SubmittedNotebook.code_score = column_property(
-    select([func.coalesce(func.sum(Grade.score), 0.0)])
-    .where(and_(
-        Grade.notebook_id == SubmittedNotebook.id,
-        GradeCell.id == Grade.cell_id,
-        GradeCell.cell_type == "code"))
-    .correlate_except(Grade), deferred=True)
+def _count_gradebook_changes(session):
+    """Change the version of the gradebook after a session that changed it
+    was committed.
+
+    """
+    if session.info.pop("nbgrader_changed", False):
+        engine = session.info.get("nbgrader_engine")
+        if engine is not None:
+            engine.count_change()
+
+
+def _forget_gradebook_changes(session):
+    session.info.pop("nbgrader_changed", None)
 
-SubmittedAssignment.code_score = column_property(
-    select([func.coalesce(func.sum(Grade.score), 0.0)])
-    .where(and_(
-        SubmittedNotebook.assignment_id == SubmittedAssignment.id,
-        Grade.notebook_id == SubmittedNotebook.id,
-        GradeCell.id == Grade.cell_id,
-        GradeCell.cell_type == "code"))
-    .correlate_except(Grade), deferred=True)
 
+def _expire_score_aggregates(session, flush_context):
+    """Make sure objects that are already loaded do not keep the scores they
+    had before they were updated by :func:`_update_score_aggregates`.
 
-# Code max scores
+    """
+    updated = session.info.pop("nbgrader_updated_aggregates", [])
+    if not updated:
+        return
+
+    for model, ids in updated:
+        names = _score_aggregate_names[model]
+        for id in ids:
+            obj = session.identity_map.get(identity_key(model, id))
+            if obj is not None:
+                session.expire(obj, names)
+
+
+def register_session_events(session_factory):
+    """Keep the stored score aggregates (and the version of the gradebook)
+    up to date in the sessions created by `session_factory` (a
+    :class:`sqlalchemy.orm.sessionmaker`). This is done for the sessions of
+    every :class:`~nbgrader.api.Gradebook`, so it is only needed for sessions
+    created in some other way.
+
+    """
+    event.listen(session_factory, "after_flush", _update_score_aggregates)
+    event.listen(session_factory, "after_flush", _mark_gradebook_changed)
+    event.listen(session_factory, "after_flush_postexec", _expire_score_aggregates)
+    event.listen(session_factory, "after_commit", _count_gradebook_changes)
+    event.listen(session_factory, "after_rollback", _forget_gradebook_changes)
 
-Notebook.max_code_score = column_property(
-    select([func.coalesce(func.sum(GradeCell.max_score), 0.0)])
-        .select_from(GradeCell)
-        .where(and_(
-            GradeCell.notebook_id == Notebook.id,
-            GradeCell.cell_type == "code"))
-        .correlate_except(GradeCell), deferred=True)
+
+# The maximum scores of submissions are looked up from their notebook or
+# assignment, which is cheap enough to always do when they are loaded.
+
+SubmittedNotebook.max_score = column_property(
+    select([Notebook.max_score])
+    .where(SubmittedNotebook.notebook_id == Notebook.id)
+    .correlate_except(Notebook))
 
 SubmittedNotebook.max_code_score = column_property(
     select([Notebook.max_code_score])
     .where(Notebook.id == SubmittedNotebook.notebook_id)
-    .correlate_except(Notebook), deferred=True)
+    .correlate_except(Notebook))
 
-Assignment.max_code_score = column_property(
-    select([func.coalesce(func.sum(GradeCell.max_score), 0.0)])
-    .select_from(GradeCell)
-    .where(and_(
-        Notebook.assignment_id == Assignment.id,
-        GradeCell.notebook_id == Notebook.id,
-        GradeCell.cell_type == "code"))
-    .correlate_except(GradeCell), deferred=True)
+SubmittedNotebook.max_written_score = column_property(
+    select([Notebook.max_written_score])
+    .where(Notebook.id == SubmittedNotebook.notebook_id)
+    .correlate_except(Notebook))
+
+SubmittedNotebook.max_task_score = column_property(
+    select([Notebook.max_task_score])
+    .where(Notebook.id == SubmittedNotebook.notebook_id)
+    .correlate_except(Notebook))
+
+SubmittedAssignment.max_score = column_property(
+    select([Assignment.max_score])
+    .where(SubmittedAssignment.assignment_id == Assignment.id)
+    .correlate_except(Assignment))
 
 SubmittedAssignment.max_code_score = column_property(
     select([Assignment.max_code_score])
     .where(Assignment.id == SubmittedAssignment.assignment_id)
-    .correlate_except(Assignment), deferred=True)
+    .correlate_except(Assignment))
 
-# task score
+SubmittedAssignment.max_written_score = column_property(
+    select([Assignment.max_written_score])
+    .where(Assignment.id == SubmittedAssignment.assignment_id)
+    .correlate_except(Assignment))
 
-SubmittedNotebook.task_score = column_property(
-    select([func.coalesce(func.sum(Grade.score), 0.0)])
-    .where(and_(
-        Grade.notebook_id == SubmittedNotebook.id,
-        TaskCell.id == Grade.cell_id,
-        TaskCell.cell_type == "markdown"))
-    .correlate_except(Grade), deferred=True)
+SubmittedAssignment.max_task_score = column_property(
+    select([Assignment.max_task_score])
+    .where(Assignment.id == SubmittedAssignment.assignment_id)
+    .correlate_except(Assignment))
+
+Student.score = column_property(
+    select([func.coalesce(func.sum(SubmittedAssignment.score), 0.0)])
+    .where(SubmittedAssignment.student_id == Student.id)
+    .correlate_except(SubmittedAssignment), deferred=True)
+
+Student.max_score = column_property(
+    select([func.coalesce(func.sum(Assignment.max_score), 0.0)])
+    .correlate_except(Assignment), deferred=True)
 
-SubmittedAssignment.task_score = column_property(
-    select([func.coalesce(func.sum(Grade.score), 0.0)])
-    .where(and_(
-        SubmittedNotebook.assignment_id == SubmittedAssignment.id,
-        Grade.notebook_id == SubmittedNotebook.id,
-        TaskCell.id == Grade.cell_id,
-        TaskCell.cell_type == "markdown"))
-    .correlate_except(Grade), deferred=True)
 
+# Max scores of grades
 
-# task max scores
+Grade.max_score_gradecell = column_property(
+    select([func.coalesce(GradeCell.max_score, 0.0)])
+    .select_from(GradeCell)
+    .where(Grade.cell_id == GradeCell.id)
+    .correlate_except(GradeCell), deferred=True)
 
-Notebook.max_task_score = column_property(
-    select([func.coalesce(func.sum(TaskCell.max_score), 0.0)])
+Grade.max_score_taskcell = column_property(
+    select([func.coalesce(TaskCell.max_score, 0.0)])
     .select_from(TaskCell)
-    .where(and_(
-        TaskCell.notebook_id == Notebook.id,
-        TaskCell.cell_type == "markdown"))
+    .where(Grade.cell_id == TaskCell.id)
     .correlate_except(TaskCell), deferred=True)
+# a grade is either from a grade cell or a task cell , so only one will not be none
+Grade.max_score = column_property(func.coalesce(Grade.max_score_gradecell, Grade.max_score_taskcell, 0.0), deferred=True)
 
-SubmittedNotebook.max_task_score = column_property(
-    select([Notebook.max_task_score])
-    .where(Notebook.id == SubmittedNotebook.notebook_id)
-    .correlate_except(Notebook), deferred=True)
+# try defining the cell_type_**** as athe result of a search as for the max_score
+# and not through the relationship
 
-Assignment.max_task_score = column_property(
-    select([func.coalesce(func.sum(TaskCell.max_score), 0.0)])
+Grade.cell_type_from_taskcell = column_property(
+    select([TaskCell.cell_type])
     .select_from(TaskCell)
-    .where(and_(
-        Notebook.assignment_id == Assignment.id,
-        TaskCell.notebook_id == Notebook.id,
-        TaskCell.cell_type == "markdown"))
+    .where(Grade.cell_id == TaskCell.id)
     .correlate_except(TaskCell), deferred=True)
 
-SubmittedAssignment.max_task_score = column_property(
-    select([func.coalesce(Assignment.max_task_score, 0.0)])
+Grade.cell_type_from_gradecell = column_property(
+    select([GradeCell.cell_type])
+    .select_from(GradeCell)
+    .where(Grade.cell_id == GradeCell.id)
+    .correlate_except(GradeCell), deferred=True)
+
+Grade.cell_type = column_property(
+    select([func.coalesce(Grade.cell_type_from_gradecell, Grade.cell_type_from_taskcell)])
 )
 
+
 # Number of submissions
 
 Assignment.num_submissions = column_property(
@@ -1307,12 +1573,264 @@ SubmittedNotebook.failed_tests = column_property(
     .correlate_except(Grade), deferred=True)
 
 
-# Late penalties
+class _DatabaseEngine(object):
+    """The engine and session factory shared by all gradebooks connecting to
+    the same database in this process.
 
-SubmittedAssignment.late_submission_penalty = column_property(
-    select([func.coalesce(func.sum(SubmittedNotebook.late_submission_penalty), 0.0)])
-    .where(SubmittedNotebook.assignment_id == SubmittedAssignment.id)
-    .correlate_except(SubmittedNotebook), deferred=True)
+    Connections to SQLite files are pooled as well (SQLAlchemy opens a new
+    connection for every session by default), so that sessions reuse open
+    connections and their page caches.
+
+    """
+
+    #: the number of idle connections to a SQLite file that are kept open
+    sqlite_pool_size = 5
+
+    def __init__(self, db_url):
+        self.db_url = db_url
+        url = make_url(db_url)
+        if url.drivername.startswith('sqlite') and not _is_memory_db(url):
+            # the pooled connections are used by whichever thread checks
+            # them out next, one at a time
+            self.engine = create_engine(
+                db_url, echo=False, poolclass=QueuePool,
+                pool_size=self.sqlite_pool_size, max_overflow=-1,
+                connect_args={'check_same_thread': False})
+        else:
+            self.engine = create_engine(db_url, echo=False)
+        self.session_factory = sessionmaker(
+            autoflush=True, bind=self.engine, info={"nbgrader_engine": self})
+        register_session_events(self.session_factory)
+        self.lock = threading.Lock()
+        self.sqlite_pragmas = None
+        self._schema_key = None
+        self._changes = itertools.count(1)
+        self.changes = 0
+
+        self.is_sqlite = url.drivername.startswith('sqlite')
+        self.is_memory = _is_memory_db(url)
+        if self.is_sqlite:
+            self.path = url.database
+            event.listen(self.engine, "connect", self._on_connect)
+        else:
+            self.path = None
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        if not self.sqlite_pragmas:
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in sorted(self.sqlite_pragmas.items()):
+                cursor.execute("PRAGMA {}={}".format(name, value))
+        finally:
+            cursor.close()
+
+    def _get_schema_key(self):
+        # For SQLite, the database file may have been deleted or replaced
+        # since we created the tables, so we need to check it is still the
+        # same file.
+        if self.path is None:
+            return True
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino)
+
+    def ensure_schema(self):
+        """Create the tables and set the alembic version, unless this has
+        already been done for this database.
+
+        """
+        with self.lock:
+            schema_key = self._get_schema_key()
+            if schema_key is not None and schema_key == self._schema_key:
+                return
+            if self._schema_key is not None:
+                # the pooled connections still use the old file
+                self.engine.dispose()
+            create_schema(self.engine)
+            self._schema_key = self._get_schema_key()
+
+    def count_change(self):
+        """Change the version after a session changed the database."""
+        self.changes = next(self._changes)
+        if not self.is_sqlite:
+            # the counter is incremented in a transaction of its own, so that
+            # writers only wait for each other for this one statement, rather
+            # than until each of them commits
+            with self.engine.begin() as connection:
+                bump_gradebook_version(connection)
+
+    def version(self, session):
+        """Get a token that changes whenever the database changes, see
+        :func:`~nbgrader.api.Gradebook.version`.
+
+        """
+        parts = [self.changes]
+        if self.is_sqlite and not self.is_memory:
+            parts.extend(_sqlite_file_version(self.path))
+        elif not self.is_sqlite:
+            parts.append(session.query(GradebookVersion.version)
+                         .filter(GradebookVersion.id == 1)
+                         .scalar() or 0)
+        return ":".join(str(x) for x in parts)
+
+    def dispose(self):
+        self.engine.dispose()
+
+
+def _sqlite_file_version(path):
+    # Every commit increments the change counter in the header of the
+    # database, except in WAL mode, where commits are appended to the -wal
+    # file until it is copied back into the database. Their modification times
+    # and sizes catch those as well.
+    parts = []
+    for name in (path, path + "-wal"):
+        try:
+            st = os.stat(name)
+        except OSError:
+            parts.append("-")
+        else:
+            parts.append("{}.{}.{!r}".format(st.st_ino, st.st_size, st.st_mtime))
+    try:
+        with open(path, "rb") as fh:
+            fh.seek(24)
+            parts.append(binascii.hexlify(fh.read(4)).decode("ascii"))
+    except (IOError, OSError):
+        pass
+    return parts
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+# engines inherited from the parent process, see _reset_engines
+_parent_engines = []
+
+
+def _is_memory_db(url):
+    return url.drivername.startswith('sqlite') and url.database in (None, '', ':memory:')
+
+
+def _normalize_db_url(db_url):
+    # relative SQLite paths are resolved against the current directory when
+    # connecting, so make them absolute to use the same file for the whole
+    # lifetime of the engine
+    url = make_url(db_url)
+    if url.drivername.startswith('sqlite') and not _is_memory_db(url):
+        database = os.path.abspath(url.database)
+        if hasattr(url, 'set'):
+            # URLs are immutable from SQLAlchemy 1.4
+            url = url.set(database=database)
+        else:
+            url.database = database
+        return str(url)
+    return db_url
+
+
+def create_schema(engine):
+    """Create all the tables in the database if they don't already exist,
+    and set the alembic version of new databases.
+
+    """
+    db_exists = len(engine.table_names()) > 0
+    Base.metadata.create_all(bind=engine)
+
+    if not db_exists:
+        alembic_version = get_alembic_version()
+        with engine.begin() as conn:
+            conn.execute("CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL);")
+            conn.execute("INSERT INTO alembic_version (version_num) VALUES ('{}');".format(alembic_version))
+
+
+def get_engine(db_url, sqlite_pragmas=None):
+    """Get the process-wide :class:`_DatabaseEngine` for a database, creating
+    it (and the database schema) if necessary. In-memory SQLite databases are
+    never shared, so a new engine is returned for them every time.
+
+    If ``sqlite_pragmas`` is given, these PRAGMAs are executed on every new
+    connection to the (SQLite) database made by the engine.
+
+    """
+    url = make_url(db_url)
+    if _is_memory_db(url):
+        engine = _DatabaseEngine(db_url)
+    else:
+        db_url = _normalize_db_url(db_url)
+        with _engines_lock:
+            engine = _engines.get(db_url, None)
+            if engine is None:
+                engine = _engines[db_url] = _DatabaseEngine(db_url)
+
+    if sqlite_pragmas is not None and dict(sqlite_pragmas) != engine.sqlite_pragmas:
+        engine.sqlite_pragmas = dict(sqlite_pragmas)
+        # the PRAGMAs are set when connecting, so don't reuse connections
+        # that were opened without them
+        engine.dispose()
+
+    engine.ensure_schema()
+    return engine
+
+
+def dispose_engines():
+    """Dispose of all the shared database engines of this process, closing
+    their pooled connections.
+
+    """
+    with _engines_lock:
+        engines = list(_engines.values())
+        _engines.clear()
+
+    for engine in engines:
+        engine.dispose()
+
+
+def _reset_engines():
+    # Pooled connections belong to the parent process and must not be used
+    # (or closed) by a forked child, so the child starts with fresh engines
+    # and just keeps a reference to the inherited ones.
+    global _engines_lock
+    _engines_lock = threading.Lock()
+    _parent_engines.extend(_engines.values())
+    _engines.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_engines)
+
+
+def _sort_and_page(query, columns, tiebreak, sort=None, limit=None, offset=None,
+                   exclude=None, exclude_column=None):
+    """Order a query by one of `columns` (a dictionary of column expressions),
+    given by its name, or by its name prefixed with ``-`` for descending
+    order, and then by `tiebreak`, and return a page of its rows. Missing
+    values come first in ascending order.
+
+    Rows whose `exclude_column` is one of the values in `exclude` are
+    skipped with a ``NOT IN`` clause (see `_ids_clause`).
+
+    """
+    if sort:
+        name = sort[1:] if sort.startswith("-") else sort
+        if name not in columns:
+            raise ValueError("Cannot sort by '{}', expected one of: {}".format(
+                name, ", ".join(sorted(columns))))
+        column = columns[name]
+        if sort.startswith("-"):
+            query = query.order_by(column.isnot(None).desc(), column.desc())
+        else:
+            query = query.order_by(column.isnot(None), column)
+    query = query.order_by(tiebreak)
+
+    with contextlib.ExitStack() as stack:
+        if exclude:
+            query = query.filter(~exclude_column.in_(_ids_clause(stack, query.session, exclude)))
+        if offset:
+            query = query.offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
 
 
 class Gradebook(object):
@@ -1321,7 +1839,7 @@ class Gradebook(object):
 
     """
 
-    def __init__(self, db_url, course_id="default_course", authenticator=None):
+    def __init__(self, db_url, course_id="default_course", authenticator=None, sqlite_pragmas=None):
         """Initialize the connection to the database.
 
         Parameters
@@ -1334,33 +1852,69 @@ class Gradebook(object):
         authenticator : :class:~`nbgrader.auth.BaseAuthenticator`
             An authenticator instance for communicating with an external
             database.
+        sqlite_pragmas : dict, optional
+            PRAGMAs to execute on every connection to a SQLite database, e.g.
+            :func:`~nbgrader.api.sqlite_concurrency_pragmas`. As the database
+            engine is shared, these also apply to other gradebooks using the
+            same database in this process.
 
         """
-        # create the connection to the database
-        self.engine = create_engine(db_url, echo=False)
-        self.db = scoped_session(sessionmaker(autoflush=True, bind=self.engine))
-
-        # this creates all the tables in the database if they don't already exist
-        db_exists = len(self.engine.table_names()) > 0
-        Base.metadata.create_all(bind=self.engine)
-
-        # set the alembic version if it doesn't exist
-        if not db_exists:
-            alembic_version = get_alembic_version()
-            self.db.execute("CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL);")
-            self.db.execute("INSERT INTO alembic_version (version_num) VALUES ('{}');".format(alembic_version))
-            self.db.commit()
+        # get the connection to the database; engines are shared by all
+        # gradebooks using the same database, and the tables are only
+        # created the first time
+        self._engine = get_engine(db_url, sqlite_pragmas=sqlite_pragmas)
+        self._owns_engine = _is_memory_db(make_url(db_url))
+        self.engine = self._engine.engine
+        self.db = scoped_session(self._engine.session_factory)
 
         self.check_course(course_id=course_id)
         self.course_id = course_id
         self.authenticator = authenticator
 
+    @classmethod
+    def from_coursedir(cls, coursedir, course_id=None, authenticator=None):
+        """Open the gradebook of a course, i.e. the database at
+        ``coursedir.db_url`` with the SQLite settings of the course directory.
+
+        Parameters
+        ----------
+        coursedir : :class:`~nbgrader.coursedir.CourseDirectory`
+            The course directory
+        course_id : string, optional
+            identifier of the course, defaults to ``coursedir.course_id``
+        authenticator : :class:~`nbgrader.auth.BaseAuthenticator`
+            An authenticator instance for communicating with an external
+            database.
+
+        """
+        if course_id is None:
+            course_id = coursedir.course_id
+        return cls(coursedir.db_url, course_id, authenticator,
+                   sqlite_pragmas=coursedir.db_sqlite_pragmas)
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
 
+    def count_queries(self):
+        """Return a :class:`~nbgrader.api.QueryCounter` that counts the
+        queries this thread issues to the database, e.g.::
+
+            with gb.count_queries() as counter:
+                ...
+            print(counter.count)
+
+        """
+        return QueryCounter(self.engine)
+
+    def __deepcopy__(self, memo):
+        # The gradebook wraps a database connection, which cannot (and should
+        # not) be copied, e.g. when it is passed to preprocessors through the
+        # nbconvert resources.
+        return self
+
     def close(self):
         """Close the connection to the database.
 
@@ -1369,9 +1923,14 @@ class Gradebook(object):
         gradebook without closing them, you may run into errors where there
         are too many open connections to the database.
 
+        The connection is returned to the connection pool of the database
+        engine, which is shared by all gradebooks in this process (see
+        :func:`~nbgrader.api.dispose_engines`).
+
         """
         self.db.remove()
-        self.engine.dispose()
+        if self._owns_engine:
+            self._engine.dispose()
 
     def check_course(self, course_id="default_course", **kwargs):
         """Set the course id
@@ -2262,6 +2821,109 @@ class Gradebook(object):
 
         return submission
 
+    def add_submissions(self, assignment, students, **kwargs):
+        """Add new submissions of an assignment by several students at once.
+
+        This does the same as calling
+        :func:`~nbgrader.api.Gradebook.add_submission` for each student, but
+        the structure of the assignment is only loaded once, and all the
+        submissions, notebooks, grades and comments are inserted in bulk in a
+        single transaction. If any of the submissions cannot be added (for
+        example because it already exists), none of them are.
+
+        Parameters
+        ----------
+        assignment : string
+            the name of an existing assignment
+        students : list of strings
+            the names of existing students
+        `**kwargs`
+            additional keyword arguments for :class:`~nbgrader.api.SubmittedAssignment`,
+            which are used for every submission
+
+        Returns
+        -------
+        submissions : list of :class:`~nbgrader.api.SubmittedAssignment`
+            the new submissions, in the same order as ``students``
+
+        """
+
+        if 'timestamp' in kwargs:
+            kwargs['timestamp'] = utils.parse_utc(kwargs['timestamp'])
+
+        students = list(students)
+        assignment_id = self.find_assignment(assignment).id
+
+        existing = set()
+        for chunk in _chunks(set(students)):
+            existing.update(x for x, in self.db.query(Student.id).filter(Student.id.in_(chunk)))
+        missing = [student for student in students if student not in existing]
+        if missing:
+            raise MissingEntry("No such student: {}".format(", ".join(missing)))
+
+        cells = self.db.query(BaseCell.id, BaseCell.notebook_id, BaseCell.type)\
+            .join(Notebook, Notebook.id == BaseCell.notebook_id)\
+            .filter(Notebook.assignment_id == assignment_id)\
+            .order_by(BaseCell.notebook_id, BaseCell.id)\
+            .all()
+        notebooks = [x for x, in self.db.query(Notebook.id)
+                     .filter(Notebook.assignment_id == assignment_id)
+                     .order_by(Notebook.id)]
+        graded = [(cell_id, notebook_id) for cell_id, notebook_id, cell_type in cells
+                  if cell_type in ('GradeCell', 'TaskCell')]
+        commented = [(cell_id, notebook_id) for cell_id, notebook_id, cell_type in cells
+                     if cell_type in ('SolutionCell', 'TaskCell')]
+
+        submission_rows = []
+        notebook_rows = []
+        grade_rows = []
+        comment_rows = []
+        for student in students:
+            submission_id = new_uuid()
+            submission_rows.append(dict(
+                kwargs, id=submission_id, assignment_id=assignment_id, student_id=student))
+
+            notebook_ids = {}
+            for notebook_id in notebooks:
+                notebook_ids[notebook_id] = new_uuid()
+                notebook_rows.append(dict(
+                    id=notebook_ids[notebook_id], assignment_id=submission_id,
+                    notebook_id=notebook_id))
+
+            grade_rows.extend(
+                dict(id=new_uuid(), cell_id=cell_id, notebook_id=notebook_ids[notebook_id])
+                for cell_id, notebook_id in graded)
+            comment_rows.extend(
+                dict(id=new_uuid(), cell_id=cell_id, notebook_id=notebook_ids[notebook_id])
+                for cell_id, notebook_id in commented)
+
+        # The rows are inserted directly rather than through the ORM, so the
+        # stored score aggregates are not updated, but new submissions don't
+        # have any scores yet, so the defaults of zero are correct. The flush
+        # listeners don't see the change either, so it is recorded here.
+        try:
+            for table, rows in [(SubmittedAssignment.__table__, submission_rows),
+                                (SubmittedNotebook.__table__, notebook_rows),
+                                (Grade.__table__, grade_rows),
+                                (Comment.__table__, comment_rows)]:
+                if rows:
+                    self.db.execute(table.insert(), rows)
+            if submission_rows:
+                _mark_gradebook_changed(self.db)
+            self.db.commit()
+
+        except (IntegrityError, FlushError) as e:
+            self.db.rollback()
+            raise InvalidEntry(*e.args)
+
+        submissions = {}
+        for chunk in _chunks([row['id'] for row in submission_rows]):
+            submissions.update(
+                (x.student_id, x) for x in self.db.query(SubmittedAssignment)
+                .filter(SubmittedAssignment.id.in_(chunk)))
+
+        return [submissions[student] for student in students]
+
     def find_submission(self, assignment, student):
         """Find a student's submission for a given assignment.
 
@@ -2697,6 +3359,254 @@ class Gradebook(object):
 
         return comment
 
+    def find_submission_notebook_grades(self, notebook, assignment, student):
+        """Find all grades in a notebook in a student's submission for a given
+        assignment, using a single query.
+
+        Parameters
+        ----------
+        notebook : string
+            the name of a notebook
+        assignment : string
+            the name of an assignment
+        student : string
+            the unique id of a student
+
+        Returns
+        -------
+        grades : dict
+            A dictionary mapping the names of the grade and task cells to
+            their :class:`~nbgrader.api.Grade` objects
+
+        """
+        grades = self.db.query(BaseCell.name, Grade)\
+            .join(Grade, Grade.cell_id == BaseCell.id)\
+            .join(SubmittedNotebook, SubmittedNotebook.id == Grade.notebook_id)\
+            .join(Notebook, Notebook.id == SubmittedNotebook.notebook_id)\
+            .join(SubmittedAssignment, SubmittedAssignment.id == SubmittedNotebook.assignment_id)\
+            .join(Assignment, Assignment.id == SubmittedAssignment.assignment_id)\
+            .filter(
+                Notebook.name == notebook,
+                Assignment.name == assignment,
+                SubmittedAssignment.student_id == student)\
+            .all()
+
+        return dict(grades)
+
+    def find_submission_notebook_comments(self, notebook, assignment, student):
+        """Find all comments in a notebook in a student's submission for a
+        given assignment, using a single query.
+
+        Parameters
+        ----------
+        notebook : string
+            the name of a notebook
+        assignment : string
+            the name of an assignment
+        student : string
+            the unique id of a student
+
+        Returns
+        -------
+        comments : dict
+            A dictionary mapping the names of the solution and task cells to
+            their :class:`~nbgrader.api.Comment` objects
+
+        """
+        comments = self.db.query(BaseCell.name, Comment)\
+            .join(Comment, Comment.cell_id == BaseCell.id)\
+            .join(SubmittedNotebook, SubmittedNotebook.id == Comment.notebook_id)\
+            .join(Notebook, Notebook.id == SubmittedNotebook.notebook_id)\
+            .join(SubmittedAssignment, SubmittedAssignment.id == SubmittedNotebook.assignment_id)\
+            .join(Assignment, Assignment.id == SubmittedAssignment.assignment_id)\
+            .filter(
+                Notebook.name == notebook,
+                Assignment.name == assignment,
+                SubmittedAssignment.student_id == student)\
+            .all()
+
+        return dict(comments)
+
+    def update_grades_and_comments(self, grades=None, comments=None):
+        """Update many grades and comments, possibly of several submissions,
+        in a single transaction. Either all updates are applied, or none of
+        them are.
+
+        Each grade update is a dictionary with the ``id`` of the grade and
+        its new ``manual_score`` and ``extra_credit``. Each comment update is a
+        dictionary with the ``id`` of the comment and its new
+        ``manual_comment``. Values that are missing are set to None, and a grade
+        needs to be graded manually if it has neither a manual nor an
+        automatic score.
+
+        Parameters
+        ----------
+        grades : list of dicts
+            the grade updates
+        comments : list of dicts
+            the comment updates
+
+        Returns
+        -------
+        grades, comments : tuple of lists
+            the updated :class:`~nbgrader.api.Grade` and
+            :class:`~nbgrader.api.Comment` objects, in the same order as the
+            updates
+
+        """
+        grades = list(grades or [])
+        comments = list(comments or [])
+
+        def parse_score(update, key):
+            value = update.get(key, None)
+            if value is None or value == "":
+                return None
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                raise InvalidEntry("Invalid {} for grade {}: {!r}".format(key, update["id"], value))
+
+        def parse_comment(update):
+            value = update.get("manual_comment", None)
+            if value is not None and not isinstance(value, six.string_types):
+                raise InvalidEntry("Invalid manual_comment for comment {}: {!r}".format(update["id"], value))
+            return value
+
+        # validate everything before anything is changed
+        for update in grades + comments:
+            if not isinstance(update, dict) or "id" not in update:
+                raise InvalidEntry("Invalid update (it needs an id): {!r}".format(update))
+        grade_values = [(parse_score(x, "manual_score"), parse_score(x, "extra_credit")) for x in grades]
+        comment_values = [parse_comment(x) for x in comments]
+
+        def load(model, updates):
+            objects = {}
+            for chunk in _chunks(set(x["id"] for x in updates)):
+                objects.update((x.id, x) for x in self.db.query(model).filter(model.id.in_(chunk)))
+            for update in updates:
+                if update["id"] not in objects:
+                    raise MissingEntry("No such {}: {}".format(model.__name__.lower(), update["id"]))
+            return [objects[x["id"]] for x in updates]
+
+        updated_grades = load(Grade, grades)
+        updated_comments = load(Comment, comments)
+
+        for grade, (manual_score, extra_credit) in zip(updated_grades, grade_values):
+            grade.manual_score = manual_score
+            grade.extra_credit = extra_credit
+            grade.needs_manual_grade = grade.manual_score is None and grade.auto_score is None
+        for comment, manual_comment in zip(updated_comments, comment_values):
+            comment.manual_comment = manual_comment
+
+        try:
+            self.db.commit()
+        except (IntegrityError, FlushError) as e:
+            self.db.rollback()
+            raise InvalidEntry(*e.args)
+
+        return updated_grades, updated_comments
+
+    def check_score_aggregates(self):
+        """Check that the stored scores and maximum scores of notebooks,
+        assignments and submissions match the grades and cells they are
+        computed from.
+
+        Returns
+        -------
+        errors : list
+            A list of ``(table, id, column, stored value, computed value)``
+            tuples, one for each stored score that is wrong
+
+        """
+        return check_score_aggregates(self.db.connection())
+
+    def rebuild_score_aggregates(self):
+        """Recompute all the stored scores and maximum scores of notebooks,
+        assignments and submissions from the grades and cells.
+
+        """
+        rebuild_score_aggregates(self.db.connection())
+        _mark_gradebook_changed(self.db)
+        self.db.commit()
+
+    def version(self):
+        """Get the version of the gradebook, which changes whenever anything
+        in the database is changed, by this or any other process. This is a
+        cheap way to check whether the gradebook changed since it was last
+        read, e.g. to tell whether cached data is stale.
+
+        The version is made up of the number of changes committed by this
+        process and, for SQLite, of the change counter and modification times
+        of the database files, so that writers don't have to update anything
+        to change it. For other databases, a counter is incremented after
+        every commit that changed something.
+
+        Returns
+        -------
+        version : string
+            An opaque token, which is only meant to be compared with other
+            versions
+
+        """
+        return self._engine.version(self.db)
+
+    def score_stats(self, assignment_id=None):
+        """Compute the submission counts, average scores and maximum scores
+        of every assignment or, if an assignment is given, of every notebook
+        in that assignment. This is equivalent to calling
+        :func:`~nbgrader.api.Gradebook.average_assignment_score` and friends (or
+        :func:`~nbgrader.api.Gradebook.average_notebook_score` and friends) for
+        each of them, except that everything is computed with one grouped
+        query.
+
+        Parameters
+        ----------
+        assignment_id : string (optional)
+            the name of an assignment
+
+        Returns
+        -------
+        stats : dict
+            A dictionary mapping the name of each assignment (or notebook) to
+            a dictionary with its statistics
+
+        """
+        if assignment_id is None:
+            parent, submission = Assignment, SubmittedAssignment
+            onclause = SubmittedAssignment.assignment_id == Assignment.id
+        else:
+            parent, submission = Notebook, SubmittedNotebook
+            onclause = SubmittedNotebook.notebook_id == Notebook.id
+
+        stats = self.db.query(
+            parent.name,
+            func.count(submission.id),
+            func.coalesce(func.avg(submission.score), 0.0),
+            func.coalesce(func.avg(submission.code_score), 0.0),
+            func.coalesce(func.avg(submission.written_score), 0.0),
+            func.coalesce(func.avg(submission.task_score), 0.0),
+            parent.max_score, parent.max_code_score,
+            parent.max_written_score, parent.max_task_score
+        ).select_from(parent)\
+         .outerjoin(submission, onclause)
+
+        if assignment_id is not None:
+            stats = stats.join(Assignment, Assignment.id == Notebook.assignment_id)\
+                .filter(Assignment.name == assignment_id)
+
+        stats = stats.group_by(
+            parent.id, parent.name,
+            parent.max_score_gradecell, parent.max_score_taskcell,
+            parent.max_code_score, parent.max_written_score, parent.max_task_score)
+
+        keys = [
+            "num_submissions",
+            "average_score", "average_code_score",
+            "average_written_score", "average_task_score",
+            "max_score", "max_code_score", "max_written_score", "max_task_score"
+        ]
+        return {x[0]: dict(zip(keys, x[1:])) for x in stats}
+
     def average_assignment_score(self, assignment_id):
         """Compute the average score for an assignment.
 
@@ -2951,7 +3861,7 @@ class Gradebook(object):
             A list of dictionaries, one per student
 
         """
-        total_score, = self.db.query(Assignment.max_score).one()
+        total_score, = self.db.query(func.coalesce(func.sum(Assignment.max_score), 0.0)).one()
         if len(self.assignments) > 0 and total_score > 0:
             # subquery the scores
             scores = self.db.query(
@@ -2980,16 +3890,36 @@ class Gradebook(object):
             students = [s.to_dict() for s in self.students]
             return students
 
-    def submission_dicts(self, assignment_id):
+    def submission_dicts(self, assignment_id, sort=None, limit=None, offset=None,
+                         needs_manual_grade=None, student_prefix=None,
+                         exclude_students=None):
         """Returns a list of dictionaries containing submission data. Equivalent
         to calling :func:`~nbgrader.api.SubmittedAssignment.to_dict` for each
         submission, except that this method is implemented using proper SQL
         joins and is much faster.
 
+        The submissions can be sorted, filtered and paged through in the
+        database, so that only the requested ones are loaded.
+
         Parameters
         ----------
         assignment_id : string
             the name of the assignment
+        sort : string (optional)
+            the key to sort by, one of ``"student"``, ``"first_name"``,
+            ``"last_name"``, ``"timestamp"``, ``"score"`` or
+            ``"needs_manual_grade"``, prefixed with ``-`` for descending
+            order; submissions are then sorted by student
+        limit : int (optional)
+            the maximum number of submissions to return
+        offset : int (optional)
+            the number of submissions to skip
+        needs_manual_grade : bool (optional)
+            only return submissions that do (or do not) need manual grading
+        student_prefix : string (optional)
+            only return submissions of students whose id starts with this
+        exclude_students : list of strings (optional)
+            the ids of students whose submissions should not be returned
 
         Returns
         -------
@@ -2997,125 +3927,41 @@ class Gradebook(object):
             A list of dictionaries, one per submitted assignment
 
         """
-        # subquery the code scores
-        code_scores = self.db.query(
-            SubmittedAssignment.id.label("id"),
-            func.sum(Grade.score).label("code_score"),
-            func.sum(GradeCell.max_score).label("max_code_score"),
-        ).select_from(SubmittedAssignment
-        ).join(SubmittedNotebook, Notebook, Assignment, Student, Grade, GradeCell)\
-         .filter(GradeCell.cell_type == "code")\
-         .group_by(SubmittedAssignment.id)\
-         .subquery()
-
-        # subquery for the written scores
-        written_scores = self.db.query(
-            SubmittedAssignment.id.label("id"),
-            func.sum(Grade.score).label("written_score"),
-            func.sum(GradeCell.max_score).label("max_written_score"),
-        ).select_from(SubmittedAssignment
-        ).join(SubmittedNotebook, Notebook, Assignment, Student, Grade, GradeCell)\
-         .filter(GradeCell.cell_type == "markdown")\
-         .group_by(SubmittedAssignment.id)\
-         .subquery()
-
-        # subquery for the task scores
-        task_scores = self.db.query(
-            SubmittedAssignment.id.label("id"),
-            func.sum(Grade.score).label("task_score"),
-            func.sum(TaskCell.max_score).label("max_task_score"),
-        ).select_from(SubmittedAssignment
-        ).join(SubmittedNotebook, Notebook, Assignment, Student, Grade, TaskCell)\
-         .filter(TaskCell.cell_type == "markdown")\
-         .group_by(SubmittedAssignment.id)\
-         .subquery()
-
-        # subquery for needing manual grading
-        manual_grade = self.db.query(
-            SubmittedAssignment.id,
-            exists().where(Grade.needs_manual_grade).label("needs_manual_grade")
-        ).select_from(SubmittedAssignment
-        ).join(SubmittedNotebook, Assignment, Notebook)\
-         .filter(
-             SubmittedNotebook.assignment_id == SubmittedAssignment.id,
-             Grade.notebook_id == SubmittedNotebook.id,
-             Grade.needs_manual_grade)\
-         .group_by(SubmittedAssignment.id)\
-         .subquery()
-
-        all_scores = aliased(union_all(
-            self.db.query(
-                SubmittedAssignment.id.label('id'),
-                func.sum(Grade.score).label("score"),
-                func.sum(GradeCell.max_score).label("max_score"),
-            ).select_from(SubmittedAssignment
-            ).join(SubmittedNotebook, Grade, GradeCell)
-            .filter(GradeCell.cell_type == "code")
-            .group_by(SubmittedAssignment.id),
-            # subquery for the written scores
-            self.db.query(
-                SubmittedAssignment.id.label('id'),
-                func.sum(Grade.score).label("score"),
-                func.sum(GradeCell.max_score).label("max_score"),
-            ).select_from(SubmittedAssignment
-            ).join(SubmittedNotebook, Grade, GradeCell)\
-            .filter(GradeCell.cell_type == "markdown")\
-            .group_by(SubmittedAssignment.id),
-
-            self.db.query(
-                SubmittedAssignment.id.label('id'),
-                func.sum(Grade.score).label("score"),
-                func.sum(TaskCell.max_score).label("max_score"),
-            ).select_from(SubmittedAssignment
-            ).join(SubmittedNotebook, Grade, TaskCell)\
-            .filter(TaskCell.cell_type == "markdown")\
-            .group_by(SubmittedAssignment.id)
-        )
-        )
-        total_scores = self.db.query(
-            func.sum(all_scores.c.score).label("score"),
-            func.sum(all_scores.c.max_score).label("max_score"),
-            all_scores.c.id.label("id"),
-        ).group_by(all_scores.c.id)\
-         .subquery()
-
-        # full query
-        _manual_grade = func.coalesce(manual_grade.c.needs_manual_grade, False)
+        # the scores are stored with the submissions (see
+        # _update_score_aggregates), and the maximum scores with the assignment
+        _manual_grade = SubmittedAssignment.needs_manual_grade.expression
         assignments = self.db.query(
             SubmittedAssignment.id, Assignment.name,
             SubmittedAssignment.timestamp, Student.first_name, Student.last_name,
             Student.id,
-            func.coalesce(total_scores.c.score, 0.0),
-            func.coalesce(total_scores.c.max_score, 0.0),
-            func.coalesce(code_scores.c.code_score, 0.0),
-            func.coalesce(code_scores.c.max_code_score, 0.0),
-            func.coalesce(written_scores.c.written_score, 0.0),
-            func.coalesce(written_scores.c.max_written_score, 0.0),
-            func.coalesce(task_scores.c.task_score, 0.0),
-            func.coalesce(task_scores.c.max_task_score, 0.0),
+            SubmittedAssignment.score, Assignment.max_score,
+            SubmittedAssignment.code_score, Assignment.max_code_score,
+            SubmittedAssignment.written_score, Assignment.max_written_score,
+            SubmittedAssignment.task_score, Assignment.max_task_score,
             _manual_grade
         ).select_from(SubmittedAssignment
-        ).join(SubmittedNotebook, Assignment, Student, Grade)\
-         .outerjoin(code_scores, SubmittedAssignment.id == code_scores.c.id)\
-         .outerjoin(written_scores, SubmittedAssignment.id == written_scores.c.id)\
-         .outerjoin(task_scores, SubmittedAssignment.id == task_scores.c.id)\
-         .outerjoin(manual_grade, SubmittedAssignment.id == manual_grade.c.id)\
-         .outerjoin(total_scores, SubmittedAssignment.id == total_scores.c.id)\
-         .filter(and_(
+        ).join(Assignment, Student)\
+         .filter(
              Assignment.name == assignment_id,
-             Student.id == SubmittedAssignment.student_id,
-             SubmittedAssignment.id == SubmittedNotebook.assignment_id,
-             SubmittedNotebook.id == Grade.notebook_id,
-             SubmittedAssignment.id == total_scores.c.id))\
-         .group_by(
-             SubmittedAssignment.id, Assignment.name,
-             SubmittedAssignment.timestamp, Student.first_name, Student.last_name,
-             Student.id, code_scores.c.code_score, code_scores.c.max_code_score,
-             written_scores.c.written_score, written_scores.c.max_written_score,
-             task_scores.c.task_score, task_scores.c.max_task_score,
-             total_scores.c.score, total_scores.c.max_score,
-             _manual_grade)\
-         .all()
+             # only submissions that have been graded
+             exists().where(and_(
+                 SubmittedNotebook.assignment_id == SubmittedAssignment.id,
+                 Grade.notebook_id == SubmittedNotebook.id)))
+
+        if needs_manual_grade is not None:
+            assignments = assignments.filter(_manual_grade == needs_manual_grade)
+        if student_prefix:
+            assignments = assignments.filter(Student.id.startswith(student_prefix, autoescape=True))
+
+        assignments = _sort_and_page(assignments, {
+            "student": Student.id,
+            "first_name": func.coalesce(Student.first_name, ""),
+            "last_name": func.coalesce(Student.last_name, ""),
+            "timestamp": SubmittedAssignment.timestamp,
+            "score": SubmittedAssignment.score,
+            "needs_manual_grade": _manual_grade,
+        }, Student.id, sort=sort, limit=limit, offset=offset,
+           exclude=exclude_students, exclude_column=Student.id)
 
         keys = [
             "id", "name", "timestamp", "first_name", "last_name", "student",
@@ -3126,18 +3972,44 @@ class Gradebook(object):
         ]
         return [dict(zip(keys, x)) for x in assignments]
 
-    def notebook_submission_dicts(self, notebook_id, assignment_id):
+    def notebook_submission_dicts(self, notebook_id, assignment_id, sort=None,
+                                  limit=None, offset=None, needs_manual_grade=None,
+                                  failed_tests=None, flagged=None,
+                                  student_prefix=None, exclude_ids=None):
         """Returns a list of dictionaries containing submission data. Equivalent
         to calling :func:`~nbgrader.api.SubmittedNotebook.to_dict` for each
         submission, except that this method is implemented using proper SQL
         joins and is much faster.
 
+        The submissions can be sorted, filtered and paged through in the
+        database, so that only the requested ones are loaded.
+
         Parameters
         ----------
         notebook_id : string
             the name of the notebook
         assignment_id : string
             the name of the assignment
+        sort : string (optional)
+            the key to sort by, one of ``"id"``, ``"student"``,
+            ``"first_name"``, ``"last_name"``, ``"score"``, ``"code_score"``,
+            ``"written_score"``, ``"task_score"``, ``"needs_manual_grade"``,
+            ``"failed_tests"`` or ``"flagged"``, prefixed with ``-`` for
+            descending order; submissions are then sorted by id
+        limit : int (optional)
+            the maximum number of submissions to return
+        offset : int (optional)
+            the number of submissions to skip
+        needs_manual_grade : bool (optional)
+            only return submissions that do (or do not) need manual grading
+        failed_tests : bool (optional)
+            only return submissions that do (or do not) fail tests
+        flagged : bool (optional)
+            only return submissions that are (or are not) flagged
+        student_prefix : string (optional)
+            only return submissions of students whose id starts with this
+        exclude_ids : list of strings (optional)
+            the ids of submitted notebooks that should not be returned
 
         Returns
         -------
@@ -3145,148 +4017,50 @@ class Gradebook(object):
             A list of dictionaries, one per submitted notebook
 
         """
-        # subquery the code scores
-        code_scores = self.db.query(
-            SubmittedNotebook.id,
-            func.sum(Grade.score).label("code_score"),
-            func.sum(GradeCell.max_score).label("max_code_score"),
-        ).select_from(SubmittedNotebook
-        ).join(SubmittedAssignment, Notebook, Assignment, Student, Grade, GradeCell)\
-         .filter(GradeCell.cell_type == "code")\
-         .group_by(SubmittedNotebook.id)\
-         .subquery()
-
-        # subquery for the written scores
-        written_scores = self.db.query(
-            SubmittedNotebook.id,
-            func.sum(Grade.score).label("written_score"),
-            func.sum(GradeCell.max_score).label("max_written_score"),
-        ).select_from(SubmittedNotebook
-        ).join(SubmittedAssignment, Notebook, Assignment, Student, Grade, GradeCell)\
-         .filter(GradeCell.cell_type == "markdown")\
-         .group_by(SubmittedNotebook.id)\
-         .subquery()
-        # subquery for the written scores
-        task_scores = self.db.query(
-            SubmittedNotebook.id,
-            func.coalesce(func.sum(Grade.score), 0.0).label("task_score"),
-            func.sum(TaskCell.max_score).label("max_task_score"),
-        ).select_from(SubmittedNotebook
-        ).join(SubmittedAssignment, Notebook, Assignment, Student, Grade, TaskCell)\
-         .filter(TaskCell.cell_type == "markdown")\
-         .group_by(SubmittedNotebook.id)\
-         .subquery()
-
-        max_scores = self.db.query(
-            SubmittedNotebook.id,
-            func.sum(task_scores.c.max_task_score).label("mmmm"),
-        ).select_from(SubmittedNotebook
-        ).join(SubmittedAssignment, task_scores)\
-         .group_by(SubmittedNotebook.id)\
-         .subquery()
-
-        all_scores = aliased(union_all(
-            self.db.query(
-                SubmittedNotebook.id.label('id'),
-                func.sum(Grade.score).label("score"),
-                func.sum(GradeCell.max_score).label("max_score"),
-            ).select_from(SubmittedNotebook
-            ).join(Grade, GradeCell)
-            .filter(GradeCell.cell_type == "code")
-            .group_by(SubmittedNotebook.id),
-            # subquery for the written scores
-            self.db.query(
-                SubmittedNotebook.id.label('id'),
-                func.sum(Grade.score).label("score"),
-                func.sum(GradeCell.max_score).label("max_score"),
-            ).select_from(SubmittedNotebook
-            ).join(Grade, GradeCell)\
-            .filter(GradeCell.cell_type == "markdown")\
-            .group_by(SubmittedNotebook.id),
-
-            self.db.query(
-                SubmittedNotebook.id.label('id'),
-                func.sum(Grade.score).label("score"),
-                func.sum(TaskCell.max_score).label("max_score"),
-            ).select_from(SubmittedNotebook
-            ).join(Grade, TaskCell)\
-            .filter(TaskCell.cell_type == "markdown")\
-            .group_by(SubmittedNotebook.id)
-        )
-        )
-        total_scores = self.db.query(
-            func.sum(all_scores.c.score).label("score"),
-            func.sum(all_scores.c.max_score).label("max_score"),
-            all_scores.c.id.label("id"),
-        )\
-            .group_by(all_scores.c.id)\
-            .subquery()
-
-        # subquery for needing manual grading
-
-        manual_grade = self.db.query(
-            SubmittedNotebook.id,
-            exists().where(Grade.needs_manual_grade).label("needs_manual_grade")
-        ).select_from(SubmittedNotebook
-        ).join(SubmittedAssignment, Assignment, Notebook)\
-         .filter(
-             Grade.notebook_id == SubmittedNotebook.id,
-             Grade.needs_manual_grade)\
-         .group_by(SubmittedNotebook.id)\
-         .subquery()
-
-        # subquery for failed tests
-        failed_tests = self.db.query(
-            SubmittedNotebook.id,
-            exists().where(Grade.failed_tests).label("failed_tests")
-        ).select_from(SubmittedNotebook
-        ).join(SubmittedAssignment, Assignment, Notebook)\
-         .filter(
-             Grade.notebook_id == SubmittedNotebook.id,
-             Grade.failed_tests)\
-         .group_by(SubmittedNotebook.id)\
-         .subquery()
-
-        # full query
-        _manual_grade = func.coalesce(manual_grade.c.needs_manual_grade, False)
-        _failed_tests = func.coalesce(failed_tests.c.failed_tests, False)
+        # the scores are stored with the submissions (see
+        # _update_score_aggregates), and the maximum scores with the notebook
+        _manual_grade = SubmittedNotebook.needs_manual_grade.expression
+        _failed_tests = SubmittedNotebook.failed_tests.expression
+        _flagged = func.coalesce(SubmittedNotebook.flagged, False)
         submissions = self.db.query(
             SubmittedNotebook.id, Notebook.name,
             Student.id, Student.first_name, Student.last_name,
-            func.coalesce(total_scores.c.score, 0.0),
-            func.coalesce(total_scores.c.max_score, 0.0),
-            func.coalesce(code_scores.c.code_score, 0.0),
-            func.coalesce(code_scores.c.max_code_score, 0.0),
-            func.coalesce(written_scores.c.written_score, 0.0),
-            func.coalesce(written_scores.c.max_written_score, 0.0),
-            func.coalesce(task_scores.c.task_score, 0.0),
-            func.coalesce(task_scores.c.max_task_score, 0.0),
+            SubmittedNotebook.score, Notebook.max_score,
+            SubmittedNotebook.code_score, Notebook.max_code_score,
+            SubmittedNotebook.written_score, Notebook.max_written_score,
+            SubmittedNotebook.task_score, Notebook.max_task_score,
             _manual_grade, _failed_tests, SubmittedNotebook.flagged
         ).select_from(SubmittedNotebook
-        ).join(SubmittedAssignment, Notebook, Assignment, Student, Grade)\
-         .outerjoin(code_scores, SubmittedNotebook.id == code_scores.c.id)\
-         .outerjoin(written_scores, SubmittedNotebook.id == written_scores.c.id)\
-         .outerjoin(task_scores, SubmittedNotebook.id == task_scores.c.id)\
-         .outerjoin(total_scores, SubmittedNotebook.id == total_scores.c.id)\
-         .outerjoin(manual_grade, SubmittedNotebook.id == manual_grade.c.id)\
-         .outerjoin(failed_tests, SubmittedNotebook.id == failed_tests.c.id)\
-         .filter(and_(
+        ).join(SubmittedAssignment, Notebook, Assignment, Student)\
+         .filter(
              Notebook.name == notebook_id,
              Assignment.name == assignment_id,
-             Student.id == SubmittedAssignment.student_id,
-             SubmittedAssignment.id == SubmittedNotebook.assignment_id,
-             SubmittedNotebook.id == Grade.notebook_id,
-             SubmittedNotebook.id == total_scores.c.id,
-         )
-        ).group_by(
-             SubmittedNotebook.id, Notebook.name,
-             Student.id, Student.first_name, Student.last_name,
-             code_scores.c.code_score, code_scores.c.max_code_score,
-             written_scores.c.written_score, written_scores.c.max_written_score,
-             task_scores.c.task_score, task_scores.c.max_task_score,
-             total_scores.c.score, total_scores.c.max_score,
-             _manual_grade, _failed_tests, SubmittedNotebook.flagged)\
-         .all()
+             # only submissions that have been graded
+             exists().where(Grade.notebook_id == SubmittedNotebook.id))
+
+        if needs_manual_grade is not None:
+            submissions = submissions.filter(_manual_grade == needs_manual_grade)
+        if failed_tests is not None:
+            submissions = submissions.filter(_failed_tests == failed_tests)
+        if flagged is not None:
+            submissions = submissions.filter(_flagged == flagged)
+        if student_prefix:
+            submissions = submissions.filter(Student.id.startswith(student_prefix, autoescape=True))
+
+        submissions = _sort_and_page(submissions, {
+            "id": SubmittedNotebook.id,
+            "student": Student.id,
+            "first_name": func.coalesce(Student.first_name, ""),
+            "last_name": func.coalesce(Student.last_name, ""),
+            "score": SubmittedNotebook.score,
+            "code_score": SubmittedNotebook.code_score,
+            "written_score": SubmittedNotebook.written_score,
+            "task_score": SubmittedNotebook.task_score,
+            "needs_manual_grade": _manual_grade,
+            "failed_tests": _failed_tests,
+            "flagged": _flagged,
+        }, SubmittedNotebook.id, sort=sort, limit=limit, offset=offset,
+           exclude=exclude_ids, exclude_column=SubmittedNotebook.id)
 
         keys = [
             "id", "name", "student", "first_name", "last_name",
@@ -3298,3 +4072,57 @@ class Gradebook(object):
             "failed_tests", "flagged"
         ]
         return [dict(zip(keys, x)) for x in submissions]
+
+    def grade_matrix(self, assignments=None, students=None):
+        """Returns the scores of every student on every assignment, including
+        the assignments a student did not submit. Equivalent to calling
+        :func:`~nbgrader.api.Gradebook.find_submission` for each pair of
+        student and assignment, except that everything is loaded with a single
+        query, and the rows are generated as they are read from the database.
+
+        Parameters
+        ----------
+        assignments : list of strings (optional)
+            the names of the assignments to include, defaults to all of them
+        students : list of strings (optional)
+            the ids of the students to include, defaults to all of them
+
+        Returns
+        -------
+        grades : iterator
+            An iterator over dictionaries, one per student and assignment,
+            ordered by assignment and then by student
+
+        """
+        grades = self.db.query(
+            Assignment.name, Assignment.duedate, Assignment.max_score,
+            Student.id, Student.first_name, Student.last_name, Student.email,
+            SubmittedAssignment.id, SubmittedAssignment.timestamp,
+            func.coalesce(SubmittedAssignment.score, 0.0),
+            func.coalesce(SubmittedAssignment.late_submission_penalty, 0.0)
+        ).select_from(Assignment)\
+         .join(Student, true())\
+         .outerjoin(SubmittedAssignment, and_(
+             SubmittedAssignment.assignment_id == Assignment.id,
+             SubmittedAssignment.student_id == Student.id))
+
+        keys = [
+            "assignment", "duedate", "max_score",
+            "student_id", "first_name", "last_name", "email",
+            "submitted", "timestamp", "raw_score", "late_submission_penalty"
+        ]
+        with contextlib.ExitStack() as stack:
+            if assignments is not None:
+                grades = grades.filter(Assignment.name.in_(_ids_clause(stack, self.db, assignments)))
+            if students is not None:
+                grades = grades.filter(Student.id.in_(_ids_clause(stack, self.db, students)))
+
+            grades = grades.order_by(
+                Assignment.duedate, Assignment.name,
+                Student.last_name, Student.first_name, Student.id)
+
+            for x in grades.yield_per(1000):
+                grade = dict(zip(keys, x))
+                grade["submitted"] = grade["submitted"] is not None
+                grade["score"] = max(0.0, grade["raw_score"] - grade["late_submission_penalty"])
+                yield grade
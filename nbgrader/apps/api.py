@@ -3,18 +3,28 @@ import re
 import sys
 import os
 import six
+import json
+import time
+import hashlib
+import threading
 import logging
 import warnings
 
 from traitlets.config import LoggingConfigurable, Config
-from traitlets import Instance, Enum, Unicode, observe
+from traitlets import Instance, Enum, Unicode, Float, observe
 
 from ..coursedir import CourseDirectory
 from ..converters import GenerateAssignment, Autograde, GenerateFeedback
 from ..exchange import ExchangeList, ExchangeReleaseAssignment, ExchangeReleaseFeedback, ExchangeFetchFeedback, ExchangeCollect, ExchangeError, ExchangeSubmit
-from ..api import MissingEntry, Gradebook, Student, SubmittedAssignment, GradeCell, Grade, BaseCell, SubmittedNotebook
-from ..utils import parse_utc, temp_attrs, capture_log, as_timezone, to_numeric_tz
+from ..api import MissingEntry, Gradebook, Student, SubmittedAssignment, GradeCell, Grade, BaseCell, SubmittedNotebook, Notebook, Assignment
+from ..utils import parse_utc, capture_log, as_timezone, to_numeric_tz, DirectoryCache, check_directory
 from ..auth import Authenticator
+from ..analytics import assignment_analytics
+
+
+# listings of the autograded directories, shared by all API instances in a
+# process (e.g. all requests handled by the formgrader)
+_autograded_directories = DirectoryCache()
 
 
 class NbGraderAPI(LoggingConfigurable):
@@ -40,6 +50,24 @@ class NbGraderAPI(LoggingConfigurable):
         help="Format string for displaying timestamps"
     ).tag(config=True)
 
+    directory_cache_ttl = Float(
+        10,
+        help=(
+            "The number of seconds for which listings of the autograded "
+            "directories are used to check whether autograded notebooks "
+            "exist, before checking whether the directories have changed"
+        )
+    ).tag(config=True)
+
+    released_assignments_ttl = Float(
+        10,
+        help=(
+            "The maximum number of seconds for which the list of assignments "
+            "released to the exchange is reused, as long as the outbound "
+            "exchange directory has not changed, before it is listed again"
+        )
+    ).tag(config=True)
+
     @observe('log_level')
     def _log_level_changed(self, change):
         """Adjust the log level when log_level is set."""
@@ -66,6 +94,12 @@ class NbGraderAPI(LoggingConfigurable):
         self.log.setLevel(self.log_level)
         super(NbGraderAPI, self).__init__(**kwargs)
 
+        # the released assignments, as (time, (outbound directory, its
+        # mtime), assignments) of when they were last listed
+        self._released_lock = threading.Lock()
+        self._released = None
+        self._released_generation = 0
+
         if coursedir is None:
             self.coursedir = CourseDirectory(parent=self)
         else:
@@ -76,6 +110,9 @@ class NbGraderAPI(LoggingConfigurable):
         else:
             self.authenticator = authenticator
 
+        self._check_exchange()
+
+    def _check_exchange(self):
         if sys.platform != 'win32':
             lister = ExchangeList(
                 coursedir=self.coursedir,
@@ -96,6 +133,43 @@ class NbGraderAPI(LoggingConfigurable):
             self.exchange = ''
             self.exchange_missing = True
 
+    def refresh_exchange(self):
+        """Check again whether the exchange exists, e.g. because it was
+        created or removed since the API was set up. Unlike
+        :func:`~nbgrader.apps.api.NbGraderAPI.invalidate`, this only checks
+        the exchange directory, and keeps everything the API has cached.
+
+        """
+        if sys.platform == 'win32':
+            return
+
+        # the exchange is only checked if it is not group-shared, see
+        # Exchange.start
+        self.exchange_missing = not (
+            self.coursedir.groupshared or
+            check_directory(self.exchange, write=False, execute=False))
+
+    def invalidate(self):
+        """Forget what the API knows about the exchange and the course
+        directory, e.g. after they have been changed by something other than
+        this API. This checks again whether the exchange exists, and lists the
+        autograded directories again the next time they are needed.
+
+        The API is meant to be long-lived (e.g. the formgrader uses one for
+        all its requests), so that nothing has to be set up for every use. It
+        takes care of what it changes itself, so this only needs to be called
+        for changes made elsewhere.
+
+        """
+        _autograded_directories.invalidate(self.coursedir.root)
+        self._invalidate_released()
+        self._check_exchange()
+
+    def _invalidate_released(self):
+        with self._released_lock:
+            self._released = None
+            self._released_generation += 1
+
     @property
     def exchange_is_functional(self):
         return self.course_id and not self.exchange_missing and sys.platform != 'win32'
@@ -105,11 +179,122 @@ class NbGraderAPI(LoggingConfigurable):
         """An instance of :class:`nbgrader.api.Gradebook`.
 
         Note that each time this property is accessed, a new gradebook is
-        created. The user is responsible for destroying the gradebook through
+        created. This is cheap, as all gradebooks share the same database
+        engine. The user is responsible for destroying the gradebook through
         :func:`~nbgrader.api.Gradebook.close`.
 
         """
-        return Gradebook(self.coursedir.db_url, self.course_id)
+        return Gradebook.from_coursedir(self.coursedir, self.course_id)
+
+    def _course_directory(self, **kwargs):
+        # the actions run on their own copy of the course directory, as the
+        # API may be used by other threads (e.g. the formgrader's requests)
+        # while they run, which must not see their assignment and student ids
+        values = {name: getattr(self.coursedir, name) for name in self.coursedir.trait_names(config=True)}
+        values.update(kwargs)
+        return CourseDirectory(parent=self, **values)
+
+    def _run_converter(self, app):
+        # the submissions are processed one at a time, because the API is used
+        # by long-running, multithreaded processes (e.g. the notebook server
+        # running the formgrader), which must not be forked to process them in
+        # parallel
+        app.jobs = 1
+        return capture_log(app)
+
+    def _autograded_path(self, student_id, assignment_id):
+        return os.path.abspath(self.coursedir.format_path(
+            self.coursedir.autograded_directory,
+            student_id=student_id,
+            assignment_id=assignment_id))
+
+    def _autograded_notebook_exists(self, student_id, assignment_id, notebook_id):
+        return _autograded_directories.exists(
+            os.path.join(self._autograded_path(student_id, assignment_id), "{}.ipynb".format(notebook_id)),
+            self.directory_cache_ttl)
+
+    def _version_token(self, *parts):
+        # the token changes whenever the gradebook changes, or any of the
+        # given (JSON serializable) parts describing the files changes
+        with self.gradebook as gb:
+            version = gb.version()
+        data = json.dumps([version] + list(parts), sort_keys=True)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def _glob_directory(self, directory, student_id, assignment_id):
+        return sorted(glob.glob(self.coursedir.format_path(
+            directory, student_id=student_id, assignment_id=assignment_id)))
+
+    def get_assignments_version(self):
+        """Get a token that changes whenever the information returned by
+        self.get_assignments() may have changed. It is much cheaper to
+        compute than the information itself, so it can be used to tell
+        whether a copy of the information is still current.
+
+        Returns
+        -------
+        version: string
+
+        """
+        if self.exchange_is_functional:
+            released = sorted(glob.glob(os.path.join(
+                self.exchange, self.course_id, "outbound", "*")))
+        else:
+            released = []
+
+        return self._version_token(
+            self._glob_directory(self.coursedir.source_directory, '.', '*'),
+            self._glob_directory(self.coursedir.release_directory, '.', '*'),
+            self._glob_directory(self.coursedir.submitted_directory, '*', '*'),
+            released)
+
+    def get_submissions_version(self, assignment_id):
+        """Get a token that changes whenever the information returned by
+        self.get_submissions(assignment_id) or
+        self.get_notebook_submissions(assignment_id, ...) may have changed.
+
+        Arguments
+        ---------
+        assignment_id: string
+            The name of the assignment
+
+        Returns
+        -------
+        version: string
+
+        """
+        submissions = []
+        for student_id in sorted(self.get_submitted_students(assignment_id)):
+            timestamp = os.path.join(self.coursedir.format_path(
+                self.coursedir.submitted_directory,
+                student_id=student_id,
+                assignment_id=assignment_id), "timestamp.txt")
+            try:
+                mtime = os.stat(timestamp).st_mtime
+            except OSError:
+                mtime = None
+
+            # the autograded directories are checked through the same cached
+            # listings as when the submissions are listed, so the token does
+            # not change before the submissions do
+            autograded = self._autograded_path(student_id, assignment_id)
+            submissions.append([
+                student_id, mtime,
+                _autograded_directories.isdir(autograded, self.directory_cache_ttl),
+                sorted(_autograded_directories.listdir(autograded, self.directory_cache_ttl))])
+
+        return self._version_token(assignment_id, submissions)
+
+    def get_students_version(self):
+        """Get a token that changes whenever the information returned by
+        self.get_students() may have changed.
+
+        Returns
+        -------
+        version: string
+
+        """
+        return self._version_token(sorted(self.get_submitted_students("*")))
 
     def get_source_assignments(self):
         """Get the names of all assignments in the `source` directory.
@@ -155,16 +340,39 @@ class NbGraderAPI(LoggingConfigurable):
             A set of assignment names
 
         """
-        if self.exchange_is_functional:
-            lister = ExchangeList(
-                coursedir=self.coursedir,
-                authenticator=self.authenticator,
-                parent=self)
-            released = set([x['assignment_id'] for x in lister.start()])
-        else:
-            released = set([])
+        if not self.exchange_is_functional:
+            return set([])
 
-        return released
+        # listing the exchange is expensive, so the assignments are only
+        # listed again once the outbound directory has changed (checked with
+        # a single stat), or after a few seconds in case it changed without
+        # its modification time changing
+        outbound = os.path.join(self.exchange, self.course_id, "outbound")
+        try:
+            validator = (outbound, os.stat(outbound).st_mtime)
+        except OSError:
+            validator = (outbound, None)
+
+        now = time.time()
+        with self._released_lock:
+            cached = self._released
+            generation = self._released_generation
+        if cached is not None and cached[1] == validator and now - cached[0] < self.released_assignments_ttl:
+            return set(cached[2])
+
+        lister = ExchangeList(
+            coursedir=self.coursedir,
+            authenticator=self.authenticator,
+            parent=self)
+        released = frozenset([x['assignment_id'] for x in lister.start()])
+
+        # don't cache the listing if the cache was invalidated in the
+        # meantime, as the exchange may have changed after it was listed
+        with self._released_lock:
+            if self._released_generation == generation:
+                self._released = (now, validator, released)
+
+        return set(released)
 
     def get_submitted_students(self, assignment_id):
         """Get the ids of students that have submitted a given assignment
@@ -264,11 +472,8 @@ class NbGraderAPI(LoggingConfigurable):
         students = set([])
         for student_id in ag_students:
             # skip files that aren't directories
-            filename = self.coursedir.format_path(
-                self.coursedir.autograded_directory,
-                student_id=student_id,
-                assignment_id=assignment_id)
-            if not os.path.isdir(filename):
+            filename = self._autograded_path(student_id, assignment_id)
+            if not _autograded_directories.isdir(filename, self.directory_cache_ttl):
                 continue
 
             # get the timestamps and check whether the submitted timestamp is
@@ -282,7 +487,21 @@ class NbGraderAPI(LoggingConfigurable):
 
         return students
 
-    def get_assignment(self, assignment_id, released=None):
+    def get_ungraded_students(self, assignment_id):
+        """Get the ids of students whose submission for a given assignment
+        has not been autograded yet, i.e. who have submitted it (see
+        self.get_submitted_students) but whose submission has not been
+        autograded (see self.get_autograded_students).
+
+        Returns
+        -------
+        students: set
+            A set of student ids
+
+        """
+        return self.get_submitted_students(assignment_id) - self.get_autograded_students(assignment_id)
+
+    def get_assignment(self, assignment_id, released=None, stats=None):
         """Get information about an assignment given its name.
 
         Arguments
@@ -292,6 +511,9 @@ class NbGraderAPI(LoggingConfigurable):
         released: list
             (Optional) A set of names of released assignments, obtained via
             self.get_released_assignments().
+        stats: dict
+            (Optional) The score statistics of all assignments, obtained via
+            self.gradebook.score_stats().
 
         Returns
         -------
@@ -324,10 +546,13 @@ class NbGraderAPI(LoggingConfigurable):
                     assignment["display_duedate"] = None
                     assignment["duedate_notimezone"] = None
                 assignment["duedate_timezone"] = to_numeric_tz(self.timezone)
-                assignment["average_score"] = gb.average_assignment_score(assignment_id)
-                assignment["average_code_score"] = gb.average_assignment_code_score(assignment_id)
-                assignment["average_written_score"] = gb.average_assignment_written_score(assignment_id)
-                assignment["average_task_score"] = gb.average_assignment_task_score(assignment_id)
+                if stats is None:
+                    stats = gb.score_stats()
+                assignment_stats = stats[assignment_id]
+                assignment["average_score"] = assignment_stats["average_score"]
+                assignment["average_code_score"] = assignment_stats["average_code_score"]
+                assignment["average_written_score"] = assignment_stats["average_written_score"]
+                assignment["average_task_score"] = assignment_stats["average_task_score"]
 
         except MissingEntry:
             assignment = {
@@ -386,10 +611,12 @@ class NbGraderAPI(LoggingConfigurable):
 
         """
         released = self.get_released_assignments()
+        with self.gradebook as gb:
+            stats = gb.score_stats()
 
         assignments = []
         for x in self.get_source_assignments():
-            assignments.append(self.get_assignment(x, released=released))
+            assignments.append(self.get_assignment(x, released=released, stats=stats))
 
         assignments.sort(key=lambda x: (x["duedate"] if x["duedate"] is not None else "None", x["name"]))
         return assignments
@@ -416,13 +643,14 @@ class NbGraderAPI(LoggingConfigurable):
 
             # if the assignment exists in the database
             if assignment and assignment.notebooks:
+                stats = gb.score_stats(assignment.name)
                 notebooks = []
                 for notebook in assignment.notebooks:
                     x = notebook.to_dict()
-                    x["average_score"] = gb.average_notebook_score(notebook.name, assignment.name)
-                    x["average_code_score"] = gb.average_notebook_code_score(notebook.name, assignment.name)
-                    x["average_written_score"] = gb.average_notebook_written_score(notebook.name, assignment.name)
-                    x["average_task_score"] = gb.average_notebook_task_score(notebook.name, assignment.name)
+                    x["average_score"] = stats[notebook.name]["average_score"]
+                    x["average_code_score"] = stats[notebook.name]["average_code_score"]
+                    x["average_written_score"] = stats[notebook.name]["average_written_score"]
+                    x["average_task_score"] = stats[notebook.name]["average_task_score"]
                     notebooks.append(x)
 
             # if it doesn't exist in the database
@@ -459,6 +687,30 @@ class NbGraderAPI(LoggingConfigurable):
 
         return notebooks
 
+    def get_assignment_analytics(self, assignment_id, bins=10):
+        """Get the score distributions and item statistics of an assignment.
+        See :func:`nbgrader.analytics.assignment_analytics` for details.
+
+        Arguments
+        ---------
+        assignment_id: string
+            The name of the assignment
+        bins: int
+            (Optional) The number of histogram bins
+
+        Returns
+        -------
+        analytics: dict
+            A dictionary containing the statistics of the assignment, or None
+            if the assignment does not exist in the database
+
+        """
+        with self.gradebook as gb:
+            try:
+                return assignment_analytics(gb, assignment_id, bins=bins)
+            except MissingEntry:
+                return None
+
     def get_submission(self, assignment_id, student_id, ungraded=None, students=None):
         """Get information about a student's submission of an assignment.
 
@@ -568,14 +820,34 @@ class NbGraderAPI(LoggingConfigurable):
 
         return submission
 
-    def get_submissions(self, assignment_id):
+    def get_submissions(self, assignment_id, sort=None, limit=None, offset=None,
+                        needs_manual_grade=None, student_prefix=None):
         """Get a list of submissions of an assignment. Each submission
         corresponds to a student.
 
+        The submissions are sorted by student, or by `sort` and then by
+        student. The submissions that have been autograded are sorted,
+        filtered and paged through in the database, and the ones that still
+        need to be autograded (which have no scores yet) are sorted in among
+        them.
+
         Arguments
         ---------
         assignment_id: string
             The name of the assignment
+        sort: string
+            (Optional) The key to sort by, see
+            :func:`~nbgrader.api.Gradebook.submission_dicts`
+        limit: int
+            (Optional) The maximum number of submissions to return
+        offset: int
+            (Optional) The number of submissions to skip
+        needs_manual_grade: bool
+            (Optional) Only return submissions that do (or do not) need
+            manual grading
+        student_prefix: string
+            (Optional) Only return submissions of students whose id starts
+            with this
 
         Returns
         -------
@@ -583,15 +855,56 @@ class NbGraderAPI(LoggingConfigurable):
             A list of dictionaries containing information about each submission
 
         """
+        if sort:
+            name = sort[1:] if sort.startswith("-") else sort
+            if name not in ("student", "first_name", "last_name", "timestamp", "score", "needs_manual_grade"):
+                raise ValueError("Cannot sort by '{}'".format(name))
+
+        # only the autograded submissions that may end up on the page are
+        # loaded, in the order of the page
+        offset = offset or 0
+        stop = None if limit is None else offset + limit
+        ungraded = self.get_ungraded_students(assignment_id)
         with self.gradebook as gb:
-            db_submissions = gb.submission_dicts(assignment_id)
+            db_submissions = gb.submission_dicts(
+                assignment_id, sort=sort, limit=stop,
+                needs_manual_grade=needs_manual_grade,
+                student_prefix=student_prefix, exclude_students=ungraded)
+        submissions = self._format_submissions(db_submissions)
+        submissions.extend(self._ungraded_submissions(
+            assignment_id, ungraded, needs_manual_grade, student_prefix))
+
+        # sorted the same way as in the database: by student, and then (in a
+        # stable sort) by the key, with missing values first
+        submissions.sort(key=lambda x: x["student"])
+        if sort:
+            def key(x):
+                value = x.get(name)
+                if name in ("first_name", "last_name"):
+                    value = value or ""
+                return (value is not None, value)
+            submissions.sort(key=key, reverse=sort.startswith("-"))
+
+        return submissions[offset:stop]
+
+    def _ungraded_submissions(self, assignment_id, ungraded, needs_manual_grade, student_prefix):
+        # submissions that still need to be autograded never need to be
+        # graded manually
+        if needs_manual_grade:
+            return []
+        if student_prefix:
+            ungraded = [x for x in ungraded if x.startswith(student_prefix)]
+        if not ungraded:
+            return []
 
-        ungraded = self.get_submitted_students(assignment_id) - self.get_autograded_students(assignment_id)
         students = {x['id']: x for x in self.get_students()}
+        return [
+            self.get_submission(assignment_id, student_id, ungraded=ungraded, students=students)
+            for student_id in ungraded]
+
+    def _format_submissions(self, db_submissions):
         submissions = []
         for submission in db_submissions:
-            if submission["student"] in ungraded:
-                continue
             ts = submission["timestamp"]
             if ts:
                 submission["timestamp"] = ts.isoformat()
@@ -603,13 +916,6 @@ class NbGraderAPI(LoggingConfigurable):
             submission["autograded"] = True
             submission["submitted"] = True
             submissions.append(submission)
-
-        for student_id in ungraded:
-            submission = self.get_submission(
-                assignment_id, student_id, ungraded=ungraded, students=students)
-            submissions.append(submission)
-
-        submissions.sort(key=lambda x: x["student"])
         return submissions
 
     def get_solution_cell_ids(self, assignment_id, notebook_id):
@@ -765,6 +1071,17 @@ class NbGraderAPI(LoggingConfigurable):
 
         return submissions
 
+    def _submitted_notebooks_exist(self):
+        # whether all notebooks are guaranteed to be submitted, see
+        # _filter_existing_notebooks
+        if self.exchange_is_functional:
+            app = ExchangeSubmit(
+                    coursedir=self.coursedir,
+                    authenticator=self.authenticator,
+                    parent=self)
+            return app.strict
+        return False
+
     def _filter_existing_notebooks(self, assignment_id, notebooks):
         """Filters a list of notebooks so that it only includes those notebooks
         which actually exist on disk.
@@ -792,25 +1109,15 @@ class NbGraderAPI(LoggingConfigurable):
         # If students are using the exchange and submitting with
         # ExchangeSubmit.strict == True, then all the notebooks we expect
         # should be here already so we don't need to filter for only
-        # existing notebooks in that case.
-        if self.exchange_is_functional:
-            app = ExchangeSubmit(
-                    coursedir=self.coursedir,
-                    authenticator=self.authenticator,
-                    parent=self)
-            if app.strict:
-                return sorted(notebooks, key=lambda x: x.id)
+        # existing notebooks in that case. Otherwise, the checks are answered
+        # from listings of the autograded directories, which are only read
+        # again when they change.
+        if self._submitted_notebooks_exist():
+            return sorted(notebooks, key=lambda x: x.id)
 
         submissions = list()
         for nb in notebooks:
-            filename = os.path.join(
-                os.path.abspath(self.coursedir.format_path(
-                    self.coursedir.autograded_directory,
-                    student_id=nb.student.id,
-                    assignment_id=assignment_id)),
-                "{}.ipynb".format(nb.name))
-
-            if os.path.exists(filename):
+            if self._autograded_notebook_exists(nb.student.id, assignment_id, nb.name):
                 submissions.append(nb)
 
         return sorted(submissions, key=lambda x: x.id)
@@ -837,15 +1144,37 @@ class NbGraderAPI(LoggingConfigurable):
             submissions = self._filter_existing_notebooks(assignment_id, notebooks)
         return dict([(x.id, i) for i, x in enumerate(submissions)])
 
-    def get_notebook_submissions(self, assignment_id, notebook_id):
+    def get_notebook_submissions(self, assignment_id, notebook_id, sort=None,
+                                 limit=None, offset=None, needs_manual_grade=None,
+                                 failed_tests=None, flagged=None, student_prefix=None):
         """Get a list of submissions for a particular notebook in an assignment.
 
+        The submissions are sorted by id, unless another key to sort by is
+        given. They are sorted, filtered and paged through in the database.
+
         Arguments
         ---------
         assignment_id: string
             The name of the assignment
         notebook_id: string
             The name of the notebook
+        sort: string
+            (Optional) The key to sort by, see
+            :func:`~nbgrader.api.Gradebook.notebook_submission_dicts`
+        limit: int
+            (Optional) The maximum number of submissions to return
+        offset: int
+            (Optional) The number of submissions to skip
+        needs_manual_grade: bool
+            (Optional) Only return submissions that do (or do not) need
+            manual grading
+        failed_tests: bool
+            (Optional) Only return submissions that do (or do not) fail tests
+        flagged: bool
+            (Optional) Only return submissions that are (or are not) flagged
+        student_prefix: string
+            (Optional) Only return submissions of students whose id starts
+            with this
 
         Returns
         -------
@@ -859,14 +1188,27 @@ class NbGraderAPI(LoggingConfigurable):
             except MissingEntry:
                 return []
 
-            submissions = gb.notebook_submission_dicts(notebook_id, assignment_id)
+            rows = gb.db.query(SubmittedNotebook.id, SubmittedAssignment.student_id)\
+                .join(SubmittedAssignment, Notebook, Assignment)\
+                .filter(Notebook.name == notebook_id, Assignment.name == assignment_id)\
+                .all()
+            if self._submitted_notebooks_exist():
+                existing = sorted(x for x, _ in rows)
+            else:
+                existing = sorted(
+                    submission_id for submission_id, student_id in rows
+                    if self._autograded_notebook_exists(student_id, assignment_id, notebook_id))
+            indices = dict((x, i) for i, x in enumerate(existing))
+
+            submissions = gb.notebook_submission_dicts(
+                notebook_id, assignment_id, sort=sort or "id", limit=limit,
+                offset=offset, needs_manual_grade=needs_manual_grade,
+                failed_tests=failed_tests, flagged=flagged,
+                student_prefix=student_prefix,
+                exclude_ids=[x for x, _ in rows if x not in indices])
 
-        indices = self.get_notebook_submission_indices(assignment_id, notebook_id)
         for nb in submissions:
-            nb['index'] = indices.get(nb['id'], None)
-
-        submissions = [x for x in submissions if x['index'] is not None]
-        submissions.sort(key=lambda x: x["id"])
+            nb['index'] = indices[nb['id']]
         return submissions
 
     def get_student(self, student_id, submitted=None):
@@ -987,14 +1329,7 @@ class NbGraderAPI(LoggingConfigurable):
 
             submissions = []
             for notebook in assignment.notebooks:
-                filename = os.path.join(
-                    os.path.abspath(self.coursedir.format_path(
-                        self.coursedir.autograded_directory,
-                        student_id=student_id,
-                        assignment_id=assignment_id)),
-                    "{}.ipynb".format(notebook.name))
-
-                if os.path.exists(filename):
+                if self._autograded_notebook_exists(student_id, assignment_id, notebook.name):
                     submissions.append(notebook.to_dict())
                 else:
                     submissions.append({
@@ -1052,11 +1387,12 @@ class NbGraderAPI(LoggingConfigurable):
             - log (string): captured log output
 
         """
-        with temp_attrs(self.coursedir, assignment_id=assignment_id):
-            app = GenerateAssignment(coursedir=self.coursedir, parent=self)
-            app.force = force
-            app.create_assignment = create
-            return capture_log(app)
+        app = GenerateAssignment(
+            coursedir=self._course_directory(assignment_id=assignment_id),
+            parent=self)
+        app.force = force
+        app.create_assignment = create
+        return self._run_converter(app)
 
     def unrelease(self, assignment_id):
         """Run ``nbgrader list --remove`` for a particular assignment.
@@ -1077,13 +1413,15 @@ class NbGraderAPI(LoggingConfigurable):
 
         """
         if sys.platform != 'win32':
-            with temp_attrs(self.coursedir, assignment_id=assignment_id):
-                app = ExchangeList(
-                    coursedir=self.coursedir,
-                    authenticator=self.authenticator,
-                    parent=self)
-                app.remove = True
-                return capture_log(app)
+            app = ExchangeList(
+                coursedir=self._course_directory(assignment_id=assignment_id),
+                authenticator=self.authenticator,
+                parent=self)
+            app.remove = True
+            result = capture_log(app)
+
+            self._invalidate_released()
+            return result
 
     def release(self, *args, **kwargs):
         """Deprecated, please use `release_assignment` instead."""
@@ -1113,12 +1451,14 @@ class NbGraderAPI(LoggingConfigurable):
 
         """
         if sys.platform != 'win32':
-            with temp_attrs(self.coursedir, assignment_id=assignment_id):
-                app = ExchangeReleaseAssignment(
-                    coursedir=self.coursedir,
-                    authenticator=self.authenticator,
-                    parent=self)
-                return capture_log(app)
+            app = ExchangeReleaseAssignment(
+                coursedir=self._course_directory(assignment_id=assignment_id),
+                authenticator=self.authenticator,
+                parent=self)
+            result = capture_log(app)
+
+            self._invalidate_released()
+            return result
 
     def collect(self, assignment_id, update=True):
         """Run ``nbgrader collect`` for a particular assignment.
@@ -1142,13 +1482,12 @@ class NbGraderAPI(LoggingConfigurable):
 
         """
         if sys.platform != 'win32':
-            with temp_attrs(self.coursedir, assignment_id=assignment_id):
-                app = ExchangeCollect(
-                    coursedir=self.coursedir,
-                    authenticator=self.authenticator,
-                    parent=self)
-                app.update = update
-                return capture_log(app)
+            app = ExchangeCollect(
+                coursedir=self._course_directory(assignment_id=assignment_id),
+                authenticator=self.authenticator,
+                parent=self)
+            app.update = update
+            return capture_log(app)
 
     def autograde(self, assignment_id, student_id, force=True, create=True):
         """Run ``nbgrader autograde`` for a particular assignment and student.
@@ -1176,11 +1515,15 @@ class NbGraderAPI(LoggingConfigurable):
             - log (string): captured log output
 
         """
-        with temp_attrs(self.coursedir, assignment_id=assignment_id, student_id=student_id):
-            app = Autograde(coursedir=self.coursedir, parent=self)
-            app.force = force
-            app.create_student = create
-            return capture_log(app)
+        app = Autograde(
+            coursedir=self._course_directory(assignment_id=assignment_id, student_id=student_id),
+            parent=self)
+        app.force = force
+        app.create_student = create
+        result = self._run_converter(app)
+
+        _autograded_directories.invalidate(self._autograded_path(student_id, assignment_id))
+        return result
 
     def generate_feedback(self, assignment_id, student_id=None, force=True):
         """Run ``nbgrader generate_feedback`` for a particular assignment and student.
@@ -1211,20 +1554,13 @@ class NbGraderAPI(LoggingConfigurable):
         c = Config()
         c.HTMLExporter.template_file = 'feedback.tpl'
         if student_id is not None:
-            with temp_attrs(self.coursedir,
-                            assignment_id=assignment_id,
-                            student_id=student_id):
-                app = GenerateFeedback(coursedir=self.coursedir, parent=self)
-                app.update_config(c)
-                app.force = force
-                return capture_log(app)
+            coursedir = self._course_directory(assignment_id=assignment_id, student_id=student_id)
         else:
-            with temp_attrs(self.coursedir,
-                            assignment_id=assignment_id):
-                app = GenerateFeedback(coursedir=self.coursedir, parent=self)
-                app.update_config(c)
-                app.force = force
-                return capture_log(app)
+            coursedir = self._course_directory(assignment_id=assignment_id)
+        app = GenerateFeedback(coursedir=coursedir, parent=self)
+        app.update_config(c)
+        app.force = force
+        return self._run_converter(app)
 
     def release_feedback(self, assignment_id, student_id=None):
         """Run ``nbgrader release_feedback`` for a particular assignment/student.
@@ -1247,20 +1583,13 @@ class NbGraderAPI(LoggingConfigurable):
             - log (string): captured log output
 
         """
-        if student_id is not None:
-            with temp_attrs(self.coursedir, assignment_id=assignment_id, student_id=student_id):
-                app = ExchangeReleaseFeedback(
-                    coursedir=self.coursedir,
-                    authentictor=self.authenticator,
-                    parent=self)
-                return capture_log(app)
-        else:
-            with temp_attrs(self.coursedir, assignment_id=assignment_id, student_id='*'):
-                app = ExchangeReleaseFeedback(
-                    coursedir=self.coursedir,
-                    authentictor=self.authenticator,
-                    parent=self)
-                return capture_log(app)
+        if student_id is None:
+            student_id = '*'
+        app = ExchangeReleaseFeedback(
+            coursedir=self._course_directory(assignment_id=assignment_id, student_id=student_id),
+            authentictor=self.authenticator,
+            parent=self)
+        return capture_log(app)
 
     def fetch_feedback(self, assignment_id, student_id):
         """Run ``nbgrader fetch_feedback`` for a particular assignment/student.
@@ -1283,20 +1612,18 @@ class NbGraderAPI(LoggingConfigurable):
             - value (list of dict): all submitted assignments
 
         """
-        with temp_attrs(self.coursedir, assignment_id=assignment_id, student_id=student_id):
-            app = ExchangeFetchFeedback(
-                coursedir=self.coursedir,
-                authentictor=self.authenticator,
-                parent=self)
-            ret_dic = capture_log(app)
-            # assignment tab needs a 'value' field with the info needed to repopulate
-            # the tables.
-        with temp_attrs(self.coursedir, assignment_id='*', student_id=student_id):
-            lister_rel = ExchangeList(
-                inbound=False, cached=True,
-                coursedir=self.coursedir,
-                authenticator=self.authenticator,
-                config=self.config)
-            assignments = lister_rel.start()
-            ret_dic["value"] = sorted(assignments, key=lambda x: (x['course_id'], x['assignment_id']))
+        app = ExchangeFetchFeedback(
+            coursedir=self._course_directory(assignment_id=assignment_id, student_id=student_id),
+            authentictor=self.authenticator,
+            parent=self)
+        ret_dic = capture_log(app)
+        # assignment tab needs a 'value' field with the info needed to repopulate
+        # the tables.
+        lister_rel = ExchangeList(
+            inbound=False, cached=True,
+            coursedir=self._course_directory(assignment_id='*', student_id=student_id),
+            authenticator=self.authenticator,
+            config=self.config)
+        assignments = lister_rel.start()
+        ret_dic["value"] = sorted(assignments, key=lambda x: (x['course_id'], x['assignment_id']))
         return ret_dic
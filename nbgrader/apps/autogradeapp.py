@@ -12,6 +12,7 @@ aliases = {
 }
 aliases.update(nbgrader_aliases)
 aliases.update({
+    'jobs': 'BaseConverter.jobs',
 })
 
 flags = {}
@@ -29,6 +30,11 @@ flags.update({
         },
         "Don't execute notebooks and clear output when autograding."
     ),
+    'cache': (
+        {'Autograde': {'use_cache': True}},
+        "Restore autograded notebooks from the autograde cache when nothing "
+        "relevant has changed, rather than executing them again."
+    ),
     'force': (
         {'BaseConverter': {'force': True}},
         "Overwrite an assignment/submission if it already exists."
@@ -81,6 +87,11 @@ class AutogradeApp(NbGrader):
 
             nbgrader autograde "Problem Set 1" --notebook "1*"
 
+        To autograde several submissions at once, e.g. using four worker
+        processes:
+
+            nbgrader autograde "Problem Set 1" --jobs 4
+
         By default, student submissions are re-executed and their output cleared.
         For long running notebooks, it can be useful to disable this with the
         '--no-execute' flag:
@@ -91,7 +91,7 @@ class DbStudentAddApp(DbBaseApp):
         }
 
         self.log.info("Creating/updating student with ID '%s': %s", student_id, student)
-        with Gradebook(self.coursedir.db_url, self.course_id, self.authenticator) as gb:
+        with Gradebook.from_coursedir(self.coursedir, self.course_id, self.authenticator) as gb:
             gb.update_or_create_student(student_id, **student)
 
 student_remove_flags = {}
@@ -125,7 +125,7 @@ class DbStudentRemoveApp(DbBaseApp):
 
         student_id = self.extra_args[0]
 
-        with Gradebook(self.coursedir.db_url, self.course_id, self.authenticator) as gb:
+        with Gradebook.from_coursedir(self.coursedir, self.course_id, self.authenticator) as gb:
             try:
                 student = gb.find_student(student_id)
             except MissingEntry:
@@ -219,7 +219,7 @@ class DbGenericImportApp(DbBaseApp):
         self.log.info("Importing from: '%s'", path)
 
 
-        with Gradebook(self.coursedir.db_url, self.course_id, self.authenticator) as gb:
+        with Gradebook.from_coursedir(self.coursedir, self.course_id, self.authenticator) as gb:
             with open(path, 'r') as fh:
                 reader = csv.DictReader(fh)
                 reader.fieldnames = self._preprocess_keys(reader.fieldnames)
@@ -292,7 +292,7 @@ class DbStudentListApp(DbBaseApp):
     def start(self):
         super(DbStudentListApp, self).start()
 
-        with Gradebook(self.coursedir.db_url, self.course_id, self.authenticator) as gb:
+        with Gradebook.from_coursedir(self.coursedir, self.course_id, self.authenticator) as gb:
             print("There are %d students in the database:" % len(gb.students))
             for student in gb.students:
                 print("%s (%s, %s) -- %s, %s" % (student.id, student.last_name, student.first_name, student.email, student.lms_user_id))
@@ -330,7 +330,7 @@ class DbAssignmentAddApp(DbBaseApp):
         }
 
         self.log.info("Creating/updating assignment with ID '%s': %s", assignment_id, assignment)
-        with Gradebook(self.coursedir.db_url, self.course_id, self.authenticator) as gb:
+        with Gradebook.from_coursedir(self.coursedir, self.course_id, self.authenticator) as gb:
             gb.update_or_create_assignment(assignment_id, **assignment)
 
 
@@ -365,7 +365,7 @@ class DbAssignmentRemoveApp(DbBaseApp):
 
         assignment_id = self.extra_args[0]
 
-        with Gradebook(self.coursedir.db_url, self.course_id, self.authenticator) as gb:
+        with Gradebook.from_coursedir(self.coursedir, self.course_id, self.authenticator) as gb:
             try:
                 assignment = gb.find_assignment(assignment_id)
             except MissingEntry:
@@ -415,7 +415,7 @@ class DbAssignmentListApp(DbBaseApp):
     def start(self):
         super(DbAssignmentListApp, self).start()
 
-        with Gradebook(self.coursedir.db_url, self.course_id, self.authenticator) as gb:
+        with Gradebook.from_coursedir(self.coursedir, self.course_id, self.authenticator) as gb:
             print("There are %d assignments in the database:" % len(gb.assignments))
             for assignment in gb.assignments:
                 print("%s (due: %s)" % (assignment.name, assignment.duedate))
@@ -499,7 +499,7 @@ class DbUpgradeApp(DbBaseApp):
     def _backup_db_file(self, db_file):
         """Backup a database file"""
         if not os.path.exists(db_file):
-            with Gradebook("sqlite:///{}".format(db_file), self.course_id, self.authenticator):
+            with Gradebook("sqlite:///{}".format(db_file), self.course_id, self.authenticator, sqlite_pragmas=self.coursedir.db_sqlite_pragmas):
                 pass
 
         timestamp = datetime.now().strftime('.%Y-%m-%d-%H%M%S.%f')
@@ -519,6 +519,45 @@ class DbUpgradeApp(DbBaseApp):
         dbutil.upgrade(self.coursedir.db_url)
 
 
+scores_flags = {}
+scores_flags.update(flags)
+scores_flags.update({
+    'rebuild': (
+        {'DbScoresApp': {'rebuild': True}},
+        "Recompute all the stored scores, rather than just checking them."
+    ),
+})
+
+class DbScoresApp(DbBaseApp):
+
+    name = u'nbgrader-db-scores'
+    description = u'Check or rebuild the scores stored in the nbgrader database'
+
+    aliases = aliases
+    flags = scores_flags
+
+    rebuild = Bool(False, help="Recompute all the stored scores, rather than just checking them.").tag(config=True)
+
+    def start(self):
+        super(DbScoresApp, self).start()
+
+        with Gradebook.from_coursedir(self.coursedir, self.course_id, self.authenticator) as gb:
+            if self.rebuild:
+                self.log.info("Rebuilding the stored scores")
+                gb.rebuild_score_aggregates()
+                return
+
+            errors = gb.check_score_aggregates()
+            for table, id, column, stored, expected in errors:
+                self.log.error(
+                    "Stored %s of %s '%s' is %s, should be %s",
+                    column, table, id, stored, expected)
+
+            if errors:
+                self.fail("!!! The stored scores are out of date, rerun with --rebuild to fix them.")
+            self.log.info("The stored scores are up to date")
+
+
 class DbApp(DbBaseApp):
 
     name = u'nbgrader-db'
@@ -549,6 +588,14 @@ class DbApp(DbBaseApp):
                 """
             ).strip()
         ),
+        scores=(
+            DbScoresApp,
+            dedent(
+                """
+                Check or rebuild the scores stored in the nbgrader database.
+                """
+            ).strip()
+        ),
     )
 
     @default("classes")
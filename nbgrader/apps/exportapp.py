@@ -75,5 +75,5 @@ class ExportApp(NbGrader):
     def start(self):
         super(ExportApp, self).start()
         self.init_plugin()
-        with Gradebook(self.coursedir.db_url, self.coursedir.course_id) as gb:
+        with Gradebook.from_coursedir(self.coursedir) as gb:
             self.plugin_inst.export(gb)
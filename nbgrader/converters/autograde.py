@@ -1,8 +1,14 @@
+import io
 import os
+import json
 import shutil
+import hashlib
+import datetime
+import nbformat
 
 from textwrap import dedent
-from traitlets import Bool, List, Dict
+from traitlets import Bool, List, Dict, Integer, Unicode, Instance, default
+from nbconvert.exporters import Exporter
 
 from .base import BaseConverter, NbGraderException
 from ..preprocessors import (
@@ -10,6 +16,7 @@ from ..preprocessors import (
     Execute, LimitOutput, OverwriteKernelspec, CheckCellMetadata, Unscramble)
 from ..api import Gradebook, MissingEntry
 from .. import utils
+from .._version import __version__
 
 
 class Autograde(BaseConverter):
@@ -37,6 +44,58 @@ class Autograde(BaseConverter):
         )
     ).tag(config=True)
 
+    in_memory_pipeline = Bool(
+        True,
+        help=dedent(
+            """
+            Whether to run the sanitizing and the autograding preprocessors on
+            the notebook in memory, and only write the autograded notebook to
+            disk once. If False, the sanitized notebook is written to the
+            autograded directory and read back in before autograding it.
+            """
+        )
+    ).tag(config=True)
+
+    use_cache = Bool(
+        False,
+        help=dedent(
+            """
+            Whether to cache autograded notebooks. The cache is keyed by a hash
+            of the submitted notebook, the source notebook, the other files in
+            the submission and the configuration of the autograding
+            preprocessors. If nothing relevant has changed since a notebook
+            was last autograded (for example when re-running with --force),
+            the autograded notebook is restored from the cache and its grades
+            are saved to the database without executing it again.
+            """
+        )
+    ).tag(config=True)
+
+    cache_directory = Unicode(
+        help=dedent(
+            """
+            The directory in which to store cached autograded notebooks.
+            Defaults to `.nbgrader_cache/autograde` inside the course root.
+            The directory can safely be removed to clear the cache.
+            """
+        )
+    ).tag(config=True)
+
+    cache_budget = Integer(
+        1024 * 1024 * 1024,
+        help=dedent(
+            """
+            The maximum number of bytes of autograded notebooks to keep in
+            `Autograde.cache_directory`. The least recently used notebooks are
+            removed from the cache when it is exceeded after autograding.
+            """
+        )
+    ).tag(config=True)
+
+    @default("cache_directory")
+    def _cache_directory_default(self):
+        return os.path.join(self.coursedir.root, ".nbgrader_cache", "autograde")
+
     _sanitizing = True
 
     @property
@@ -65,11 +124,50 @@ class Autograde(BaseConverter):
         AssignLatePenalties,
         CheckCellMetadata
     ])
+    cached_preprocessors = List([
+        SaveAutoGrades,
+        AssignLatePenalties
+    ])
 
     preprocessors = List([])
 
+    # exporter running both the sanitize and autograde preprocessors, used by
+    # the in-memory pipeline
+    _pipeline_exporter = Instance(Exporter, allow_none=True)
+
+    _gradebook = Instance(Gradebook, allow_none=True)
+
+    @property
+    def gradebook(self):
+        """The gradebook shared by all steps of processing a submission. It
+        is opened on first use and closed once the submission has been
+        processed.
+
+        """
+        if self._gradebook is None:
+            self._gradebook = Gradebook.from_coursedir(self.coursedir)
+        return self._gradebook
+
+    def _close_gradebook(self):
+        if self._gradebook is not None:
+            self._gradebook.close()
+            self._gradebook = None
+
+    def convert_assignment(self, assignment):
+        try:
+            return super(Autograde, self).convert_assignment(assignment)
+        finally:
+            self._close_gradebook()
+
+    def init_single_notebook_resources(self, notebook_filename):
+        resources = super(Autograde, self).init_single_notebook_resources(notebook_filename)
+        resources['nbgrader']['gradebook'] = self.gradebook
+        return resources
+
     def init_assignment(self, assignment_id, student_id):
         super(Autograde, self).init_assignment(assignment_id, student_id)
+        gb = self.gradebook
+
         # try to get the student from the database, and throw an error if it
         # doesn't exist
         student = {}
@@ -82,41 +180,37 @@ class Autograde(BaseConverter):
             if 'id' in student:
                 del student['id']
             self.log.info("Creating/updating student with ID '%s': %s", student_id, student)
-            with Gradebook(self.coursedir.db_url, self.coursedir.course_id) as gb:
-                gb.update_or_create_student(student_id, **student)
+            gb.update_or_create_student(student_id, **student)
 
         else:
-            with Gradebook(self.coursedir.db_url, self.coursedir.course_id) as gb:
-                try:
-                    gb.find_student(student_id)
-                except MissingEntry:
-                    msg = "No student with ID '%s' exists in the database" % student_id
-                    self.log.error(msg)
-                    raise NbGraderException(msg)
-
-        # make sure the assignment exists
-        with Gradebook(self.coursedir.db_url, self.coursedir.course_id) as gb:
             try:
-                gb.find_assignment(assignment_id)
+                gb.find_student(student_id)
             except MissingEntry:
-                msg = "No assignment with ID '%s' exists in the database" % assignment_id
+                msg = "No student with ID '%s' exists in the database" % student_id
                 self.log.error(msg)
                 raise NbGraderException(msg)
 
+        # make sure the assignment exists
+        try:
+            assignment = gb.find_assignment(assignment_id)
+        except MissingEntry:
+            msg = "No assignment with ID '%s' exists in the database" % assignment_id
+            self.log.error(msg)
+            raise NbGraderException(msg)
+
         # try to read in a timestamp from file
         src_path = self._format_source(assignment_id, student_id)
         timestamp = self.coursedir.get_existing_timestamp(src_path)
-        with Gradebook(self.coursedir.db_url, self.coursedir.course_id) as gb:
-            if timestamp:
-                submission = gb.update_or_create_submission(
-                    assignment_id, student_id, timestamp=timestamp)
-                self.log.info("%s submitted at %s", submission, timestamp)
-
-                # if the submission is late, print out how many seconds late it is
-                if timestamp and submission.total_seconds_late > 0:
-                    self.log.warning("%s is %s seconds late", submission, submission.total_seconds_late)
-            else:
-                submission = gb.update_or_create_submission(assignment_id, student_id)
+        if timestamp:
+            submission = gb.update_or_create_submission(
+                assignment_id, student_id, timestamp=timestamp)
+            self.log.info("%s submitted at %s", submission, timestamp)
+
+            # if the submission is late, print out how many seconds late it is
+            if timestamp and submission.total_seconds_late > 0:
+                self.log.warning("%s is %s seconds late", submission, submission.total_seconds_late)
+        else:
+            submission = gb.update_or_create_submission(assignment_id, student_id)
 
         # copy files over from the source directory
         self.log.info("Overwriting files with master versions from the source directory")
@@ -138,16 +232,13 @@ class Autograde(BaseConverter):
 
         # ignore notebooks that aren't in the database
         notebooks = []
-        with Gradebook(self.coursedir.db_url, self.coursedir.course_id) as gb:
-            for notebook in self.notebooks:
-                notebook_id = os.path.splitext(os.path.basename(notebook))[0]
-                try:
-                    gb.find_notebook(notebook_id, assignment_id)
-                except MissingEntry:
-                    self.log.warning("Skipping unknown notebook: %s", notebook)
-                    continue
-                else:
-                    notebooks.append(notebook)
+        notebook_ids = set(notebook.name for notebook in assignment.notebooks)
+        for notebook in self.notebooks:
+            notebook_id = os.path.splitext(os.path.basename(notebook))[0]
+            if notebook_id not in notebook_ids:
+                self.log.warning("Skipping unknown notebook: %s", notebook)
+                continue
+            notebooks.append(notebook)
         self.notebooks = notebooks
         if len(self.notebooks) == 0:
             msg = "No notebooks found, did you forget to run 'nbgrader generate_assignment'?"
@@ -156,21 +247,22 @@ class Autograde(BaseConverter):
 
         # check for missing notebooks and give them a score of zero if they
         # do not exist
-        with Gradebook(self.coursedir.db_url, self.coursedir.course_id) as gb:
-            assignment = gb.find_assignment(assignment_id)
-            for notebook in assignment.notebooks:
-                path = os.path.join(self.coursedir.format_path(
-                    self.coursedir.submitted_directory,
-                    student_id,
-                    assignment_id), "{}.ipynb".format(notebook.name))
-                if not os.path.exists(path):
-                    self.log.warning("No submitted file: {}".format(path))
-                    submission = gb.find_submission_notebook(
-                        notebook.name, assignment_id, student_id)
-                    for grade in submission.grades:
-                        grade.auto_score = 0
-                        grade.needs_manual_grade = False
-                    gb.db.commit()
+        missing = False
+        for notebook in assignment.notebooks:
+            path = os.path.join(self.coursedir.format_path(
+                self.coursedir.submitted_directory,
+                student_id,
+                assignment_id), "{}.ipynb".format(notebook.name))
+            if not os.path.exists(path):
+                self.log.warning("No submitted file: {}".format(path))
+                submission = gb.find_submission_notebook(
+                    notebook.name, assignment_id, student_id)
+                for grade in submission.grades:
+                    grade.auto_score = 0
+                    grade.needs_manual_grade = False
+                missing = True
+        if missing:
+            gb.db.commit()
 
     def _init_preprocessors(self):
         self.exporter._preprocessors = []
@@ -182,7 +274,47 @@ class Autograde(BaseConverter):
         for pp in preprocessors:
             self.exporter.register_preprocessor(pp)
 
-    def convert_single_notebook(self, notebook_filename):
+    def _init_pipeline_exporter(self):
+        if self._pipeline_exporter is None:
+            self._pipeline_exporter = self.exporter_class(parent=self, config=self.config)
+
+        # the preprocessors keep state from the notebooks they process (e.g.
+        # the kernel arguments of Execute), so every notebook gets new ones
+        self._pipeline_exporter._preprocessors = []
+        for pp in self.sanitize_preprocessors + self.autograde_preprocessors:
+            self._pipeline_exporter.register_preprocessor(pp)
+
+    def _convert_single_notebook_in_memory(self, notebook_filename):
+        """Sanitize and autograde a notebook without writing the sanitized
+        notebook to disk in between.
+
+        """
+        self._init_pipeline_exporter()
+
+        self.log.info("Sanitizing and autograding %s", notebook_filename)
+        resources = self.init_single_notebook_resources(notebook_filename)
+
+        # the notebook is executed in the directory it would have been read
+        # from by the second pass, i.e. the autograded directory
+        gd = resources['nbgrader']
+        dest = self._format_dest(gd['assignment'], gd['student'])
+        if not os.path.exists(dest):
+            os.makedirs(dest)
+
+        modified_date = datetime.datetime.fromtimestamp(os.path.getmtime(notebook_filename))
+        resources['metadata'] = {
+            'name': gd['notebook'],
+            'path': dest,
+            'modified_date': modified_date.strftime("%B %d, %Y")
+        }
+
+        with io.open(notebook_filename, encoding='utf-8') as fh:
+            nb = nbformat.read(fh, as_version=4)
+
+        output, resources = self._pipeline_exporter.from_notebook_node(nb, resources=resources)
+        self.write_single_notebook(output, resources)
+
+    def _convert_single_notebook_two_pass(self, notebook_filename):
         self.log.info("Sanitizing %s", notebook_filename)
         self._sanitizing = True
         self._init_preprocessors()
@@ -196,3 +328,111 @@ class Autograde(BaseConverter):
             super(Autograde, self).convert_single_notebook(notebook_filename)
         finally:
             self._sanitizing = True
+
+    def _cache_key(self, notebook_filename, resources):
+        """Compute the hash of everything that determines the result of
+        autograding a notebook.
+
+        """
+        gd = resources['nbgrader']
+        m = hashlib.sha256()
+        m.update(utils.to_bytes(__version__))
+        m.update(utils.to_bytes("+".join([gd['assignment'], gd['notebook'], gd['student']])))
+
+        # the submitted notebook and the master version of it
+        m.update(utils.to_bytes(utils.compute_hashcode(notebook_filename, method='sha1')))
+        source_path = os.path.join(
+            self.coursedir.format_path(self.coursedir.source_directory, '.', gd['assignment']),
+            "{}.ipynb".format(gd['notebook']))
+        if os.path.exists(source_path):
+            m.update(utils.to_bytes(utils.compute_hashcode(source_path, method='sha1')))
+
+        # other files in the submission, which the notebook might use
+        dest_path = self._format_dest(gd['assignment'], gd['student'])
+        for filename in sorted(utils.find_all_files(dest_path, ["*.ipynb", "timestamp.txt"])):
+            m.update(utils.to_bytes(os.path.relpath(filename, dest_path)))
+            m.update(utils.to_bytes(utils.compute_hashcode(filename, method='sha1')))
+
+        # configuration of the preprocessors that produce the notebook
+        sections = set()
+        for pp in self.sanitize_preprocessors + self.autograde_preprocessors:
+            sections.update(cls.__name__ for cls in pp.mro())
+        config = dict((x, self.config[x]) for x in sorted(sections) if x in self.config)
+        m.update(utils.to_bytes(json.dumps(config, sort_keys=True, default=repr)))
+
+        return m.hexdigest()
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_directory, key[:2], "{}.ipynb".format(key))
+
+    def _restore_from_cache(self, cache_path, resources):
+        self.log.info("Restoring cached autograded notebook %s", cache_path)
+        self.exporter._preprocessors = []
+        for pp in self.cached_preprocessors:
+            self.exporter.register_preprocessor(pp)
+        output, resources = self.exporter.from_filename(cache_path, resources=resources)
+        self.write_single_notebook(output, resources)
+        # mark it as recently used, so it is the last to be evicted
+        os.utime(cache_path)
+
+    def _save_to_cache(self, notebook_filename, cache_path):
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+        # write to a temporary file first, so that concurrent autograders
+        # never see a partially written notebook
+        tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+        shutil.copyfile(notebook_filename, tmp_path)
+        os.replace(tmp_path, cache_path)
+
+    def prune_cache(self):
+        """Remove the least recently used notebooks from the autograde cache
+        until it fits in `Autograde.cache_budget`.
+
+        """
+        entries = []
+        for dirname, _, filenames in os.walk(self.cache_directory):
+            for filename in filenames:
+                path = os.path.join(dirname, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, path, st.st_size))
+
+        size = sum(x[2] for x in entries)
+        for _, path, file_size in sorted(entries):
+            if size <= self.cache_budget:
+                break
+            self.log.debug("Removing %s from the autograde cache", path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= file_size
+
+    def convert_notebooks(self):
+        try:
+            super(Autograde, self).convert_notebooks()
+        finally:
+            # only the main process prunes the cache, once all the (parallel)
+            # workers are done with it
+            if self.use_cache:
+                self.prune_cache()
+
+    def convert_single_notebook(self, notebook_filename):
+        cache_path = None
+        if self.use_cache:
+            resources = self.init_single_notebook_resources(notebook_filename)
+            cache_path = self._cache_path(self._cache_key(notebook_filename, resources))
+            if os.path.exists(cache_path):
+                self._restore_from_cache(cache_path, resources)
+                return
+
+        if self.in_memory_pipeline:
+            self._convert_single_notebook_in_memory(notebook_filename)
+        else:
+            self._convert_single_notebook_two_pass(notebook_filename)
+
+        notebook_filename = os.path.join(self.writer.build_directory, os.path.basename(notebook_filename))
+        if cache_path is not None:
+            self._save_to_cache(notebook_filename, cache_path)
@@ -4,17 +4,21 @@ import re
 import shutil
 import sqlalchemy
 import traceback
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from traitlets.config import LoggingConfigurable, Config
 from traitlets import Bool, List, Dict, Integer, Instance, Type
-from traitlets import default
+from traitlets import default, validate, TraitError
 from textwrap import dedent
 from nbconvert.exporters import Exporter, NotebookExporter
 from nbconvert.writers import FilesWriter
 
+from ..api import get_engine
 from ..coursedir import CourseDirectory
 from ..utils import find_all_files, rmtree, remove
-from ..preprocessors.execute import UnresponsiveKernelError
+from ..preprocessors.execute import UnresponsiveKernelError, shutdown_kernel_pools
 from ..nbgraderformat import SchemaTooOldError, SchemaTooNewError
 
 
@@ -33,6 +37,26 @@ class BaseConverter(LoggingConfigurable):
 
     force = Bool(False, help="Whether to overwrite existing assignments/submissions").tag(config=True)
 
+    jobs = Integer(
+        1,
+        help=dedent(
+            """
+            The number of submissions to process in parallel. Each
+            submission (i.e. each assignment of each student) is processed in
+            its own worker process. The default of 1 processes submissions
+            one at a time in the current process. Actions run from the
+            formgrader (or through :class:`nbgrader.apps.api.NbGraderAPI`)
+            always process submissions one at a time.
+            """
+        )
+    ).tag(config=True)
+
+    @validate("jobs")
+    def _validate_jobs(self, proposal):
+        if proposal['value'] < 1:
+            raise TraitError("jobs must be at least 1")
+        return proposal['value']
+
     permissions = Integer(
         help=dedent(
             """
@@ -68,12 +92,14 @@ class BaseConverter(LoggingConfigurable):
         self.exporter = self.exporter_class(parent=self, config=self.config)
         for pp in self.preprocessors:
             self.exporter.register_preprocessor(pp)
-        currdir = os.getcwd()
-        os.chdir(self.coursedir.root)
+        # paths are absolute or resolved against the root of the course
+        # directory (and notebooks are executed in their own directory), so
+        # this does not change the current directory, which would affect every
+        # thread in the process (e.g. when run from the formgrader)
         try:
             self.convert_notebooks()
         finally:
-            os.chdir(currdir)
+            shutdown_kernel_pools()
 
     @default("classes")
     def _classes_default(self):
@@ -154,7 +180,9 @@ class BaseConverter(LoggingConfigurable):
         resources['nbgrader']['student'] = gd['student_id']
         resources['nbgrader']['assignment'] = gd['assignment_id']
         resources['nbgrader']['notebook'] = gd['notebook_id']
+        resources['nbgrader']['root'] = self.coursedir.root
         resources['nbgrader']['db_url'] = self.coursedir.db_url
+        resources['nbgrader']['db_sqlite_pragmas'] = self.coursedir.db_sqlite_pragmas
 
         return resources
 
@@ -292,107 +320,163 @@ class BaseConverter(LoggingConfigurable):
         output, resources = self.exporter.from_filename(notebook_filename, resources=resources)
         self.write_single_notebook(output, resources)
 
-    def convert_notebooks(self):
+    def _handle_failure(self, gd):
+        dest = os.path.normpath(self._format_dest(gd['assignment_id'], gd['student_id']))
+        if self.coursedir.notebook_id == "*":
+            if os.path.exists(dest):
+                self.log.warning("Removing failed assignment: {}".format(dest))
+                rmtree(dest)
+        else:
+            for notebook in self.notebooks:
+                filename = os.path.splitext(os.path.basename(notebook))[0] + self.exporter.file_extension
+                path = os.path.join(dest, filename)
+                if os.path.exists(path):
+                    self.log.warning("Removing failed notebook: {}".format(path))
+                    remove(path)
+
+    def convert_assignment(self, assignment):
+        """Process a single (assignment_id, student_id) unit of work.
+
+        Returns a list of ``(assignment_id, student_id)`` tuples for
+        submissions that failed in a recoverable way (this list is empty on
+        success). Unrecoverable errors are raised as
+        :class:`NbGraderException`.
+
+        """
         errors = []
 
-        def _handle_failure(gd):
-            dest = os.path.normpath(self._format_dest(gd['assignment_id'], gd['student_id']))
-            if self.coursedir.notebook_id == "*":
-                if os.path.exists(dest):
-                    self.log.warning("Removing failed assignment: {}".format(dest))
-                    rmtree(dest)
-            else:
-                for notebook in self.notebooks:
-                    filename = os.path.splitext(os.path.basename(notebook))[0] + self.exporter.file_extension
-                    path = os.path.join(dest, filename)
-                    if os.path.exists(path):
-                        self.log.warning("Removing failed notebook: {}".format(path))
-                        remove(path)
+        # initialize the list of notebooks and the exporter
+        self.notebooks = sorted(self.assignments[assignment])
 
-        for assignment in sorted(self.assignments.keys()):
-            # initialize the list of notebooks and the exporter
-            self.notebooks = sorted(self.assignments[assignment])
+        # parse out the assignment and student ids
+        regexp = self._format_source("(?P<assignment_id>.*)", "(?P<student_id>.*)", escape=True)
+        m = re.match(regexp, assignment)
+        if m is None:
+            msg = "Could not match '%s' with regexp '%s'" % (assignment, regexp)
+            self.log.error(msg)
+            raise NbGraderException(msg)
+        gd = m.groupdict()
 
-            # parse out the assignment and student ids
-            regexp = self._format_source("(?P<assignment_id>.*)", "(?P<student_id>.*)", escape=True)
-            m = re.match(regexp, assignment)
-            if m is None:
-                msg = "Could not match '%s' with regexp '%s'" % (assignment, regexp)
-                self.log.error(msg)
-                raise NbGraderException(msg)
-            gd = m.groupdict()
+        try:
+            # determine whether we actually even want to process this submission
+            should_process = self.init_destination(gd['assignment_id'], gd['student_id'])
+            if not should_process:
+                return errors
+
+            # initialize the destination
+            self.init_assignment(gd['assignment_id'], gd['student_id'])
+
+            # convert all the notebooks
+            for notebook_filename in self.notebooks:
+                self.convert_single_notebook(notebook_filename)
+
+            # set assignment permissions
+            self.set_permissions(gd['assignment_id'], gd['student_id'])
+
+        except UnresponsiveKernelError:
+            self.log.error(
+                "While processing assignment %s, the kernel became "
+                "unresponsive and we could not interrupt it. This probably "
+                "means that the students' code has an infinite loop that "
+                "consumes a lot of memory or something similar. nbgrader "
+                "doesn't know how to deal with this problem, so you will "
+                "have to manually edit the students' code (for example, to "
+                "just throw an error rather than enter an infinite loop). ",
+                assignment)
+            errors.append((gd['assignment_id'], gd['student_id']))
+            self._handle_failure(gd)
+
+        except sqlalchemy.exc.OperationalError:
+            self._handle_failure(gd)
+            self.log.error(traceback.format_exc())
+            msg = (
+                "There was an error accessing the nbgrader database. This "
+                "may occur if you recently upgraded nbgrader. To resolve "
+                "the issue, first BACK UP your database and then run the "
+                "command `nbgrader db upgrade`."
+            )
+            self.log.error(msg)
+            raise NbGraderException(msg)
 
-            try:
-                # determine whether we actually even want to process this submission
-                should_process = self.init_destination(gd['assignment_id'], gd['student_id'])
-                if not should_process:
-                    continue
+        except SchemaTooOldError:
+            self._handle_failure(gd)
+            msg = (
+                "One or more notebooks in the assignment use an old version \n"
+                "of the nbgrader metadata format. Please **back up your class files \n"
+                "directory** and then update the metadata using:\n\nnbgrader update .\n"
+            )
+            self.log.error(msg)
+            raise NbGraderException(msg)
 
-                # initialize the destination
-                self.init_assignment(gd['assignment_id'], gd['student_id'])
+        except SchemaTooNewError:
+            self._handle_failure(gd)
+            msg = (
+                "One or more notebooks in the assignment use an newer version \n"
+                "of the nbgrader metadata format. Please update your version of \n"
+                "nbgrader to the latest version to be able to use this notebook.\n"
+            )
+            self.log.error(msg)
+            raise NbGraderException(msg)
 
-                # convert all the notebooks
-                for notebook_filename in self.notebooks:
-                    self.convert_single_notebook(notebook_filename)
+        except KeyboardInterrupt:
+            self._handle_failure(gd)
+            self.log.error("Canceled")
+            raise
 
-                # set assignment permissions
-                self.set_permissions(gd['assignment_id'], gd['student_id'])
+        except Exception:
+            self.log.error("There was an error processing assignment: %s", assignment)
+            self.log.error(traceback.format_exc())
+            errors.append((gd['assignment_id'], gd['student_id']))
+            self._handle_failure(gd)
 
-            except UnresponsiveKernelError:
-                self.log.error(
-                    "While processing assignment %s, the kernel became "
-                    "unresponsive and we could not interrupt it. This probably "
-                    "means that the students' code has an infinite loop that "
-                    "consumes a lot of memory or something similar. nbgrader "
-                    "doesn't know how to deal with this problem, so you will "
-                    "have to manually edit the students' code (for example, to "
-                    "just throw an error rather than enter an infinite loop). ",
-                    assignment)
-                errors.append((gd['assignment_id'], gd['student_id']))
-                _handle_failure(gd)
-
-            except sqlalchemy.exc.OperationalError:
-                _handle_failure(gd)
-                self.log.error(traceback.format_exc())
-                msg = (
-                    "There was an error accessing the nbgrader database. This "
-                    "may occur if you recently upgraded nbgrader. To resolve "
-                    "the issue, first BACK UP your database and then run the "
-                    "command `nbgrader db upgrade`."
-                )
-                self.log.error(msg)
-                raise NbGraderException(msg)
-
-            except SchemaTooOldError:
-                _handle_failure(gd)
-                msg = (
-                    "One or more notebooks in the assignment use an old version \n"
-                    "of the nbgrader metadata format. Please **back up your class files \n"
-                    "directory** and then update the metadata using:\n\nnbgrader update .\n"
-                )
-                self.log.error(msg)
-                raise NbGraderException(msg)
-
-            except SchemaTooNewError:
-                _handle_failure(gd)
-                msg = (
-                    "One or more notebooks in the assignment use an newer version \n"
-                    "of the nbgrader metadata format. Please update your version of \n"
-                    "nbgrader to the latest version to be able to use this notebook.\n"
-                )
-                self.log.error(msg)
-                raise NbGraderException(msg)
-
-            except KeyboardInterrupt:
-                _handle_failure(gd)
-                self.log.error("Canceled")
+        return errors
+
+    def _convert_assignments_parallel(self, assignments):
+        global _worker_converter
+
+        self.log.info("Processing %d submissions with %d jobs", len(assignments), self.jobs)
+        errors = []
+        context = multiprocessing.get_context("fork")
+        _worker_converter = self
+        try:
+            executor = ProcessPoolExecutor(max_workers=self.jobs, mp_context=context,
+                                           initializer=_init_worker)
+            futures = [executor.submit(_convert_assignment_in_worker, x) for x in assignments]
+            try:
+                # stop at the first unrecoverable error, whichever submission
+                # it is in, without starting the submissions that are left
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
                 raise
+            finally:
+                executor.shutdown(wait=True)
+        finally:
+            _worker_converter = None
+
+        for future in futures:
+            errors.extend(future.result())
+
+        return errors
 
-            except Exception:
-                self.log.error("There was an error processing assignment: %s", assignment)
-                self.log.error(traceback.format_exc())
-                errors.append((gd['assignment_id'], gd['student_id']))
-                _handle_failure(gd)
+    def convert_notebooks(self):
+        errors = []
+        assignments = sorted(self.assignments.keys())
+
+        jobs = self.jobs
+        if jobs > 1 and "fork" not in multiprocessing.get_all_start_methods():
+            self.log.warning(
+                "Parallel processing is not supported on this platform, "
+                "falling back to processing submissions one at a time.")
+            jobs = 1
+
+        if jobs > 1 and len(assignments) > 1:
+            errors = self._convert_assignments_parallel(assignments)
+        else:
+            for assignment in assignments:
+                errors.extend(self.convert_assignment(assignment))
 
         if len(errors) > 0:
             for assignment_id, student_id in errors:
@@ -411,3 +495,23 @@ class BaseConverter(LoggingConfigurable):
 
             self.log.error(msg)
             raise NbGraderException(msg)
+
+
+# The converter used by worker processes when processing submissions in
+# parallel. Worker processes are forked from the parent, so they inherit
+# this reference (and the fully configured converter) without pickling it.
+_worker_converter = None
+
+
+def _init_worker():
+    # The workers write to the gradebook at the same time, so unless the
+    # SQLite concurrency settings are enabled anyway, they at least have to
+    # wait for each other's locks rather than fail with "database is locked".
+    coursedir = _worker_converter.coursedir
+    if coursedir.db_sqlite_pragmas is None and coursedir.db_url.startswith("sqlite"):
+        get_engine(coursedir.db_url, sqlite_pragmas={
+            "busy_timeout": coursedir.db_sqlite_busy_timeout})
+
+
+def _convert_assignment_in_worker(assignment):
+    return _worker_converter.convert_assignment(assignment)
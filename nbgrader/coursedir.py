@@ -6,7 +6,7 @@ from textwrap import dedent
 from traitlets.config import LoggingConfigurable
 from traitlets import Integer, Bool, Unicode, List, default, validate, TraitError
 
-from .utils import full_split, parse_utc
+from .utils import full_split, parse_utc, sqlite_concurrency_pragmas
 
 
 class CourseDirectory(LoggingConfigurable):
@@ -187,6 +187,57 @@ class CourseDirectory(LoggingConfigurable):
         return "sqlite:///{}".format(
             os.path.abspath(os.path.join(self.root, "gradebook.db")))
 
+    db_sqlite_concurrency = Bool(
+        False,
+        help=dedent(
+            """
+            Configure SQLite gradebooks for concurrent access, e.g. when the
+            formgrader is used while `nbgrader autograde` is running: use
+            write-ahead logging (WAL) so that readers do not block the writer,
+            wait for locks to be released rather than failing with "database
+            is locked", sync less often to disk, and use a larger page cache.
+            Note that WAL mode is stored in the database file, and requires
+            the database to be on a local filesystem.
+            """
+        )
+    ).tag(config=True)
+
+    db_sqlite_busy_timeout = Integer(
+        30000,
+        help=dedent(
+            """
+            The number of milliseconds to wait for a locked SQLite gradebook
+            to become available. Only used if `db_sqlite_concurrency` is
+            enabled, or if submissions are processed in parallel (see
+            `--jobs`).
+            """
+        )
+    ).tag(config=True)
+
+    db_sqlite_cache_size = Integer(
+        -64000,
+        help=dedent(
+            """
+            The SQLite page cache size of each connection to the gradebook, in
+            pages, or in KiB if negative. Only used if `db_sqlite_concurrency`
+            is enabled.
+            """
+        )
+    ).tag(config=True)
+
+    @property
+    def db_sqlite_pragmas(self):
+        """The SQLite PRAGMAs to pass to :class:`~nbgrader.api.Gradebook`,
+        or None if `db_sqlite_concurrency` is disabled.
+
+        """
+        if not self.db_sqlite_concurrency:
+            return None
+
+        return sqlite_concurrency_pragmas(
+            busy_timeout=self.db_sqlite_busy_timeout,
+            cache_size=self.db_sqlite_cache_size)
+
     db_assignments = List(
         help=dedent(
             """
@@ -1,7 +1,6 @@
 from traitlets import Unicode, List
 
 from .base import BasePlugin
-from ..api import MissingEntry
 
 
 class ExportPlugin(BasePlugin):
@@ -31,6 +30,24 @@ class ExportPlugin(BasePlugin):
         """
         raise NotImplementedError
 
+    def grades(self, gradebook):
+        """Get the grades to export, i.e. one dictionary for every student
+        and assignment selected with ``self.student`` and ``self.assignment``
+        (or all of them, if these are empty). See
+        :func:`nbgrader.api.Gradebook.grade_matrix` for the contents of the
+        dictionaries.
+
+        Arguments
+        ---------
+        gradebook: :class:`nbgrader.api.Gradebook`
+            An instance of the gradebook
+
+        """
+        # make sure studentID(s) and assignment(s) are lists of strings
+        students = [str(item) for item in self.student] or None
+        assignments = [str(item) for item in self.assignment] or None
+        return gradebook.grade_matrix(assignments=assignments, students=students)
+
 
 class CsvExportPlugin(ExportPlugin):
     """CSV exporter plugin."""
@@ -60,7 +77,6 @@ class CsvExportPlugin(ExportPlugin):
         if allstudents:
             self.log.info("Exporting only students: %s", allstudents)
 
-        fh = open(dest, "w")
         keys = [
             "assignment",
             "duedate",
@@ -74,59 +90,19 @@ class CsvExportPlugin(ExportPlugin):
             "score",
             "max_score"
         ]
-        fh.write(",".join(keys) + "\n")
         fmt = ",".join(["{" + x + "}" for x in keys]) + "\n"
 
-        # Loop over each assignment in the database
-        for assignment in gradebook.assignments:
-
-            # only continue if assignment is required
-            if allassignments and assignment.name not in allassignments:
-                continue
+        with open(dest, "w") as fh:
+            fh.write(",".join(keys) + "\n")
 
-            # Loop over each student in the database
-            for student in gradebook.students:
-
-                # only continue if student is required
-                if allstudents and student.id not in allstudents:
-                    continue
-
-                # Create a dictionary that will store information 
-                # about this student's submitted assignment
+            # Students that didn't submit an assignment get a score of zero,
+            # and the rows are written as they are read from the database
+            for grade in self.grades(gradebook):
                 score = {}
-                score['assignment'] = assignment.name
-                score['duedate'] = assignment.duedate
-                score['student_id'] = student.id
-                score['last_name'] = student.last_name
-                score['first_name'] = student.first_name
-                score['email'] = student.email
-                score['max_score'] = assignment.max_score
-
-                # Try to find the submission in the database. If it
-                # doesn't exist, the `MissingEntry` exception will be
-                # raised, which means the student didn't submit 
-                # anything, so we assign them a score of zero.
-                try:
-                    submission = gradebook.find_submission(
-                        assignment.name, student.id)
-                except MissingEntry:
-                    score['timestamp'] = ''
-                    score['raw_score'] = 0.0
-                    score['late_submission_penalty'] = 0.0
-                    score['score'] = 0.0
-                else:
-                    penalty = submission.late_submission_penalty
-                    score['timestamp'] = submission.timestamp
-                    score['raw_score'] = submission.score
-                    score['late_submission_penalty'] = penalty
-                    score['score'] = max(0.0, submission.score - penalty)
-
-                for key in score:
-                    if score[key] is None:
+                for key in keys:
+                    if grade[key] is None:
                         score[key] = ''
-                    if not isinstance(score[key], str):
-                        score[key] = str(score[key])
+                    else:
+                        score[key] = str(grade[key])
 
                 fh.write(fmt.format(**score))
-
-        fh.close()
@@ -1,8 +1,31 @@
+from contextlib import contextmanager
 from nbconvert.preprocessors import Preprocessor
 from traitlets import List, Unicode, Bool
 
+from ..api import Gradebook
+
 class NbGraderPreprocessor(Preprocessor):
 
     default_language = Unicode('ipython')
     display_data_priority = List(['text/html', 'application/pdf', 'text/latex', 'image/svg+xml', 'image/png', 'image/jpeg', 'text/plain'])
     enabled = Bool(True, help="Whether to use this preprocessor when running nbgrader").tag(config=True)
+
+    @contextmanager
+    def open_gradebook(self, resources):
+        """Yield the gradebook to use for this notebook.
+
+        If the caller already has a gradebook open (and passed it in as
+        ``resources['nbgrader']['gradebook']``), that gradebook is used and
+        left open. Otherwise a new connection to ``resources['nbgrader']['db_url']``
+        (using the SQLite PRAGMAs in ``resources['nbgrader']['db_sqlite_pragmas']``,
+        if any) is opened and closed again afterwards.
+
+        """
+        gradebook = resources['nbgrader'].get('gradebook', None)
+        if gradebook is not None:
+            yield gradebook
+            return
+
+        with Gradebook(resources['nbgrader']['db_url'],
+                       sqlite_pragmas=resources['nbgrader'].get('db_sqlite_pragmas')) as gradebook:
+            yield gradebook
@@ -1,3 +1,10 @@
+import os
+import threading
+import multiprocessing.util
+
+from collections import deque
+from contextlib import contextmanager
+from jupyter_client import AsyncKernelManager, KernelManager
 from nbconvert.preprocessors import ExecutePreprocessor
 from traitlets import Bool, List, Integer
 from textwrap import dedent
@@ -8,6 +15,170 @@ class UnresponsiveKernelError(Exception):
     pass
 
 
+class KernelPool(object):
+    """A pool of pre-started kernels for a single kernelspec.
+
+    Kernels are started in background threads so that a warm kernel is
+    (usually) ready by the time the next notebook needs one. Kernels are never
+    reused: every call to :meth:`acquire` hands out a kernel that has not yet
+    executed any code, and the caller is responsible for shutting it down.
+
+    The kernel managers are blocking ones (as there is no event loop in the
+    threads that start them), but they hand out asynchronous clients, which
+    is what nbclient expects of the kernel managers it is given.
+
+    """
+
+    def __init__(self, kernel_name, kernel_manager_class, extra_arguments=None,
+                 size=1, prewarm=1, startup_timeout=60, config=None, log=None):
+        self.kernel_name = kernel_name
+        self.kernel_manager_class = kernel_manager_class
+        self.extra_arguments = list(extra_arguments or [])
+        self.size = size
+        self.startup_timeout = startup_timeout
+        self.config = config
+        self.log = log
+
+        self._cond = threading.Condition()
+        self._ready = deque()
+        self._pending = 0
+        self._closed = False
+
+        with self._cond:
+            for i in range(min(prewarm, size)):
+                self._spawn()
+
+    def _start_kernel(self):
+        km = self.kernel_manager_class(
+            kernel_name=self.kernel_name, config=self.config,
+            client_class='jupyter_client.asynchronous.AsyncKernelClient')
+        km.start_kernel(extra_arguments=self.extra_arguments)
+        kc = km.blocking_client()
+        kc.start_channels()
+        try:
+            kc.wait_for_ready(timeout=self.startup_timeout)
+        except RuntimeError:
+            km.shutdown_kernel(now=True)
+            raise
+        finally:
+            kc.stop_channels()
+        return km
+
+    def _warm_kernel(self):
+        try:
+            km = self._start_kernel()
+        except Exception:
+            if self.log:
+                self.log.warning("Could not pre-start a '%s' kernel", self.kernel_name, exc_info=True)
+            km = None
+
+        with self._cond:
+            self._pending -= 1
+            if km is not None:
+                self._ready.append(km)
+            self._cond.notify_all()
+
+    def _spawn(self):
+        # must be called with the lock held
+        self._pending += 1
+        thread = threading.Thread(target=self._warm_kernel)
+        thread.daemon = True
+        thread.start()
+
+    def _fill(self):
+        # must be called with the lock held
+        while not self._closed and len(self._ready) + self._pending < self.size:
+            self._spawn()
+
+    def acquire(self):
+        """Return the kernel manager of a started, never used kernel, and
+        begin warming up a replacement for it.
+
+        """
+        km = None
+        with self._cond:
+            while km is None:
+                while not self._ready and self._pending > 0:
+                    self._cond.wait()
+                if not self._ready:
+                    break
+                km = self._ready.popleft()
+                if not km.is_alive():
+                    km.cleanup()
+                    km = None
+            self._fill()
+
+        if km is None:
+            # nothing was warming up (or it failed to start), so we have to
+            # wait for a kernel after all
+            km = self._start_kernel()
+
+        return km
+
+    def shutdown(self):
+        """Shut down all idle kernels, waiting for kernels that are still
+        starting so that none of them are left behind.
+
+        """
+        with self._cond:
+            self._closed = True
+            while self._pending > 0:
+                self._cond.wait()
+            kernels = list(self._ready)
+            self._ready.clear()
+
+        for km in kernels:
+            km.shutdown_kernel(now=True)
+
+
+_kernel_pools = {}
+_kernel_pools_lock = threading.Lock()
+
+
+def shutdown_kernel_pools():
+    """Shut down the idle kernels of all kernel pools in this process."""
+    with _kernel_pools_lock:
+        pools = list(_kernel_pools.values())
+        _kernel_pools.clear()
+
+    for pool in pools:
+        pool.shutdown()
+
+
+def _reset_kernel_pools():
+    # Kernels (and the threads warming them up) belong to the parent process,
+    # so a forked child must start its own pools from scratch.
+    global _kernel_pools_lock
+    _kernel_pools_lock = threading.Lock()
+    _kernel_pools.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_kernel_pools)
+
+
+def get_kernel_pool(kernel_name, kernel_manager_class, extra_arguments, size,
+                    prewarm, startup_timeout, config=None, log=None):
+    """Get (or create) the process-wide kernel pool for a kernelspec."""
+    key = (kernel_name, kernel_manager_class, tuple(extra_arguments))
+    with _kernel_pools_lock:
+        if not _kernel_pools:
+            # Using a multiprocessing finalizer rather than atexit ensures
+            # the pools are also shut down in the worker processes used by
+            # parallel autograding.
+            multiprocessing.util.Finalize(None, shutdown_kernel_pools, exitpriority=10)
+        if key not in _kernel_pools:
+            _kernel_pools[key] = KernelPool(
+                kernel_name, kernel_manager_class,
+                extra_arguments=extra_arguments,
+                size=size,
+                prewarm=prewarm,
+                startup_timeout=startup_timeout,
+                config=config,
+                log=log)
+        return _kernel_pools[key]
+
+
 class Execute(NbGraderPreprocessor, ExecutePreprocessor):
 
     interrupt_on_timeout = Bool(True)
@@ -29,6 +200,85 @@ class Execute(NbGraderPreprocessor, ExecutePreprocessor):
         """)
     ).tag(config=True)
 
+    kernel_pool_size = Integer(0, help=dedent(
+        """
+        The number of kernels to keep started in the background, per
+        kernelspec, so that notebooks do not have to wait for kernel startup.
+        Each notebook still gets a fresh kernel which is never reused. This is
+        only supported for IPython kernels. The default of 0 disables the
+        kernel pool.
+        """)
+    ).tag(config=True)
+
+    kernel_pool_prewarm = Integer(1, help=dedent(
+        """
+        The number of kernels (at most ``kernel_pool_size``) to start as soon
+        as the kernel pool is created, i.e. before the first notebook is
+        executed. The remaining kernels are started as kernels get used.
+        """)
+    ).tag(config=True)
+
+    _pool_kernel = None
+
+    def _get_kernel_pool(self, kernel_name):
+        if self.kernel_pool_size <= 0:
+            return None
+
+        # only IPython kernels can be moved to the notebook's directory after
+        # they have been started
+        km = self.kernel_manager_class(kernel_name=kernel_name, config=self.config)
+        if not km.ipykernel:
+            return None
+
+        # the pool starts its kernels from threads without an event loop, so
+        # it needs a blocking kernel manager
+        kernel_manager_class = self.kernel_manager_class
+        if issubclass(kernel_manager_class, AsyncKernelManager):
+            kernel_manager_class = KernelManager
+
+        extra_arguments = list(self.extra_arguments)
+        hist_file = '--HistoryManager.hist_file={}'.format(self.ipython_hist_file)
+        if self.ipython_hist_file and not any(x.startswith('--HistoryManager.hist_file') for x in extra_arguments):
+            extra_arguments.append(hist_file)
+
+        return get_kernel_pool(
+            kernel_name, kernel_manager_class, extra_arguments,
+            self.kernel_pool_size, self.kernel_pool_prewarm, self.startup_timeout,
+            config=self.config, log=self.log)
+
+    @contextmanager
+    def setup_kernel(self, **kwargs):
+        if self.km is None or self.km is not self._pool_kernel:
+            with super(Execute, self).setup_kernel(**kwargs):
+                yield
+            return
+
+        # the kernel was started before we knew which notebook it would run,
+        # so move it to the notebook's directory first
+        with super(Execute, self).setup_kernel(**kwargs):
+            try:
+                path = self.resources.get('metadata', {}).get('path') or os.getcwd()
+                code = "import os; os.chdir({!r}); del os".format(os.path.abspath(path))
+                reply = self.wait_for_reply(self.kc.execute(code, silent=True, store_history=False))
+                if reply is None or reply['content']['status'] != 'ok':
+                    raise RuntimeError("Could not change the directory of the kernel to {}".format(path))
+                yield
+            finally:
+                # nbclient leaves the client of a kernel it was given running
+                self.kc.stop_channels()
+                self.kc = None
+
+    def _execute(self, nb, resources, pool):
+        if pool is None:
+            return super(Execute, self).preprocess(nb, resources)
+
+        self._pool_kernel = pool.acquire()
+        try:
+            return super(Execute, self).preprocess(nb, resources, km=self._pool_kernel)
+        finally:
+            self._pool_kernel.shutdown_kernel(now=self.shutdown_kernel == 'immediate')
+            self._pool_kernel = None
+
     def preprocess(self, nb, resources, retries=None):
         kernel_name = nb.metadata.get('kernelspec', {}).get('name', 'python')
         if self.extra_arguments == [] and kernel_name == "python":
@@ -37,8 +287,9 @@ class Execute(NbGraderPreprocessor, ExecutePreprocessor):
         if retries is None:
             retries = self.execute_retries
 
+        pool = self._get_kernel_pool(self.kernel_name or kernel_name)
         try:
-            output = super(Execute, self).preprocess(nb, resources)
+            output = self._execute(nb, resources, pool)
         except RuntimeError:
             if retries == 0:
                 raise UnresponsiveKernelError()
@@ -18,7 +18,8 @@ class GetGrades(NbGraderPreprocessor):
         self.db_url = resources['nbgrader']['db_url']
 
         # connect to the database
-        self.gradebook = Gradebook(self.db_url)
+        self.gradebook = Gradebook(
+            self.db_url, sqlite_pragmas=resources['nbgrader'].get('db_sqlite_pragmas'))
 
         with self.gradebook:
             # process the cells
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import io
+import os
 
 from nbformat import current_nbformat
 from traitlets import Unicode
@@ -22,9 +23,13 @@ class IncludeHeaderFooter(NbGraderPreprocessor):
         """
         new_cells = []
 
+        # the paths are relative to the root of the course directory, which
+        # is not necessarily the current directory
+        root = resources.get('nbgrader', {}).get('root', '')
+
         # header
         if self.header:
-            with io.open(self.header, encoding='utf-8') as fh:
+            with io.open(os.path.join(root, self.header), encoding='utf-8') as fh:
                 header_nb = read_nb(fh, as_version=current_nbformat)
             new_cells.extend(header_nb.cells)
 
@@ -33,7 +38,7 @@ class IncludeHeaderFooter(NbGraderPreprocessor):
 
         # footer
         if self.footer:
-            with io.open(self.footer, encoding='utf-8') as fh:
+            with io.open(os.path.join(root, self.footer), encoding='utf-8') as fh:
                 footer_nb = read_nb(fh, as_version=current_nbformat)
             new_cells.extend(footer_nb.cells)
 
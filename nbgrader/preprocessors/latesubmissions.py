@@ -2,7 +2,6 @@ from traitlets import Instance
 from traitlets import Type
 
 from .. import utils
-from ..api import Gradebook
 from ..plugins import BasePlugin
 from ..plugins import LateSubmissionPlugin
 from . import NbGraderPreprocessor
@@ -45,9 +44,8 @@ class AssignLatePenalties(NbGraderPreprocessor):
         self.init_plugin()
 
         # connect to the database
-        self.gradebook = Gradebook(self.db_url)
-
-        with self.gradebook:
+        with self.open_gradebook(resources) as gb:
+            self.gradebook = gb
             # process the late submissions
             nb, resources = super(AssignLatePenalties, self).preprocess(nb, resources)
             assignment = self.gradebook.find_submission(
@@ -1,7 +1,7 @@
 from nbformat.v4.nbbase import validate
 
 from .. import utils
-from ..api import Gradebook, MissingEntry
+from ..api import MissingEntry
 from . import NbGraderPreprocessor
 
 
@@ -15,9 +15,8 @@ class OverwriteCells(NbGraderPreprocessor):
         self.db_url = resources['nbgrader']['db_url']
 
         # connect to the database
-        self.gradebook = Gradebook(self.db_url)
-
-        with self.gradebook:
+        with self.open_gradebook(resources) as gb:
+            self.gradebook = gb
             nb, resources = super(OverwriteCells, self).preprocess(nb, resources)
 
         return nb, resources
@@ -1,7 +1,6 @@
 import json
 
 from . import NbGraderPreprocessor
-from ..api import Gradebook
 
 
 class OverwriteKernelspec(NbGraderPreprocessor):
@@ -11,9 +10,8 @@ class OverwriteKernelspec(NbGraderPreprocessor):
         # pull information from the resources
         notebook_id = resources['nbgrader']['notebook']
         assignment_id = resources['nbgrader']['assignment']
-        db_url = resources['nbgrader']['db_url']
 
-        with Gradebook(db_url) as gb:
+        with self.open_gradebook(resources) as gb:
             kernelspec = json.loads(
                 gb.find_notebook(notebook_id, assignment_id).kernelspec)
             self.log.debug("Source notebook kernelspec: {}".format(kernelspec))
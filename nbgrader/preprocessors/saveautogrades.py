@@ -1,5 +1,5 @@
 from .. import utils
-from ..api import Gradebook
+from ..api import MissingEntry
 from . import NbGraderPreprocessor
 
 
@@ -14,14 +14,43 @@ class SaveAutoGrades(NbGraderPreprocessor):
         self.db_url = resources['nbgrader']['db_url']
 
         # connect to the database
-        self.gradebook = Gradebook(self.db_url)
-
-        with self.gradebook:
-            # process the cells
-            nb, resources = super(SaveAutoGrades, self).preprocess(nb, resources)
+        with self.open_gradebook(resources) as gb:
+            self.gradebook = gb
+            with gb.count_queries() as counter:
+                # fetch all grades and comments up front, so that processing
+                # the cells only has to update them in memory
+                self.grades = gb.find_submission_notebook_grades(
+                    self.notebook_id, self.assignment_id, self.student_id)
+                self.comments = gb.find_submission_notebook_comments(
+                    self.notebook_id, self.assignment_id, self.student_id)
+
+                # process the cells
+                nb, resources = super(SaveAutoGrades, self).preprocess(nb, resources)
+
+                # and save all the changes at once
+                gb.db.commit()
+
+            self.num_queries = counter.count
+            self.log.debug(
+                "Saved autograder grades for %s using %d queries",
+                self.notebook_id, self.num_queries)
 
         return nb, resources
 
+    def _find_grade(self, grade_id):
+        try:
+            return self.grades[grade_id]
+        except KeyError:
+            raise MissingEntry("No such grade: {}/{}/{} for {}".format(
+                self.assignment_id, self.notebook_id, grade_id, self.student_id))
+
+    def _find_comment(self, grade_id):
+        try:
+            return self.comments[grade_id]
+        except KeyError:
+            raise MissingEntry("No such comment: {}/{}/{} for {}".format(
+                self.assignment_id, self.notebook_id, grade_id, self.student_id))
+
     def _add_score(self, cell, resources):
         """Graders can override the autograder grades, and may need to
         manually grade written solutions anyway. This function adds
@@ -32,11 +61,7 @@ class SaveAutoGrades(NbGraderPreprocessor):
         """
         # these are the fields by which we will identify the score
         # information
-        grade = self.gradebook.find_grade(
-            cell.metadata['nbgrader']['grade_id'],
-            self.notebook_id,
-            self.assignment_id,
-            self.student_id)
+        grade = self._find_grade(cell.metadata['nbgrader']['grade_id'])
 
         # determine what the grade is
         auto_score, _ = utils.determine_grade(cell, self.log)
@@ -49,21 +74,13 @@ class SaveAutoGrades(NbGraderPreprocessor):
         else:
             grade.needs_manual_grade = False
 
-        self.gradebook.db.commit()
-
     def _add_comment(self, cell, resources):
-        comment = self.gradebook.find_comment(
-            cell.metadata['nbgrader']['grade_id'],
-            self.notebook_id,
-            self.assignment_id,
-            self.student_id)
+        comment = self._find_comment(cell.metadata['nbgrader']['grade_id'])
         if cell.metadata.nbgrader.get("checksum", None) == utils.compute_checksum(cell) and not utils.is_task(cell):
             comment.auto_comment = "No response."
         else:
             comment.auto_comment = None
 
-        self.gradebook.db.commit()
-
     def preprocess_cell(self, cell, resources, cell_index):
         # if it's a grade cell, the add a grade
         if utils.is_grade(cell):
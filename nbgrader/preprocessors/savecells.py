@@ -87,7 +87,8 @@ class SaveCells(NbGraderPreprocessor):
         self.new_source_cells = {}
 
         # connect to the database
-        self.gradebook = Gradebook(self.db_url)
+        self.gradebook = Gradebook(
+            self.db_url, sqlite_pragmas=resources['nbgrader'].get('db_sqlite_pragmas'))
 
         with self.gradebook:
             nb, resources = super(SaveCells, self).preprocess(nb, resources)
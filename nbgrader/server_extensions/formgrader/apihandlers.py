@@ -1,10 +1,10 @@
 import json
 import os
 
-from tornado import web
+from tornado import web, gen
 
 from .base import BaseApiHandler, check_xsrf, check_notebook_dir
-from ...api import MissingEntry
+from ...api import MissingEntry, InvalidEntry
 from ...exchange import ExchangeList
 
 
@@ -16,52 +16,72 @@ class StatusHandler(BaseApiHandler):
 
 
 class GradeCollectionHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def get(self):
         submission_id = self.get_argument("submission_id")
+        grades = yield self.run_blocking(self._get_grades, submission_id)
+        self.write(json.dumps(grades))
+
+    def _get_grades(self, submission_id):
         try:
             notebook = self.gradebook.find_submission_notebook_by_id(submission_id)
         except MissingEntry:
             raise web.HTTPError(404)
-        self.write(json.dumps([g.to_dict() for g in notebook.grades]))
+        return [g.to_dict() for g in notebook.grades]
 
 
 class CommentCollectionHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def get(self):
         submission_id = self.get_argument("submission_id")
+        comments = yield self.run_blocking(self._get_comments, submission_id)
+        self.write(json.dumps(comments))
+
+    def _get_comments(self, submission_id):
         try:
             notebook = self.gradebook.find_submission_notebook_by_id(submission_id)
         except MissingEntry:
             raise web.HTTPError(404)
-        self.write(json.dumps([c.to_dict() for c in notebook.comments]))
+        return [c.to_dict() for c in notebook.comments]
 
 
 class GradeHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def get(self, grade_id):
+        grade = yield self.run_blocking(self._get_grade, grade_id)
+        self.write(json.dumps(grade))
+
+    def _get_grade(self, grade_id):
         try:
             grade = self.gradebook.find_grade_by_id(grade_id)
         except MissingEntry:
             raise web.HTTPError(404)
-        self.write(json.dumps(grade.to_dict()))
+        return grade.to_dict()
 
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def put(self, grade_id):
+        data = self.get_json_body()
+        grade = yield self.run_blocking(self._update_grade, grade_id, data)
+        self.write(json.dumps(grade))
+
+    def _update_grade(self, grade_id, data):
         try:
             grade = self.gradebook.find_grade_by_id(grade_id)
         except MissingEntry:
             raise web.HTTPError(404)
 
-        data = self.get_json_body()
         grade.manual_score = data.get("manual_score", None)
         grade.extra_credit = data.get("extra_credit", None)
         if grade.manual_score is None and grade.auto_score is None:
@@ -69,40 +89,91 @@ class GradeHandler(BaseApiHandler):
         else:
             grade.needs_manual_grade = False
         self.gradebook.db.commit()
-        self.write(json.dumps(grade.to_dict()))
+        grade = grade.to_dict()
+        self.invalidate_submission_orderings([grade])
+        return grade
 
 
 class CommentHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def get(self, grade_id):
+        comment = yield self.run_blocking(self._get_comment, grade_id)
+        self.write(json.dumps(comment))
+
+    def _get_comment(self, grade_id):
         try:
             comment = self.gradebook.find_comment_by_id(grade_id)
         except MissingEntry:
             raise web.HTTPError(404)
-        self.write(json.dumps(comment.to_dict()))
+        return comment.to_dict()
 
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def put(self, grade_id):
+        data = self.get_json_body()
+        comment = yield self.run_blocking(self._update_comment, grade_id, data)
+        self.write(json.dumps(comment))
+
+    def _update_comment(self, grade_id, data):
         try:
             comment = self.gradebook.find_comment_by_id(grade_id)
         except MissingEntry:
             raise web.HTTPError(404)
 
-        data = self.get_json_body()
         comment.manual_comment = data.get("manual_comment", None)
         self.gradebook.db.commit()
-        self.write(json.dumps(comment.to_dict()))
+        comment = comment.to_dict()
+        self.invalidate_submission_orderings([comment])
+        return comment
+
+
+class GradesAndCommentsHandler(BaseApiHandler):
+    @gen.coroutine
+    @web.authenticated
+    @check_xsrf
+    @check_notebook_dir
+    def put(self):
+        data = self.get_json_body() or {}
+        grades = data.get("grades", []) if isinstance(data, dict) else None
+        comments = data.get("comments", []) if isinstance(data, dict) else None
+        if not isinstance(grades, list) or not isinstance(comments, list):
+            raise web.HTTPError(400, "Expected lists of grades and comments")
+
+        result = yield self.run_blocking(self._update, grades, comments)
+        self.write(json.dumps(result))
+
+    def _update(self, grades, comments):
+        try:
+            grades, comments = self.gradebook.update_grades_and_comments(
+                grades=grades, comments=comments)
+        except MissingEntry:
+            raise web.HTTPError(404)
+        except InvalidEntry as e:
+            raise web.HTTPError(400, str(e))
+
+        result = {
+            "grades": [g.to_dict() for g in grades],
+            "comments": [c.to_dict() for c in comments]
+        }
+        self.invalidate_submission_orderings(result["grades"] + result["comments"])
+        return result
 
 
 class FlagSubmissionHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def post(self, submission_id):
+        submission = yield self.run_blocking(self._toggle_flag, submission_id)
+        self.write(json.dumps(submission))
+
+    def _toggle_flag(self, submission_id):
         try:
             submission = self.gradebook.find_submission_notebook_by_id(submission_id)
         except MissingEntry:
@@ -110,28 +181,34 @@ class FlagSubmissionHandler(BaseApiHandler):
 
         submission.flagged = not submission.flagged
         self.gradebook.db.commit()
-        self.write(json.dumps(submission.to_dict()))
+        return submission.to_dict()
 
 
 class AssignmentCollectionHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def get(self):
-        assignments = self.api.get_assignments()
-        self.write(json.dumps(assignments))
+        api = self.api
+        if (yield self.not_modified(api.get_assignments_version)):
+            return
+        assignments = yield self.run_blocking(api.get_assignments)
+        yield self.write_json_list(assignments)
 
 
 class AssignmentHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def get(self, assignment_id):
-        assignment = self.api.get_assignment(assignment_id)
+        assignment = yield self.run_blocking(self.api.get_assignment, assignment_id)
         if assignment is None:
             raise web.HTTPError(404)
         self.write(json.dumps(assignment))
 
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
@@ -143,70 +220,129 @@ class AssignmentHandler(BaseApiHandler):
             duedate = duedate + " " + timezone
         assignment = {"duedate": duedate}
         assignment_id = assignment_id.strip()
+        result = yield self.run_blocking(self._update, assignment_id, assignment)
+        self.write(json.dumps(result))
+
+    def _update(self, assignment_id, assignment):
         self.gradebook.update_or_create_assignment(assignment_id, **assignment)
         sourcedir = os.path.abspath(self.coursedir.format_path(self.coursedir.source_directory, '.', assignment_id))
         if not os.path.isdir(sourcedir):
             os.makedirs(sourcedir)
-        self.write(json.dumps(self.api.get_assignment(assignment_id)))
+        return self.api.get_assignment(assignment_id)
 
 
 class NotebookCollectionHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def get(self, assignment_id):
-        notebooks = self.api.get_notebooks(assignment_id)
+        notebooks = yield self.run_blocking(self.api.get_notebooks, assignment_id)
         self.write(json.dumps(notebooks))
 
 
+class AssignmentAnalyticsHandler(BaseApiHandler):
+    @gen.coroutine
+    @web.authenticated
+    @check_xsrf
+    @check_notebook_dir
+    def get(self, assignment_id):
+        try:
+            bins = int(self.get_argument("bins", "10"))
+        except ValueError:
+            raise web.HTTPError(400, "bins must be an integer")
+        if bins < 1:
+            raise web.HTTPError(400, "bins must be positive")
+
+        analytics = yield self.run_blocking(self.api.get_assignment_analytics, assignment_id, bins=bins)
+        if analytics is None:
+            raise web.HTTPError(404)
+        self.write(json.dumps(analytics))
+
+
 class SubmissionCollectionHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def get(self, assignment_id):
-        submissions = self.api.get_submissions(assignment_id)
-        self.write(json.dumps(submissions))
+        api = self.api
+        if (yield self.not_modified(api.get_submissions_version, assignment_id)):
+            return
+        try:
+            submissions = yield self.run_blocking(
+                api.get_submissions, assignment_id,
+                sort=self.get_argument("sort", None),
+                limit=self.get_int_argument("limit"),
+                offset=self.get_int_argument("offset"),
+                needs_manual_grade=self.get_bool_argument("needs_manual_grade"),
+                student_prefix=self.get_argument("student", None))
+        except ValueError as e:
+            raise web.HTTPError(400, str(e))
+        yield self.write_json_list(submissions)
 
 
 class SubmissionHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def get(self, assignment_id, student_id):
-        submission = self.api.get_submission(assignment_id, student_id)
+        submission = yield self.run_blocking(self.api.get_submission, assignment_id, student_id)
         if submission is None:
             raise web.HTTPError(404)
         self.write(json.dumps(submission))
 
 
 class SubmittedNotebookCollectionHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def get(self, assignment_id, notebook_id):
-        submissions = self.api.get_notebook_submissions(assignment_id, notebook_id)
-        self.write(json.dumps(submissions))
+        api = self.api
+        if (yield self.not_modified(api.get_submissions_version, assignment_id)):
+            return
+        try:
+            submissions = yield self.run_blocking(
+                api.get_notebook_submissions, assignment_id, notebook_id,
+                sort=self.get_argument("sort", None),
+                limit=self.get_int_argument("limit"),
+                offset=self.get_int_argument("offset"),
+                needs_manual_grade=self.get_bool_argument("needs_manual_grade"),
+                failed_tests=self.get_bool_argument("failed_tests"),
+                flagged=self.get_bool_argument("flagged"),
+                student_prefix=self.get_argument("student", None))
+        except ValueError as e:
+            raise web.HTTPError(400, str(e))
+        yield self.write_json_list(submissions)
 
 
 class StudentCollectionHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def get(self):
-        students = self.api.get_students()
-        self.write(json.dumps(students))
+        api = self.api
+        if (yield self.not_modified(api.get_students_version)):
+            return
+        students = yield self.run_blocking(api.get_students)
+        yield self.write_json_list(students)
 
 
 class StudentHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def get(self, student_id):
-        student = self.api.get_student(student_id)
+        student = yield self.run_blocking(self.api.get_student, student_id)
         if student is None:
             raise web.HTTPError(404)
         self.write(json.dumps(student))
 
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
@@ -218,113 +354,176 @@ class StudentHandler(BaseApiHandler):
             "email": data.get("email", None),
         }
         student_id = student_id.strip()
+        result = yield self.run_blocking(self._update, student_id, student)
+        self.write(json.dumps(result))
+
+    def _update(self, student_id, student):
         self.gradebook.update_or_create_student(student_id, **student)
-        self.write(json.dumps(self.api.get_student(student_id)))
+        return self.api.get_student(student_id)
 
 
 class StudentSubmissionCollectionHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def get(self, student_id):
-        submissions = self.api.get_student_submissions(student_id)
+        submissions = yield self.run_blocking(self.api.get_student_submissions, student_id)
         self.write(json.dumps(submissions))
 
 
 class StudentNotebookSubmissionCollectionHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def get(self, student_id, assignment_id):
-        submissions = self.api.get_student_notebook_submissions(student_id, assignment_id)
+        submissions = yield self.run_blocking(self.api.get_student_notebook_submissions, student_id, assignment_id)
         self.write(json.dumps(submissions))
 
 
 class AssignHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def post(self, assignment_id):
-        self.write(json.dumps(self.api.generate_assignment(assignment_id)))
+        result = yield self.submit_job("generate_assignment", assignment_id).future
+        self.write(json.dumps(result))
 
 
 class UnReleaseHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def post(self, assignment_id):
-        self.write(json.dumps(self.api.unrelease(assignment_id)))
+        result = yield self.submit_job("unrelease", assignment_id).future
+        self.write(json.dumps(result))
 
 
 class ReleaseHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def post(self, assignment_id):
-        self.write(json.dumps(self.api.release_assignment(assignment_id)))
+        result = yield self.submit_job("release_assignment", assignment_id).future
+        self.write(json.dumps(result))
 
 
 class CollectHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def post(self, assignment_id):
-        self.write(json.dumps(self.api.collect(assignment_id)))
+        result = yield self.submit_job("collect", assignment_id).future
+        self.write(json.dumps(result))
 
 
 class AutogradeHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def post(self, assignment_id, student_id):
-        self.write(json.dumps(self.api.autograde(assignment_id, student_id)))
+        result = yield self.submit_job("autograde", assignment_id, student_id).future
+        self.write(json.dumps(result))
 
 
 class GenerateAllFeedbackHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def post(self, assignment_id):
-        self.write(json.dumps(self.api.generate_feedback(assignment_id)))
+        result = yield self.submit_job("generate_feedback", assignment_id).future
+        self.write(json.dumps(result))
 
 
 class ReleaseAllFeedbackHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def post(self, assignment_id):
-        self.write(json.dumps(self.api.release_feedback(assignment_id)))
+        result = yield self.submit_job("release_feedback", assignment_id).future
+        self.write(json.dumps(result))
 
 
 class GenerateFeedbackHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def post(self, assignment_id, student_id):
-        self.write(json.dumps(self.api.generate_feedback(assignment_id, student_id)))
+        result = yield self.submit_job("generate_feedback", assignment_id, student_id).future
+        self.write(json.dumps(result))
 
 
 class ReleaseFeedbackHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def post(self, assignment_id, student_id):
-        self.write(json.dumps(self.api.release_feedback(assignment_id, student_id)))
+        result = yield self.submit_job("release_feedback", assignment_id, student_id).future
+        self.write(json.dumps(result))
+
+
+class JobCollectionHandler(BaseApiHandler):
+    @web.authenticated
+    @check_xsrf
+    def get(self):
+        jobs = [x.to_dict(log=False) for x in reversed(self.job_queue.jobs())]
+        self.write(json.dumps(jobs))
+
+    @web.authenticated
+    @check_xsrf
+    @check_notebook_dir
+    def post(self):
+        data = self.get_json_body() or {}
+        job = self.submit_job(
+            data.get("action"), data.get("assignment_id"), data.get("student_id"))
+        self.write(json.dumps(job.to_dict()))
+
+
+class JobHandler(BaseApiHandler):
+    @web.authenticated
+    @check_xsrf
+    def get(self, job_id):
+        job = self.job_queue.get(job_id)
+        if job is None:
+            raise web.HTTPError(404)
+        self.write(json.dumps(job.to_dict()))
+
+
+class CancelJobHandler(BaseApiHandler):
+    @web.authenticated
+    @check_xsrf
+    def post(self, job_id):
+        job = self.job_queue.cancel(job_id)
+        if job is None:
+            raise web.HTTPError(404)
+        self.write(json.dumps(job.to_dict()))
 
 
 class SolutionCellCollectionHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     def get(self, assignment_id, notebook_id):
-        cells = self.api.get_solution_cell_ids(assignment_id, notebook_id)
+        cells = yield self.run_blocking(self.api.get_solution_cell_ids, assignment_id, notebook_id)
         self.write(json.dumps(cells))
 
 
 class SubmittedTaskCollectionHandler(BaseApiHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     def get(self, assignment_id, notebook_id, task_id):
-        submissions = self.api.get_task_submissions(assignment_id, notebook_id, task_id)
+        submissions = yield self.run_blocking(self.api.get_task_submissions, assignment_id, notebook_id, task_id)
         self.write(json.dumps(submissions))
 
 
@@ -339,6 +538,7 @@ default_handlers = [
     (r"/formgrader/api/assignment/([^/]+)/collect", CollectHandler),
     (r"/formgrader/api/assignment/([^/]+)/generate_feedback", GenerateAllFeedbackHandler),
     (r"/formgrader/api/assignment/([^/]+)/release_feedback", ReleaseAllFeedbackHandler),
+    (r"/formgrader/api/assignment/([^/]+)/analytics", AssignmentAnalyticsHandler),
     (r"/formgrader/api/assignment/([^/]+)/([^/]+)/generate_feedback", GenerateFeedbackHandler),
     (r"/formgrader/api/assignment/([^/]+)/([^/]+)/release_feedback", ReleaseFeedbackHandler),
 
@@ -357,12 +557,18 @@ default_handlers = [
     (r"/formgrader/api/comments", CommentCollectionHandler),
     (r"/formgrader/api/comment/([^/]+)", CommentHandler),
 
+    (r"/formgrader/api/grades_and_comments", GradesAndCommentsHandler),
+
     (r"/formgrader/api/students", StudentCollectionHandler),
     (r"/formgrader/api/student/([^/]+)", StudentHandler),
 
     (r"/formgrader/api/student_submissions/([^/]+)", StudentSubmissionCollectionHandler),
     (r"/formgrader/api/student_notebook_submissions/([^/]+)/([^/]+)", StudentNotebookSubmissionCollectionHandler),
 
+    (r"/formgrader/api/jobs", JobCollectionHandler),
+    (r"/formgrader/api/job/([^/]+)", JobHandler),
+    (r"/formgrader/api/job/([^/]+)/cancel", CancelJobHandler),
+
     (r"/formgrader/api/solution_cells/([^/]+)/([^/]+)", SolutionCellCollectionHandler),
     (r"/formgrader/api/submitted_tasks/([^/]+)/([^/]+)/([^/]+)", SubmittedTaskCollectionHandler),
 ]
@@ -1,11 +1,17 @@
 import os
 import json
+import zlib
 import functools
+import threading
 
-from tornado import web
+from tornado import web, gen
+from tornado.escape import utf8
 from notebook.base.handlers import IPythonHandler
+from .jobqueue import JobQueueFull
 from ...api import Gradebook
-from ...apps.api import NbGraderAPI
+
+
+_gradebook_lock = threading.Lock()
 
 
 class BaseHandler(IPythonHandler):
@@ -32,11 +38,12 @@ class BaseHandler(IPythonHandler):
 
     @property
     def gradebook(self):
-        gb = self.settings['nbgrader_gradebook']
-        if gb is None:
-            self.log.debug("creating gradebook")
-            gb = Gradebook(self.db_url)
-            self.settings['nbgrader_gradebook'] = gb
+        with _gradebook_lock:
+            gb = self.settings['nbgrader_gradebook']
+            if gb is None:
+                self.log.debug("creating gradebook")
+                gb = Gradebook.from_coursedir(self.coursedir, course_id="default_course")
+                self.settings['nbgrader_gradebook'] = gb
         return gb
 
     @property
@@ -47,13 +54,114 @@ class BaseHandler(IPythonHandler):
     def exporter(self):
         return self.settings['nbgrader_exporter']
 
+    @property
+    def render_cache(self):
+        return self.settings['nbgrader_render_cache']
+
+    @property
+    def submission_index(self):
+        return self.settings['nbgrader_submission_index']
+
+    @property
+    def executor(self):
+        return self.settings['nbgrader_executor']
+
+    def run_blocking(self, f, *args, **kwargs):
+        """Call a function that blocks (e.g. because it queries the database,
+        reads files or renders notebooks) in the formgrader's thread pool, so
+        the server can handle other requests in the meantime. Returns a future
+        that handlers can yield from a coroutine.
+
+        The gradebook gives every thread its own database session, which is
+        closed once the function returns, so the function should not return
+        objects from the database (but e.g. their dictionaries instead).
+
+        """
+        return self.executor.submit(self._run_blocking, f, args, kwargs)
+
+    @property
+    def job_queue(self):
+        return self.settings['nbgrader_job_queue']
+
+    def submit_job(self, action, assignment_id, student_id=None):
+        """Queue one of the actions of the formgrader (which run nbgrader
+        apps, e.g. autograding) as a job that runs in the background, and
+        return the job. Handlers that need the result of the action can
+        yield the future of the job.
+
+        Besides the actions of the API, ``autograde_ungraded`` autogrades all
+        submissions of an assignment that have not been autograded yet, one
+        student after another, in a single job.
+
+        """
+        if not assignment_id:
+            raise web.HTTPError(400, "assignment_id is required")
+
+        api = self.api
+        submission_index = self.submission_index
+
+        def autograde(student_id):
+            try:
+                return api.autograde(assignment_id, student_id)
+            finally:
+                submission_index.invalidate(assignment_id)
+
+        actions = {
+            "generate_assignment": lambda: api.generate_assignment(assignment_id),
+            "release_assignment": lambda: api.release_assignment(assignment_id),
+            "unrelease": lambda: api.unrelease(assignment_id),
+            "collect": lambda: api.collect(assignment_id),
+            "autograde": lambda: autograde(student_id),
+            "generate_feedback": lambda: api.generate_feedback(assignment_id, student_id),
+            "release_feedback": lambda: api.release_feedback(assignment_id, student_id),
+        }
+
+        if action == "autograde_ungraded":
+            def steps():
+                students = sorted(api.get_ungraded_students(assignment_id))
+                return [(x, functools.partial(autograde, x)) for x in students]
+        elif action in actions:
+            if action == "autograde" and not student_id:
+                raise web.HTTPError(400, "student_id is required")
+            step = actions[action]
+
+            def steps():
+                return [(None, step)]
+        else:
+            raise web.HTTPError(400, "Unknown action: {}".format(action))
+
+        try:
+            return self.job_queue.submit(
+                action, steps, assignment_id=assignment_id, student_id=student_id)
+        except JobQueueFull as e:
+            raise web.HTTPError(503, str(e))
+
+    def _run_blocking(self, f, args, kwargs):
+        try:
+            return f(*args, **kwargs)
+        finally:
+            gb = self.settings['nbgrader_gradebook']
+            if gb is not None:
+                gb.db.remove()
+
+    def get_submission_ordering(self, assignment_id, notebook_id):
+        def build():
+            notebooks = self.gradebook.notebook_submissions(notebook_id, assignment_id)
+            submissions = self.api._filter_existing_notebooks(assignment_id, notebooks)
+            return [x.id for x in submissions], [x.id for x in submissions if x.failed_tests]
+
+        return self.submission_index.get(
+            assignment_id, notebook_id, build, version=self.gradebook.version())
+
+    def invalidate_submission_orderings(self, items):
+        """Forget the orderings of the notebooks of grades or comments (given
+        as dictionaries) that were changed."""
+        for assignment_id, notebook_id in set((x["assignment"], x["notebook"]) for x in items):
+            self.submission_index.invalidate(assignment_id, notebook_id)
+
     @property
     def api(self):
-        level = self.log.level
-        api = NbGraderAPI(
-            self.coursedir, self.authenticator, parent=self.coursedir.parent)
-        api.log_level = level
-        return api
+        return self.settings['nbgrader_api']
 
     def render(self, name, **ns):
         template = self.settings['nbgrader_jinja2_env'].get_template(name)
@@ -87,6 +195,72 @@ class BaseHandler(IPythonHandler):
 
 class BaseApiHandler(BaseHandler):
 
+    # responses shorter than this many bytes are not worth compressing
+    gzip_min_length = 1024
+
+    # the compressor of the response, if it is being compressed with gzip
+    _gzip = None
+
+    def clear(self):
+        super(BaseApiHandler, self).clear()
+        self._gzip = None
+
+    def start_gzip(self):
+        """Compress the rest of the response with gzip, if the client accepts
+        it. This must be called before anything has been flushed."""
+        self.add_header("Vary", "Accept-Encoding")
+        if self._gzip is None and "gzip" in self.request.headers.get("Accept-Encoding", ""):
+            self.set_header("Content-Encoding", "gzip")
+            self._gzip = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def write(self, chunk):
+        if self._gzip is None:
+            return super(BaseApiHandler, self).write(chunk)
+        if isinstance(chunk, dict):
+            self.set_header("Content-Type", "application/json; charset=UTF-8")
+            chunk = json.dumps(chunk)
+        super(BaseApiHandler, self).write(self._gzip.compress(utf8(chunk)))
+
+    def flush(self, *args, **kwargs):
+        if self._gzip is not None:
+            super(BaseApiHandler, self).write(self._gzip.flush(zlib.Z_SYNC_FLUSH))
+        return super(BaseApiHandler, self).flush(*args, **kwargs)
+
+    def finish(self, chunk=None):
+        if self._gzip is not None:
+            if chunk is not None:
+                self.write(chunk)
+                chunk = None
+            super(BaseApiHandler, self).write(self._gzip.flush())
+            self._gzip = None
+        return super(BaseApiHandler, self).finish(chunk)
+
+    @gen.coroutine
+    def not_modified(self, version, *args):
+        """Send a version token of the requested data as the ETag of the
+        response, and check it against the tokens the client already has.
+        The token is computed by calling `version` with `args` in the
+        formgrader's thread pool, and should be much cheaper to compute than
+        the data itself.
+
+        Returns True if the client's copy of the data is current, in which
+        case the response is finished with 304 Not Modified and the handler
+        should return without computing the data.
+
+        """
+        token = yield self.run_blocking(version, *args)
+        # the client has to check with us whether its copy is still current
+        # before using it
+        self.set_header("Cache-Control", "no-cache")
+        # the same token is used whether or not the response is compressed,
+        # so it is a weak validator
+        self.set_header("Etag", 'W/"{}"'.format(token))
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+            raise gen.Return(True)
+        raise gen.Return(False)
+
     def get_json_body(self):
         """Return the body of the request as JSON data."""
         if not self.request.body:
@@ -100,6 +274,46 @@ class BaseApiHandler(BaseHandler):
             raise web.HTTPError(400, 'Invalid JSON in body of request')
         return model
 
+    def get_int_argument(self, name):
+        """Return a non-negative integer query argument, or None if it is not
+        given."""
+        value = self.get_argument(name, None)
+        if value is None:
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            raise web.HTTPError(400, "{} must be an integer".format(name))
+        if value < 0:
+            raise web.HTTPError(400, "{} must not be negative".format(name))
+        return value
+
+    def get_bool_argument(self, name):
+        """Return a boolean query argument (``true`` or ``false``), or None if
+        it is not given."""
+        value = self.get_argument(name, None)
+        if value is None:
+            return None
+        if value not in ("true", "false"):
+            raise web.HTTPError(400, "{} must be true or false".format(name))
+        return value == "true"
+
+    @gen.coroutine
+    def write_json_list(self, items, chunk_size=100):
+        """Write a list as JSON, sending it to the client in chunks, so large
+        lists do not have to be serialized in one go before anything is
+        sent. Large lists are compressed with gzip if the client accepts it."""
+        for i in range(0, len(items), chunk_size):
+            chunk = ", ".join(json.dumps(x) for x in items[i:i + chunk_size])
+            if i == 0:
+                if len(chunk) >= self.gzip_min_length:
+                    self.start_gzip()
+                self.write("[" + chunk)
+            else:
+                self.write(", " + chunk)
+            yield self.flush()
+        self.write("]" if items else "[]")
+
 
 def check_xsrf(f):
     @functools.wraps(f)
@@ -2,13 +2,20 @@
 
 import os
 
+from concurrent.futures import ThreadPoolExecutor
+from textwrap import dedent
+
 from nbconvert.exporters import HTMLExporter
-from traitlets import default
+from traitlets import Integer, default
 from tornado import web
 from jinja2 import Environment, FileSystemLoader
 from notebook.utils import url_path_join as ujoin
 
 from . import handlers, apihandlers
+from .jobqueue import JobQueue
+from .rendercache import RenderCache
+from .submissionindex import SubmissionIndex
+from ...apps.api import NbGraderAPI
 from ...apps.baseapp import NbGrader
 from ...preprocessors import FilterCellsById
 
@@ -18,10 +25,22 @@ class FormgradeExtension(NbGrader):
     name = u'formgrade'
     description = u'Grade a notebook using an HTML form'
 
+    worker_threads = Integer(4, help=dedent(
+        """
+        The number of threads the formgrader uses to query the database, read
+        files and render notebooks, so that slow requests do not block the
+        notebook server. At most this many such requests are handled at the
+        same time; others wait until a thread is free.
+        """)
+    ).tag(config=True)
+
     @default("classes")
     def _classes_default(self):
         classes = super(FormgradeExtension, self)._classes_default()
         classes.append(HTMLExporter)
+        classes.append(RenderCache)
+        classes.append(SubmissionIndex)
+        classes.append(JobQueue)
         return classes
 
     def build_extra_config(self):
@@ -49,12 +68,26 @@ class FormgradeExtension(NbGrader):
         else:
             nbgrader_bad_setup = False
 
+        # All requests share one API, rather than setting up a new one (and
+        # checking the exchange) for every request
+        api = NbGraderAPI(self.coursedir, self.authenticator, parent=self)
+        api.log_level = self.log.level
+
+        # pages rendered by an earlier version of nbgrader are of no use
+        render_cache = RenderCache(parent=self, template_paths=[handlers.template_path])
+        render_cache.clear_outdated()
+
         # Configure the formgrader settings
         tornado_settings = dict(
             nbgrader_url_prefix=os.path.relpath(self.coursedir.root, self.parent.notebook_dir),
             nbgrader_coursedir=self.coursedir,
             nbgrader_authenticator=self.authenticator,
+            nbgrader_api=api,
             nbgrader_exporter=HTMLExporter(config=self.config),
+            nbgrader_render_cache=render_cache,
+            nbgrader_submission_index=SubmissionIndex(parent=self),
+            nbgrader_executor=ThreadPoolExecutor(max(1, self.worker_threads)),
+            nbgrader_job_queue=JobQueue(parent=self, course_root=self.coursedir.root),
             nbgrader_gradebook=None,
             nbgrader_db_url=self.coursedir.db_url,
             nbgrader_jinja2_env=jinja_env,
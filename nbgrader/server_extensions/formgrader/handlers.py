@@ -1,27 +1,49 @@
 import os
 import re
 import sys
+import functools
+import threading
 
-from tornado import web
+from tornado import web, gen
 
 from .base import BaseHandler, check_xsrf, check_notebook_dir
 from ...api import MissingEntry
 
 
+_exporters = threading.local()
+
+
+def _render_notebook(exporter, filename, resources):
+    # exporters keep state while converting a notebook, so each thread
+    # converts with its own copy of the formgrader's exporter
+    if getattr(_exporters, 'exporter', None) is None:
+        _exporters.exporter = type(exporter)(config=exporter.config)
+    html, _ = _exporters.exporter.from_filename(filename, resources=resources)
+    return html
+
+
 class ManageAssignmentsHandler(BaseHandler):
+    @gen.coroutine
     @web.authenticated
     @check_xsrf
     @check_notebook_dir
     def get(self):
-        html = self.render(
+        html = yield self.run_blocking(self._render)
+        self.write(html)
+
+    def _render(self):
+        # the API is shared by all requests, so check whether the exchange
+        # was created or removed since it was last checked
+        api = self.api
+        api.refresh_exchange()
+        return self.render(
             "manage_assignments.tpl",
             url_prefix=self.url_prefix,
             base_url=self.base_url,
             windows=(sys.prefix == 'win32'),
-            course_id=self.api.course_id,
-            exchange=self.api.exchange,
-            exchange_missing=self.api.exchange_missing)
-        self.write(html)
+            course_id=api.course_id,
+            exchange=api.exchange,
+            exchange_missing=api.exchange_missing)
 
 
 class ManageSubmissionsHandler(BaseHandler):
@@ -91,39 +113,21 @@ class GradebookNotebookSubmissionsHandler(BaseHandler):
 
 
 class SubmissionHandler(BaseHandler):
-    @web.authenticated
-    @check_xsrf
-    @check_notebook_dir
-    def get(self, submission_id):
-        try:
-            submission = self.gradebook.find_submission_notebook_by_id(submission_id)
-            assignment_id = submission.assignment.assignment.name
-            notebook_id = submission.notebook.name
-            student_id = submission.student.id
-        except MissingEntry:
-            raise web.HTTPError(404, "Invalid submission: {}".format(submission_id))
 
-        # redirect if there isn't a trailing slash in the uri
-        if os.path.split(self.request.path)[1] == submission_id:
-            url = self.request.path + '/'
-            if self.request.query:
-                url += '?' + self.request.query
-            return self.redirect(url, permanent=True)
+    def _submission_resources(self, submission, indices, task_id):
+        assignment_id = submission.assignment.assignment.name
+        notebook_id = submission.notebook.name
+        student_id = submission.student.id
 
         filename = os.path.join(os.path.abspath(self.coursedir.format_path(
             self.coursedir.autograded_directory, student_id, assignment_id)), '{}.ipynb'.format(notebook_id))
         relative_path = os.path.relpath(filename, self.coursedir.root)
-        indices = self.api.get_notebook_submission_indices(assignment_id, notebook_id)
-        ix = indices.get(submission.id, -2)
-
-        view = self.get_argument('view', 'notebook')
-        task_id = self.get_argument('task', '')
 
         resources = {
             'assignment_id': assignment_id,
             'notebook_id': notebook_id,
             'submission_id': submission.id,
-            'index': ix,
+            'index': indices.get(submission.id, -2),
             'total': len(indices),
             'base_url': self.base_url,
             'mathjax_url': self.mathjax_url,
@@ -134,16 +138,71 @@ class SubmissionHandler(BaseHandler):
             'keyword': task_id
         }
 
+        return filename, resources
+
+    def _prefetch_neighbors(self, submission, ordering, task_id):
+        # render the submissions that the next and previous buttons lead to
+        # in the background, so they are already cached when the grader
+        # moves on to them
+        for neighbor_id in (ordering.next(submission.id), ordering.prev(submission.id)):
+            if neighbor_id is None:
+                continue
+
+            neighbor = self.gradebook.find_submission_notebook_by_id(neighbor_id)
+            filename, resources = self._submission_resources(neighbor, ordering.indices, task_id)
+            key = self.render_cache.key(filename, self.exporter.template_file, resources)
+            self.render_cache.prefetch(
+                key, functools.partial(_render_notebook, self.exporter, filename, resources))
+
+    def _render(self, submission_id, task_id):
+        # returns the status and page of the submission, or None if the
+        # request should be redirected
+        try:
+            submission = self.gradebook.find_submission_notebook_by_id(submission_id)
+            assignment_id = submission.assignment.assignment.name
+            notebook_id = submission.notebook.name
+        except MissingEntry:
+            raise web.HTTPError(404, "Invalid submission: {}".format(submission_id))
+
+        # redirect if there isn't a trailing slash in the uri
+        if os.path.split(self.request.path)[1] == submission_id:
+            return None
+
+        ordering = self.get_submission_ordering(assignment_id, notebook_id)
+        filename, resources = self._submission_resources(submission, ordering.indices, task_id)
+
         if not os.path.exists(filename):
             resources['filename'] = filename
-            html = self.render('formgrade_404.tpl', resources=resources)
-            self.clear()
-            self.set_status(404)
-            self.write(html)
+            return 404, self.render('formgrade_404.tpl', resources=resources)
 
-        else:
-            html, _ = self.exporter.from_filename(filename, resources=resources)
-            self.write(html)
+        key = self.render_cache.key(filename, self.exporter.template_file, resources)
+        html = self.render_cache.get(key)
+        if html is None:
+            html = _render_notebook(self.exporter, filename, resources)
+            self.render_cache.set(key, html)
+        self._prefetch_neighbors(submission, ordering, task_id)
+        return 200, html
+
+    @gen.coroutine
+    @web.authenticated
+    @check_xsrf
+    @check_notebook_dir
+    def get(self, submission_id):
+        task_id = self.get_argument('task', '')
+        page = yield self.run_blocking(self._render, submission_id, task_id)
+
+        if page is None:
+            url = self.request.path + '/'
+            if self.request.query:
+                url += '?' + self.request.query
+            self.redirect(url, permanent=True)
+            return
+
+        status, html = page
+        if status != 200:
+            self.clear()
+            self.set_status(status)
+        self.write(html)
 
 
 class SubmissionNavigationHandler(BaseHandler):
@@ -160,69 +219,51 @@ class SubmissionNavigationHandler(BaseHandler):
         else:
             return url
 
-    def _get_submission_ids(self, assignment_id, notebook_id):
-        notebooks = self.gradebook.notebook_submissions(notebook_id, assignment_id)
-        submissions = self.api._filter_existing_notebooks(assignment_id, notebooks)
-        return sorted([x.id for x in submissions])
-
-    def _get_incorrect_submission_ids(self, assignment_id, notebook_id, submission):
-        notebooks = self.gradebook.notebook_submissions(notebook_id, assignment_id)
-        submissions = self.api._filter_existing_notebooks(assignment_id, notebooks)
-        incorrect_ids = set([x.id for x in submissions if x.failed_tests])
-        incorrect_ids.add(submission.id)
-        incorrect_ids = sorted(incorrect_ids)
-        return incorrect_ids
-
-    def _next(self, assignment_id, notebook_id, submission, task_id):
-        # find next submission
-        submission_ids = self._get_submission_ids(assignment_id, notebook_id)
-        ix = submission_ids.index(submission.id)
-        if ix == (len(submission_ids) - 1):
+    def _redirect_url(self, assignment_id, notebook_id, submission_id, task_id):
+        if submission_id is None:
             return self._assignment_notebook_list_url(assignment_id, notebook_id, task_id)
         else:
-            return self._submission_url(submission_ids[ix + 1]) + "?task={}".format(task_id)
+            return self._submission_url(submission_id) + "?task={}".format(task_id)
+
+    def _next(self, assignment_id, notebook_id, submission, task_id):
+        ordering = self.get_submission_ordering(assignment_id, notebook_id)
+        return self._redirect_url(
+            assignment_id, notebook_id, ordering.next(submission.id), task_id)
 
     def _prev(self, assignment_id, notebook_id, submission, task_id):
-        # find previous submission
-        submission_ids = self._get_submission_ids(assignment_id, notebook_id)
-        ix = submission_ids.index(submission.id)
-        if ix == 0:
-            return self._assignment_notebook_list_url(assignment_id, notebook_id, task_id)
-        else:
-            return self._submission_url(submission_ids[ix - 1]) + "?task={}".format(task_id)
+        ordering = self.get_submission_ordering(assignment_id, notebook_id)
+        return self._redirect_url(
+            assignment_id, notebook_id, ordering.prev(submission.id), task_id)
 
     def _next_incorrect(self, assignment_id, notebook_id, submission, task_id):
-        # find next incorrect submission
-        submission_ids = self._get_incorrect_submission_ids(assignment_id, notebook_id, submission)
-        ix_incorrect = submission_ids.index(submission.id)
-        if ix_incorrect == (len(submission_ids) - 1):
-            return self._assignment_notebook_list_url(assignment_id, notebook_id, task_id)
-        else:
-            return self._submission_url(submission_ids[ix_incorrect + 1]) + "?task={}".format(task_id)
+        ordering = self.get_submission_ordering(assignment_id, notebook_id)
+        return self._redirect_url(
+            assignment_id, notebook_id, ordering.next_incorrect(submission.id), task_id)
 
     def _prev_incorrect(self, assignment_id, notebook_id, submission, task_id):
-        # find previous incorrect submission
-        submission_ids = self._get_incorrect_submission_ids(assignment_id, notebook_id, submission)
-        ix_incorrect = submission_ids.index(submission.id)
-        if ix_incorrect == 0:
-            return self._assignment_notebook_list_url(assignment_id, notebook_id, task_id)
-        else:
-            return self._submission_url(submission_ids[ix_incorrect - 1]) + "?task={}".format(task_id)
+        ordering = self.get_submission_ordering(assignment_id, notebook_id)
+        return self._redirect_url(
+            assignment_id, notebook_id, ordering.prev_incorrect(submission.id), task_id)
 
-    @web.authenticated
-    @check_xsrf
-    @check_notebook_dir
-    def get(self, submission_id, action):
+    def _url(self, submission_id, action, task_id):
         try:
             submission = self.gradebook.find_submission_notebook_by_id(submission_id)
             assignment_id = submission.assignment.assignment.name
             notebook_id = submission.notebook.name
-            task_id = self.get_argument('task', '')
         except MissingEntry:
             raise web.HTTPError(404, "Invalid submission: {}".format(submission_id))
 
         handler = getattr(self, '_{}'.format(action))
-        self.redirect(handler(assignment_id, notebook_id, submission, task_id), permanent=False)
+        return handler(assignment_id, notebook_id, submission, task_id)
+
+    @gen.coroutine
+    @web.authenticated
+    @check_xsrf
+    @check_notebook_dir
+    def get(self, submission_id, action):
+        task_id = self.get_argument('task', '')
+        url = yield self.run_blocking(self._url, submission_id, action, task_id)
+        self.redirect(url, permanent=False)
 
 
 class SubmissionFilesHandler(web.StaticFileHandler, BaseHandler):
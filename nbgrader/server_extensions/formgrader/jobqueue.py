@@ -0,0 +1,350 @@
+import os
+import io
+import hashlib
+import json
+import uuid
+import threading
+import traceback
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from textwrap import dedent
+
+from jupyter_core.paths import jupyter_runtime_dir
+from traitlets import Integer, Unicode, default
+from traitlets.config import LoggingConfigurable
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job(object):
+    """An action of the formgrader (e.g. autograding a submission), or a
+    batch of them, that runs in the background.
+
+    Jobs are queued, then run, and then either finished or cancelled. Jobs
+    that were queued or running when the server stopped are interrupted.
+    The result of a job has the same form as the results of the actions of
+    :class:`~nbgrader.apps.api.NbGraderAPI`, i.e. it says whether the job
+    succeeded and contains the log and errors of its actions.
+
+    """
+
+    def __init__(self, action, assignment_id=None, student_id=None, id=None,
+                 status="queued", created=None, started=None, finished=None,
+                 cancel_requested=False, steps=None, completed=0,
+                 success=None, log="", error=""):
+        self.id = id or uuid.uuid4().hex
+        self.action = action
+        self.assignment_id = assignment_id
+        self.student_id = student_id
+        self.status = status
+        self.created = created or datetime.utcnow().isoformat()
+        self.started = started
+        self.finished = finished
+        self.cancel_requested = cancel_requested
+        self.steps = steps
+        self.completed = completed
+        self.success = success
+        self.log = log
+        self.error = error
+
+        # resolves to the result of the job once it is done
+        self.future = Future()
+
+    @property
+    def done(self):
+        return self.status in ("finished", "cancelled", "interrupted")
+
+    def result(self):
+        result = {"success": bool(self.success)}
+        if self.log:
+            result["log"] = self.log
+        if self.error:
+            result["error"] = self.error
+        return result
+
+    def to_dict(self, log=True):
+        job = {
+            "id": self.id,
+            "action": self.action,
+            "assignment_id": self.assignment_id,
+            "student_id": self.student_id,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "cancel_requested": self.cancel_requested,
+            "steps": self.steps,
+            "completed": self.completed,
+            "success": self.success
+        }
+        if log:
+            job["log"] = self.log
+            job["error"] = self.error
+        return job
+
+
+class JobQueue(LoggingConfigurable):
+    """A queue of the jobs the formgrader runs in the background.
+
+    Jobs are run by a pool of worker threads, in the order they were
+    submitted. Jobs for the same assignment run one at a time, as they may
+    work on the same files. The status and logs of every job are kept on
+    disk, so they are still available after the server is restarted.
+
+    """
+
+    max_workers = Integer(2, help=dedent(
+        """
+        The maximum number of jobs that run at the same time. Jobs for the
+        same assignment never run at the same time.
+        """)
+    ).tag(config=True)
+
+    max_queued = Integer(100, help=dedent(
+        """
+        The maximum number of jobs waiting to run. Jobs that are submitted
+        while this many jobs are waiting are rejected.
+        """)
+    ).tag(config=True)
+
+    max_finished = Integer(100, help=dedent(
+        """
+        The number of jobs that are done whose status and logs are kept. The
+        oldest ones are removed when there are more.
+        """)
+    ).tag(config=True)
+
+    directory = Unicode(help=dedent(
+        """
+        The directory where the status and logs of jobs are kept. Defaults to
+        a directory in the Jupyter runtime directory that is specific to the
+        course directory, so that formgraders of different courses do not see
+        each other's jobs.
+        """)
+    ).tag(config=True)
+
+    course_root = Unicode("", help="The root of the course directory the jobs are for.")
+
+    @default("directory")
+    def _directory_default(self):
+        directory = os.path.join(jupyter_runtime_dir(), "nbgrader_formgrade_jobs")
+        if self.course_root:
+            root = os.path.abspath(self.course_root)
+            directory = os.path.join(directory, hashlib.sha1(root.encode("utf-8")).hexdigest())
+        return directory
+
+    def __init__(self, **kwargs):
+        super(JobQueue, self).__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._jobs = None
+        self._assignment_locks = {}
+        self._executor = ThreadPoolExecutor(max(1, self.max_workers))
+
+    def submit(self, action, steps, assignment_id=None, student_id=None):
+        """Queue a job.
+
+        Arguments
+        ---------
+        action: string
+            The name of the action the job runs
+        steps: function
+            A function without arguments that is called when the job starts,
+            and returns the steps of the job as a list of ``(name, function)``
+            pairs. Each function takes no arguments and returns a result like
+            the actions of :class:`~nbgrader.apps.api.NbGraderAPI`. The names
+            are used to tell the logs of the steps apart, and may be None if
+            the job has a single step.
+        assignment_id: string
+            (Optional) The assignment the job is for
+        student_id: string
+            (Optional) The student the job is for
+
+        Returns
+        -------
+        job: :class:`Job`
+
+        """
+        with self._lock:
+            jobs = self._load()
+            queued = sum(1 for x in jobs.values() if x.status == "queued")
+            if queued >= self.max_queued:
+                raise JobQueueFull("There are already {} jobs waiting to run".format(queued))
+
+            job = Job(action, assignment_id=assignment_id, student_id=student_id)
+            jobs[job.id] = job
+            self._save(job)
+
+        self._executor.submit(self._run, job, steps)
+        return job
+
+    def get(self, job_id):
+        """Get a job by its id, or None if there is no such job."""
+        with self._lock:
+            return self._load().get(job_id)
+
+    def jobs(self):
+        """Get all jobs, from the oldest to the most recently submitted."""
+        with self._lock:
+            return list(self._load().values())
+
+    def cancel(self, job_id):
+        """Cancel a job. Jobs that are waiting are not run at all, and jobs
+        that are running stop before their next step. Returns the job, or None
+        if there is no such job."""
+        with self._lock:
+            job = self._load().get(job_id)
+            if job is None or job.done:
+                return job
+
+            job.cancel_requested = True
+            if job.status == "queued":
+                self._finish(job, "cancelled")
+            else:
+                self._save(job)
+            return job
+
+    def _assignment_lock(self, assignment_id):
+        with self._lock:
+            return self._assignment_locks.setdefault(assignment_id, threading.Lock())
+
+    def _run(self, job, steps):
+        # the job waits (and can still be cancelled) while another job for the
+        # same assignment runs
+        with self._assignment_lock(job.assignment_id):
+            self._run_job(job, steps)
+
+    def _run_job(self, job, steps):
+        with self._lock:
+            if job.status != "queued":
+                return
+            job.status = "running"
+            job.started = datetime.utcnow().isoformat()
+            self._save(job)
+
+        # whatever happens, the job has to be finished, or it would stay
+        # running forever (and requests waiting for it would never return)
+        success = False
+        try:
+            success = self._run_steps(job, steps)
+        except Exception:
+            self.log.error("Job %s failed", job.id, exc_info=True)
+            with self._lock:
+                job.error = "\n".join(x for x in [job.error, traceback.format_exc()] if x)
+        finally:
+            with self._lock:
+                job.success = success and not job.cancel_requested
+                self._finish(job, "cancelled" if job.cancel_requested else "finished")
+
+    def _run_steps(self, job, steps):
+        logs = []
+        errors = []
+        success = True
+        try:
+            steps = list(steps())
+        except Exception:
+            self.log.error("Could not start job %s", job.id, exc_info=True)
+            steps = []
+            success = False
+            errors.append(traceback.format_exc())
+
+        with self._lock:
+            job.steps = len(steps)
+            job.error = "\n".join(errors)
+            self._save(job)
+
+        for name, step in steps:
+            if job.cancel_requested:
+                break
+
+            try:
+                result = step()
+            except Exception:
+                self.log.error("Job %s failed", job.id, exc_info=True)
+                result = {"success": False, "error": traceback.format_exc()}
+
+            prefix = "[{}]\n".format(name) if name is not None else ""
+            if result.get("log"):
+                logs.append(prefix + result["log"])
+            if result.get("error"):
+                errors.append(prefix + result["error"])
+            success = success and result["success"]
+
+            with self._lock:
+                job.completed += 1
+                job.log = "\n".join(logs)
+                job.error = "\n".join(errors)
+                self._save(job)
+
+        return success
+
+    def _finish(self, job, status):
+        try:
+            job.status = status
+            job.finished = datetime.utcnow().isoformat()
+            if status == "cancelled" and not job.error:
+                job.error = "The job was cancelled."
+                job.success = False
+            self._save(job)
+            self._prune()
+        finally:
+            if not job.future.done():
+                job.future.set_result(job.result())
+
+    def _load(self):
+        # the jobs that are on disk (e.g. from before the server was
+        # restarted) are loaded once
+        if self._jobs is not None:
+            return self._jobs
+
+        jobs = []
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with io.open(os.path.join(self.directory, name), "r", encoding="utf-8") as fh:
+                        job = Job(**json.load(fh))
+                except (IOError, OSError, ValueError, TypeError):
+                    self.log.warning("Could not read job %s", name, exc_info=True)
+                    continue
+                jobs.append(job)
+
+        self._jobs = OrderedDict()
+        for job in sorted(jobs, key=lambda x: x.created):
+            self._jobs[job.id] = job
+            if not job.done:
+                # the server stopped before the job was done
+                job.status = "interrupted"
+                job.finished = datetime.utcnow().isoformat()
+                job.success = False
+                self._save(job)
+            job.future.set_result(job.result())
+
+        return self._jobs
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, job_id + ".json")
+
+    def _save(self, job):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            tmp = self._path(job.id) + ".tmp"
+            with io.open(tmp, "w", encoding="utf-8") as fh:
+                fh.write(json.dumps(job.to_dict()))
+            os.replace(tmp, self._path(job.id))
+        except (IOError, OSError):
+            self.log.warning("Could not save job %s", job.id, exc_info=True)
+
+    def _prune(self):
+        done = [x for x in self._jobs.values() if x.done]
+        for job in done[:max(0, len(done) - self.max_finished)]:
+            del self._jobs[job.id]
+            try:
+                os.remove(self._path(job.id))
+            except OSError:
+                pass
@@ -0,0 +1,287 @@
+import os
+import io
+import json
+import hashlib
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from textwrap import dedent
+
+from jupyter_core.paths import jupyter_runtime_dir
+from traitlets import Integer, List, Unicode, default
+from traitlets.config import LoggingConfigurable
+
+from ..._version import __version__
+
+
+class RenderCache(LoggingConfigurable):
+    """A cache of the HTML the formgrader renders for submitted notebooks.
+
+    Rendered pages are kept in memory and on disk, each with their own budget,
+    and the least recently used pages are evicted when a budget is exceeded.
+    Pages are keyed by the path, modification time and size of the notebook,
+    the template, the resources passed to the template and the version of
+    nbgrader, so a page is rendered again whenever any of these change or a
+    file in `RenderCache.template_paths` is modified.
+
+    """
+
+    memory_budget = Integer(64 * 1024 * 1024, help=dedent(
+        """
+        The maximum number of bytes of rendered HTML to keep in memory. Set
+        this to 0 to not keep any rendered pages in memory.
+        """)
+    ).tag(config=True)
+
+    disk_budget = Integer(512 * 1024 * 1024, help=dedent(
+        """
+        The maximum number of bytes of rendered HTML to keep on disk, in
+        `RenderCache.directory`. Set this to 0 to not keep any rendered pages
+        on disk.
+        """)
+    ).tag(config=True)
+
+    directory = Unicode(help=dedent(
+        """
+        The directory where rendered pages are kept on disk. Defaults to a
+        directory in the Jupyter runtime directory.
+        """)
+    ).tag(config=True)
+
+    prefetch_workers = Integer(2, help=dedent(
+        """
+        The number of threads used to render pages in the background, e.g.
+        the submissions before and after the one that is being graded. Set
+        this to 0 to disable rendering pages in the background.
+        """)
+    ).tag(config=True)
+
+    template_paths = List(Unicode(), help=dedent(
+        """
+        The directories of the templates pages are rendered with.
+        """)
+    )
+
+    @default("directory")
+    def _directory_default(self):
+        return os.path.join(jupyter_runtime_dir(), "nbgrader_formgrade_cache")
+
+    def __init__(self, **kwargs):
+        super(RenderCache, self).__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = None
+        self._disk_size = 0
+        self._executor = None
+        self._pending = set()
+
+    def key(self, filename, template, resources):
+        """Compute the key of the page rendered from a notebook, or None if
+        the notebook does not exist.
+
+        Arguments
+        ---------
+        filename: string
+            The path to the notebook
+        template: string
+            The name of the template the notebook is rendered with
+        resources: dict
+            The resources passed to the template, which must be JSON
+            serializable
+
+        """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+
+        data = json.dumps(
+            [os.path.abspath(filename), st.st_mtime, st.st_size, template,
+             self._template_mtime(), __version__, resources],
+            sort_keys=True)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def _template_mtime(self):
+        # the most recent modification of the templates, which may include
+        # each other
+        mtime = 0
+        for path in self.template_paths:
+            for dirname, _, filenames in os.walk(path):
+                for name in filenames:
+                    try:
+                        mtime = max(mtime, os.stat(os.path.join(dirname, name)).st_mtime)
+                    except OSError:
+                        pass
+        return mtime
+
+    def get(self, key):
+        """Get a rendered page, or None if it is not in the cache."""
+        if key is None:
+            return None
+
+        with self._lock:
+            if key in self._memory:
+                # move it to the end, i.e. make it the most recently used
+                html = self._memory[key] = self._memory.pop(key)
+                return html
+
+            html = self._read(key)
+            if html is not None:
+                self._add_to_memory(key, html)
+            return html
+
+    def set(self, key, html):
+        """Add a rendered page to the cache."""
+        if key is None:
+            return
+
+        with self._lock:
+            self._add_to_memory(key, html)
+            self._write(key, html)
+
+    def prefetch(self, key, render):
+        """Render a page in the background and add it to the cache, unless it
+        is already cached or being rendered.
+
+        Arguments
+        ---------
+        key: string
+            The key of the page, as returned by `RenderCache.key`
+        render: function
+            A function without arguments that returns the rendered page
+
+        """
+        if key is None or self.prefetch_workers <= 0:
+            return
+
+        with self._lock:
+            if key in self._pending or key in self._memory or key in self._disk_index():
+                return
+            self._pending.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.prefetch_workers)
+
+        self._executor.submit(self._prefetch, key, render)
+
+    def _prefetch(self, key, render):
+        try:
+            self.set(key, render())
+        except Exception:
+            self.log.warning("Could not render page %s in the background", key, exc_info=True)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def clear(self):
+        """Remove all rendered pages from memory and disk."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            for key in list(self._disk_index()):
+                self._remove(key)
+
+    def clear_outdated(self):
+        """Remove all rendered pages from memory and disk if they were
+        rendered by another version of nbgrader, which can no longer use
+        them anyway.
+
+        """
+        path = os.path.join(self.directory, "version")
+        try:
+            with io.open(path, "r", encoding="utf-8") as fh:
+                version = fh.read().strip()
+        except (IOError, OSError):
+            version = None
+        if version == __version__:
+            return
+
+        self.clear()
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with io.open(path, "w", encoding="utf-8") as fh:
+                fh.write(__version__)
+        except (IOError, OSError):
+            self.log.warning("Could not write %s", path, exc_info=True)
+
+    def _add_to_memory(self, key, html):
+        size = len(html)
+        if size > self.memory_budget:
+            return
+
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = html
+        self._memory_size += size
+
+        while self._memory_size > self.memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".html")
+
+    def _disk_index(self):
+        # the pages that are already on disk (e.g. from before the server was
+        # restarted) are found once, ordered from least to most recently used
+        if self._disk is None:
+            self._disk = OrderedDict()
+            self._disk_size = 0
+            entries = []
+            if self.disk_budget > 0 and os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    if name.endswith(".html"):
+                        st = os.stat(os.path.join(self.directory, name))
+                        entries.append((st.st_atime, name[:-5], st.st_size))
+            for _, key, size in sorted(entries):
+                self._disk[key] = size
+                self._disk_size += size
+        return self._disk
+
+    def _read(self, key):
+        index = self._disk_index()
+        if key not in index:
+            return None
+
+        try:
+            with io.open(self._path(key), "r", encoding="utf-8") as fh:
+                html = fh.read()
+        except (IOError, OSError):
+            self.log.warning("Could not read cached page %s", key, exc_info=True)
+            self._disk_size -= index.pop(key)
+            return None
+
+        index[key] = index.pop(key)
+        return html
+
+    def _write(self, key, html):
+        index = self._disk_index()
+        data = html.encode("utf-8")
+        if len(data) > self.disk_budget or key in index:
+            return
+
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            tmp = self._path(key) + ".tmp"
+            with io.open(tmp, "wb") as fh:
+                fh.write(data)
+            # the page is not on disk yet, so renaming does not replace anything
+            os.rename(tmp, self._path(key))
+        except (IOError, OSError):
+            self.log.warning("Could not cache page %s", key, exc_info=True)
+            return
+
+        index[key] = len(data)
+        self._disk_size += len(data)
+        while self._disk_size > self.disk_budget:
+            self._remove(next(iter(index)))
+
+    def _remove(self, key):
+        self._disk_size -= self._disk.pop(key)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
@@ -163,6 +163,12 @@ FormGrader.prototype.save = function (callback) {
         }
         $(elem).blur();
         $(elem).trigger("change");
+        pending_updates.flush();
+    } else if (pending_updates.flush()) {
+        // wait for edits that were not sent yet
+        if (callback) {
+            $(document).on("finished_saving", callback);
+        }
     } else {
         callback();
     }
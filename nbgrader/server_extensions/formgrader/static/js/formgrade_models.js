@@ -1,3 +1,69 @@
+// Grade and comment edits are not saved one at a time, but collected for a
+// short while and then sent to the server together, which saves them all in
+// one transaction.
+var PendingUpdates = function (url, delay) {
+    this.url = url;
+    this.delay = delay;
+    this.grades = {};
+    this.comments = {};
+    this.timeout = null;
+};
+
+PendingUpdates.prototype.save = function (kind, model, attrs) {
+    model.set(attrs);
+    this[kind][model.id] = model;
+    model.trigger("request", model);
+
+    if (this.timeout === null) {
+        this.timeout = setTimeout(_.bind(this.flush, this), this.delay);
+    }
+};
+
+// Send the collected edits right away. Returns whether there were any.
+PendingUpdates.prototype.flush = function () {
+    clearTimeout(this.timeout);
+    this.timeout = null;
+
+    var grades = this.grades;
+    var comments = this.comments;
+    if (_.isEmpty(grades) && _.isEmpty(comments)) {
+        return false;
+    }
+    this.grades = {};
+    this.comments = {};
+
+    var data = {
+        "grades": _.map(grades, function (model) {
+            return _.pick(model.attributes, "id", "manual_score", "extra_credit");
+        }),
+        "comments": _.map(comments, function (model) {
+            return _.pick(model.attributes, "id", "manual_comment");
+        })
+    };
+
+    $.ajax({
+        'method': 'PUT',
+        'url': this.url,
+        'contentType': 'application/json',
+        'data': JSON.stringify(data),
+        'headers': {'X-CSRFToken': getCookie("_xsrf")},
+        'success': function (data, status, xhr) {
+            data = JSON.parse(data);
+            _.each(data.grades, function (attrs) {
+                grades[attrs.id].set(attrs);
+                grades[attrs.id].trigger("sync", grades[attrs.id]);
+            });
+            _.each(data.comments, function (attrs) {
+                comments[attrs.id].set(attrs);
+                comments[attrs.id].trigger("sync", comments[attrs.id]);
+            });
+        }
+    });
+    return true;
+};
+
+var pending_updates = new PendingUpdates(base_url + "/api/grades_and_comments", 250);
+
 var GradeUI = Backbone.View.extend({
 
     events: {
@@ -67,7 +133,7 @@ var GradeUI = Backbone.View.extend({
             }
         }
 
-        this.model.save({"manual_score": score, "extra_credit": extra_credit});
+        pending_updates.save("grades", this.model, {"manual_score": score, "extra_credit": extra_credit});
         this.render();
     },
 
@@ -103,13 +169,13 @@ var GradeUI = Backbone.View.extend({
     },
 
     assignFullCredit: function () {
-        this.model.save({"manual_score": this.model.get("max_score")});
+        pending_updates.save("grades", this.model, {"manual_score": this.model.get("max_score")});
         this.$score.select();
         this.$score.focus();
     },
 
     assignNoCredit: function () {
-        this.model.save({"manual_score": 0, "extra_credit": 0});
+        pending_updates.save("grades", this.model, {"manual_score": 0, "extra_credit": 0});
         this.$score.select();
         this.$score.focus();
     }
@@ -150,7 +216,7 @@ var CommentUI = Backbone.View.extend({
     },
 
     save: function () {
-        this.model.save({"manual_comment": this.$comment.val()});
+        pending_updates.save("comments", this.model, {"manual_comment": this.$comment.val()});
     },
 
     animateSaving: function () {
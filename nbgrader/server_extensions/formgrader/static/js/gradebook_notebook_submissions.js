@@ -170,24 +170,48 @@ var loadSubmittedNotebooks = function () {
     models = new SubmittedNotebooks();
     views = [];
     models.loaded = false;
-    models.fetch({
-        success: function () {
-            tbl.empty();
-            models.each(function (model) {
-                var view = new SubmittedNotebookUI({
-                    "model": model,
-                    "el": insertRow(tbl)
+
+    // the submissions of a notebook are loaded one page at a time, and each
+    // page is shown as soon as it arrives (the submissions of a task are
+    // loaded all at once)
+    var loadPage = function (offset) {
+        var page = new SubmittedNotebooks();
+        page.fetch({
+            data: view === "notebook" ? {limit: page_size, offset: offset} : {},
+            success: function () {
+                var rows = $("<tbody/>");
+                page.each(function (model) {
+                    models.add(model);
+                    var view = new SubmittedNotebookUI({
+                        "model": model,
+                        "el": insertRow(rows)
+                    });
+                    views.push(view);
                 });
-                views.push(view);
-            });
-            insertDataTable(tbl.parent());
-            $('span.glyphicon.name-hidden').tooltip({title: "Show student name"});
-            $('span.glyphicon.name-shown').tooltip({title: "Hide student name"});
-            models.loaded = true;
-        }
-    });
+                rows = rows.children();
+                rows.find('span.glyphicon.name-hidden').tooltip({title: "Show student name"});
+                rows.find('span.glyphicon.name-shown').tooltip({title: "Hide student name"});
+
+                if (offset === 0) {
+                    tbl.empty();
+                    tbl.append(rows);
+                    insertDataTable(tbl.parent());
+                } else {
+                    tbl.parent().DataTable().rows.add(rows).draw(false);
+                }
+
+                if (view === "notebook" && page.length === page_size) {
+                    loadPage(offset + page_size);
+                } else {
+                    models.loaded = true;
+                }
+            }
+        });
+    };
+    loadPage(0);
 };
 
+var page_size = 200;
 var models = undefined;
 var views = [];
 $(window).load(function () {
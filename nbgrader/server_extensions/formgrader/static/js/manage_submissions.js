@@ -278,24 +278,107 @@ var loadSubmissions = function () {
     models = new Submissions();
     views = [];
     models.loaded = false;
-    models.fetch({
-        success: function () {
-            tbl.empty();
-            models.each(function (model) {
-                var view = new SubmissionUI({
-                    "model": model,
-                    "el": insertRow(tbl)
+
+    // the submissions are loaded one page at a time, and each page is shown
+    // as soon as it arrives
+    var loadPage = function (offset) {
+        var page = new Submissions();
+        page.fetch({
+            data: {sort: "student", limit: page_size, offset: offset},
+            success: function () {
+                var rows = $("<tbody/>");
+                page.each(function (model) {
+                    models.add(model);
+                    var view = new SubmissionUI({
+                        "model": model,
+                        "el": insertRow(rows)
+                    });
+                    views.push(view);
                 });
-                views.push(view);
-            });
-            insertDataTable(tbl.parent());
-            models.loaded = true;
+                rows = rows.children();
+
+                if (offset === 0) {
+                    // the submissions may be loaded again, e.g. after
+                    // autograding them
+                    if ($.fn.dataTable.isDataTable(tbl.parent())) {
+                        tbl.parent().DataTable().destroy();
+                    }
+                    tbl.empty();
+                    tbl.append(rows);
+                    insertDataTable(tbl.parent());
+                } else {
+                    tbl.parent().DataTable().rows.add(rows).draw(false);
+                }
+
+                if (page.length === page_size) {
+                    loadPage(offset + page_size);
+                } else {
+                    models.loaded = true;
+                }
+            }
+        });
+    };
+    loadPage(0);
+};
+
+// autograde all ungraded submissions in a background job, and check how far
+// it got every few seconds until it is done
+var autogradeUngraded = function () {
+    var button = $(".autograde-ungraded");
+    button.prop("disabled", true).text("Autograding, please wait...");
+
+    var failure = function () {
+        button.prop("disabled", false).text("Autograde all ungraded");
+        createModal(
+            "error-modal",
+            "Error",
+            "There was an error autograding '" + assignment_id + "'.");
+    };
+
+    var update = function (job) {
+        if (job["status"] === "queued" || job["status"] === "running") {
+            if (job["steps"]) {
+                button.text("Autograding " + job["completed"] + "/" + job["steps"] + ", please wait...");
+            }
+            setTimeout(function () {
+                $.get(base_url + "/formgrader/api/job/" + job["id"])
+                    .done(function (response) { update(JSON.parse(response)); })
+                    .fail(failure);
+            }, job_poll_interval);
+            return;
+        }
+
+        button.prop("disabled", false).text("Autograde all ungraded");
+        loadSubmissions();
+        if (job["success"]) {
+            createLogModal(
+                "success-modal",
+                "Success",
+                "Successfully autograded " + job["completed"] + " submission(s) of '" + assignment_id + "'.",
+                job["log"]);
+        } else {
+            createLogModal(
+                "error-modal",
+                "Error",
+                "There was an error autograding the submissions of '" + assignment_id + "':",
+                job["log"],
+                job["error"]);
         }
-    });
+    };
+
+    $.post(base_url + "/formgrader/api/jobs", JSON.stringify({
+        action: "autograde_ungraded",
+        assignment_id: assignment_id
+    }))
+        .done(function (response) { update(JSON.parse(response)); })
+        .fail(failure);
 };
 
+var page_size = 200;
+var job_poll_interval = 2000;
 var models = undefined;
 var views = [];
 $(window).load(function () {
     loadSubmissions();
+    $(".autograde-ungraded").click(autogradeUngraded);
 });
@@ -0,0 +1,147 @@
+import time
+import bisect
+import threading
+
+from textwrap import dedent
+
+from traitlets import Float
+from traitlets.config import LoggingConfigurable
+
+
+class SubmissionOrdering(object):
+    """The order in which the formgrader walks through the submissions of a
+    notebook, i.e. the ids of the submissions that exist on disk sorted by
+    id, together with the ids of the submissions that fail tests.
+
+    Looking up the submission before or after a submission takes constant
+    time. Submissions that are not part of the ordering (e.g. because they
+    were autograded after the ordering was built) are placed by their id.
+
+    """
+
+    def __init__(self, submission_ids, incorrect_ids):
+        self.ids = sorted(submission_ids)
+        self.incorrect_ids = sorted(set(incorrect_ids))
+        self.indices = dict((x, i) for i, x in enumerate(self.ids))
+
+        # for every submission, the position in `incorrect_ids` of the first
+        # incorrect submission after it and of the last one before it
+        incorrect = set(self.incorrect_ids)
+        self._next_incorrect = [0] * len(self.ids)
+        self._prev_incorrect = [0] * len(self.ids)
+        count = 0
+        for i, submission_id in enumerate(self.ids):
+            self._prev_incorrect[i] = count - 1
+            if submission_id in incorrect:
+                count += 1
+            self._next_incorrect[i] = count
+
+    def _neighbor(self, ids, ix):
+        if 0 <= ix < len(ids):
+            return ids[ix]
+        return None
+
+    def next(self, submission_id):
+        """The id of the submission after the given one, or None if it is the
+        last submission."""
+        ix = self.indices.get(submission_id)
+        if ix is None:
+            ix = bisect.bisect_right(self.ids, submission_id) - 1
+        return self._neighbor(self.ids, ix + 1)
+
+    def prev(self, submission_id):
+        """The id of the submission before the given one, or None if it is the
+        first submission."""
+        ix = self.indices.get(submission_id)
+        if ix is None:
+            ix = bisect.bisect_left(self.ids, submission_id)
+        return self._neighbor(self.ids, ix - 1)
+
+    def next_incorrect(self, submission_id):
+        """The id of the first submission after the given one that fails
+        tests, or None if there is no such submission."""
+        ix = self.indices.get(submission_id)
+        if ix is None:
+            ix = bisect.bisect_right(self.incorrect_ids, submission_id)
+        else:
+            ix = self._next_incorrect[ix]
+        return self._neighbor(self.incorrect_ids, ix)
+
+    def prev_incorrect(self, submission_id):
+        """The id of the last submission before the given one that fails
+        tests, or None if there is no such submission."""
+        ix = self.indices.get(submission_id)
+        if ix is None:
+            ix = bisect.bisect_left(self.incorrect_ids, submission_id) - 1
+        else:
+            ix = self._prev_incorrect[ix]
+        return self._neighbor(self.incorrect_ids, ix)
+
+
+class SubmissionIndex(LoggingConfigurable):
+    """The orderings of the submissions of each notebook, which are built once
+    and reused until the submissions or the gradebook change."""
+
+    max_age = Float(60, help=dedent(
+        """
+        The number of seconds for which the order of the submissions of a
+        notebook is reused. The formgrader rebuilds the order when it
+        autogrades or grades a submission, or when the gradebook changed, but
+        it does not know about submissions that are only copied to disk
+        outside of it, which are picked up after this long. Set this to 0 to
+        rebuild the order every time it is needed.
+        """)
+    ).tag(config=True)
+
+    def __init__(self, **kwargs):
+        super(SubmissionIndex, self).__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._orderings = {}
+
+    def get(self, assignment_id, notebook_id, build, version=None):
+        """Get the ordering of the submissions of a notebook.
+
+        Arguments
+        ---------
+        assignment_id: string
+            The name of the assignment
+        notebook_id: string
+            The name of the notebook
+        build: function
+            A function without arguments that returns the ids of the
+            submissions that exist on disk and the ids of the submissions that
+            fail tests, which is called if the ordering needs to be built
+        version: string
+            The version of the gradebook (see
+            :meth:`~nbgrader.api.Gradebook.version`). If it differs from the
+            version the ordering was built at, the ordering is built again.
+
+        Returns
+        -------
+        ordering: :class:`SubmissionOrdering`
+
+        """
+        key = (assignment_id, notebook_id)
+        now = time.time()
+        with self._lock:
+            if key in self._orderings:
+                built, built_version, ordering = self._orderings[key]
+                if now - built < self.max_age and built_version == version:
+                    return ordering
+
+        self.log.debug("Building the submission order of %s/%s", assignment_id, notebook_id)
+        ordering = SubmissionOrdering(*build())
+        with self._lock:
+            self._orderings[key] = (now, version, ordering)
+        return ordering
+
+    def invalidate(self, assignment_id=None, notebook_id=None):
+        """Forget the orderings of the submissions of a notebook, of all
+        notebooks in an assignment, or of all notebooks."""
+        with self._lock:
+            for key in list(self._orderings):
+                if assignment_id is not None and key[0] != assignment_id:
+                    continue
+                if notebook_id is not None and key[1] != notebook_id:
+                    continue
+                del self._orderings[key]
@@ -39,8 +39,10 @@ Manage Submissions
       <div class="panel-body">
         <p>
           <b>Note:</b> Here you can autograde individual students' submissions by
-          clicking on the autograde icons below. If you want to autograde
-          all submissions at once, you will need to do this via the
+          clicking on the autograde icons below. To autograde all submissions
+          that have not been autograded yet, click the "Autograde all ungraded"
+          button below; they are autograded in the background, one after
+          another. You can also autograde all submissions at once via the
           <a target="_blank" href="{{ base_url }}/terminals/1">command line</a>:
         </p>
         <p>
@@ -52,6 +54,9 @@ nbgrader autograde "{{ assignment_id }}"</pre>
     </div>
   </div>
 </div>
+<p>
+  <button type="button" class="btn btn-default autograde-ungraded">Autograde all ungraded</button>
+</p>
 {%- endblock -%}
 
 {%- block table_header -%}
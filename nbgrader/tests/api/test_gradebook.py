@@ -1,9 +1,14 @@
 import pytest
+import threading
+import multiprocessing
 
 from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 from ... import api
 from ... import utils
 from ...api import InvalidEntry, MissingEntry
+from ...coursedir import CourseDirectory
 
 
 @pytest.fixture
@@ -433,6 +438,106 @@ def test_remove_notebook(assignment):
             assignment.find_notebook(nb.name, 'foo')
 
 
+def test_shared_engine(tmpdir):
+    db_url = "sqlite:///" + str(tmpdir.join("gradebook.db"))
+    with api.Gradebook(db_url) as gb:
+        gb.add_student("hacker123")
+        engine = gb.engine
+        connection = gb.db.connection().connection.connection
+
+    # the engine is not disposed of when the gradebook is closed, and is
+    # reused (along with its connection) by the next gradebook
+    with api.Gradebook(db_url) as gb:
+        assert gb.engine is engine
+        assert gb.db.connection().connection.connection is connection
+        assert gb.find_student("hacker123").id == "hacker123"
+
+    # the tables are created again if the database file is removed
+    tmpdir.join("gradebook.db").remove()
+    with api.Gradebook(db_url) as gb:
+        assert gb.engine is engine
+        assert gb.students == []
+        gb.add_student("bitdiddle")
+
+    api.dispose_engines()
+    with api.Gradebook(db_url) as gb:
+        assert gb.engine is not engine
+        assert gb.find_student("bitdiddle").id == "bitdiddle"
+
+
+def test_relative_sqlite_path(tmpdir):
+    with tmpdir.as_cwd():
+        url = api._normalize_db_url("sqlite:///gradebook.db")
+    assert url == "sqlite:///" + str(tmpdir.join("gradebook.db"))
+    assert api._normalize_db_url("postgresql://localhost/nbgrader") == "postgresql://localhost/nbgrader"
+
+
+def test_memory_engine_not_shared():
+    with api.Gradebook("sqlite:///:memory:") as gb_one:
+        gb_one.add_student("hacker123")
+        with api.Gradebook("sqlite:///:memory:") as gb_two:
+            assert gb_one.engine is not gb_two.engine
+            assert gb_two.students == []
+
+
+def test_from_coursedir(tmpdir):
+    db_url = "sqlite:///" + str(tmpdir.join("gradebook.db"))
+    coursedir = CourseDirectory(
+        db_url=db_url, course_id="course101", db_sqlite_concurrency=True,
+        db_sqlite_busy_timeout=10000)
+    with api.Gradebook.from_coursedir(coursedir) as gb:
+        assert gb.course_id == "course101"
+        assert gb.db.execute("PRAGMA journal_mode").scalar() == "wal"
+        assert gb.db.execute("PRAGMA busy_timeout").scalar() == 10000
+
+    with api.Gradebook.from_coursedir(coursedir, course_id="other") as gb:
+        assert gb.course_id == "other"
+
+
+def _write_students(db_url, n):
+    with api.Gradebook(db_url, sqlite_pragmas=api.sqlite_concurrency_pragmas()) as gb:
+        for i in range(n):
+            gb.add_student("student{}".format(i))
+            gb.add_assignment("assignment{}".format(i))
+            gb.add_submission("assignment{}".format(i), "student{}".format(i))
+
+
+def test_sqlite_concurrency(tmpdir):
+    db_url = "sqlite:///" + str(tmpdir.join("gradebook.db"))
+    pragmas = api.sqlite_concurrency_pragmas(busy_timeout=10000)
+    with api.Gradebook(db_url, sqlite_pragmas=pragmas) as gb:
+        assert gb.db.execute("PRAGMA journal_mode").scalar() == "wal"
+        assert gb.db.execute("PRAGMA busy_timeout").scalar() == 10000
+        assert gb.db.execute("PRAGMA synchronous").scalar() == 1
+
+    ctx = multiprocessing.get_context("fork")
+    writer = ctx.Process(target=_write_students, args=(db_url, 50))
+    errors = []
+
+    def read_students():
+        try:
+            while writer.is_alive():
+                with api.Gradebook(db_url, sqlite_pragmas=pragmas) as gb:
+                    gb.submission_dicts("assignment0")
+                    len(gb.students)
+        except Exception as e:
+            errors.append(e)
+
+    writer.start()
+    readers = [threading.Thread(target=read_students) for i in range(4)]
+    for reader in readers:
+        reader.start()
+    writer.join()
+    for reader in readers:
+        reader.join()
+
+    assert writer.exitcode == 0
+    assert errors == []
+    with api.Gradebook(db_url) as gb:
+        assert len(gb.students) == 50
+        assert len(gb.assignments) == 50
+
+
 def test_course_id_constructor():
     gb = api.Gradebook("sqlite:///:memory:")
     assert gb.db.query(api.Course).first().id == "default_course"
@@ -701,6 +806,57 @@ def test_add_duplicate_submission(assignment):
         assignment.add_submission('foo', 'hacker123')
 
 
+def test_add_submissions(assignmentWithTask):
+    gb = assignmentWithTask
+    gb.add_student('hacker123')
+    gb.add_student('bitdiddle')
+    gb.add_student('louisreasoner')
+    s1, s2 = gb.add_submissions('foo', ['hacker123', 'bitdiddle'], timestamp='2020-01-01 10:00:00')
+    s3 = gb.add_submission('foo', 'louisreasoner', timestamp='2020-01-01 10:00:00')
+
+    assert s1 == gb.find_submission('foo', 'hacker123')
+    assert s2 == gb.find_submission('foo', 'bitdiddle')
+    assert s1.timestamp == s3.timestamp
+
+    # the bulk submissions should have exactly the same structure as one
+    # added with add_submission
+    def structure(submission):
+        return sorted(
+            (nb.name, sorted(g.name for g in nb.grades), sorted(c.name for c in nb.comments))
+            for nb in submission.notebooks)
+
+    assert structure(s1) == structure(s3)
+    assert structure(s2) == structure(s3)
+    assert s1.score == 0
+    assert s1.max_score == s3.max_score == 88
+    assert s1.needs_manual_grade
+
+    grade = gb.find_grade('task1', 'p1', 'foo', 'hacker123')
+    grade.manual_score = 1
+    gb.db.commit()
+    assert s1.score == 1
+    assert gb.find_student('hacker123').score == 1
+
+
+def test_add_submissions_invalid(assignment):
+    assignment.add_student('hacker123')
+    assignment.add_student('bitdiddle')
+    assignment.add_submission('foo', 'hacker123')
+
+    with pytest.raises(MissingEntry):
+        assignment.add_submissions('foo', ['bitdiddle', 'louisreasoner'])
+    with pytest.raises(MissingEntry):
+        assignment.add_submissions('bar', ['bitdiddle'])
+
+    # nothing is added if one of the submissions already exists
+    with pytest.raises(InvalidEntry):
+        assignment.add_submissions('foo', ['bitdiddle', 'hacker123'])
+    with pytest.raises(MissingEntry):
+        assignment.find_submission('foo', 'bitdiddle')
+    assert assignment.db.query(api.SubmittedNotebook).count() == 1
+    assert assignment.db.query(api.Grade).count() == 2
+
+
 def test_remove_submission(assignment):
     assignment.add_student('hacker123')
     assignment.add_submission('foo', 'hacker123')
@@ -836,6 +992,95 @@ def test_find_comment_by_id(assignment):
         assignment.find_comment_by_id('12345')
 
 
+def test_update_grades_and_comments(assignment):
+    assignment.add_student('hacker123')
+    assignment.add_student('bitdiddle')
+    s1, s2 = assignment.add_submissions('foo', ['hacker123', 'bitdiddle'])
+    g1 = assignment.find_grade('test1', 'p1', 'foo', 'hacker123')
+    g2 = assignment.find_grade('test2', 'p1', 'foo', 'bitdiddle')
+    c1 = assignment.find_comment('solution1', 'p1', 'foo', 'bitdiddle')
+    g1.auto_score = 1
+    assignment.db.commit()
+
+    grades, comments = assignment.update_grades_and_comments(
+        grades=[
+            {'id': g2.id, 'manual_score': '1.5', 'extra_credit': 1},
+            {'id': g1.id, 'manual_score': None},
+        ],
+        comments=[{'id': c1.id, 'manual_comment': 'good job'}])
+    assert grades == [g2, g1]
+    assert comments == [c1]
+
+    assert g1.manual_score is None
+    assert not g1.needs_manual_grade
+    assert g2.manual_score == 1.5
+    assert g2.extra_credit == 1
+    assert not g2.needs_manual_grade
+    assert c1.manual_comment == 'good job'
+    assert s1.score == 1
+    assert s2.score == 2.5
+
+    grades, comments = assignment.update_grades_and_comments(grades=[{'id': g2.id}])
+    assert g2.manual_score is None
+    assert g2.needs_manual_grade
+    assert comments == []
+
+
+def test_update_grades_and_comments_invalid(assignment):
+    assignment.add_student('hacker123')
+    assignment.add_submission('foo', 'hacker123')
+    g1 = assignment.find_grade('test1', 'p1', 'foo', 'hacker123')
+    c1 = assignment.find_comment('solution1', 'p1', 'foo', 'hacker123')
+
+    # none of the updates are applied if one of them is invalid
+    with pytest.raises(MissingEntry):
+        assignment.update_grades_and_comments(
+            grades=[{'id': g1.id, 'manual_score': 1}, {'id': '12345', 'manual_score': 1}])
+    with pytest.raises(MissingEntry):
+        assignment.update_grades_and_comments(
+            grades=[{'id': g1.id, 'manual_score': 1}], comments=[{'id': g1.id}])
+    with pytest.raises(InvalidEntry):
+        assignment.update_grades_and_comments(
+            grades=[{'id': g1.id, 'manual_score': 1}, {'id': g1.id, 'extra_credit': 'lots'}])
+    with pytest.raises(InvalidEntry):
+        assignment.update_grades_and_comments(
+            comments=[{'id': c1.id, 'manual_comment': 1}])
+    with pytest.raises(InvalidEntry):
+        assignment.update_grades_and_comments(grades=[{'manual_score': 1}])
+
+    assignment.db.expire_all()
+    assert g1.manual_score is None
+    assert c1.manual_comment is None
+
+
+def test_find_submission_notebook_grades(assignment):
+    assignment.add_student('hacker123')
+    assignment.add_student('bitdiddle')
+    s = assignment.add_submission('foo', 'hacker123')
+    assignment.add_submission('foo', 'bitdiddle')
+    n1, = s.notebooks
+
+    with assignment.count_queries() as counter:
+        grades = assignment.find_submission_notebook_grades('p1', 'foo', 'hacker123')
+    assert counter.count == 1
+    assert grades == {g.name: g for g in n1.grades}
+    assert assignment.find_submission_notebook_grades('p2', 'foo', 'hacker123') == {}
+
+
+def test_find_submission_notebook_comments(assignment):
+    assignment.add_student('hacker123')
+    assignment.add_student('bitdiddle')
+    s = assignment.add_submission('foo', 'hacker123')
+    assignment.add_submission('foo', 'bitdiddle')
+    n1, = s.notebooks
+
+    with assignment.count_queries() as counter:
+        comments = assignment.find_submission_notebook_comments('p1', 'foo', 'hacker123')
+    assert counter.count == 1
+    assert comments == {c.name: c for c in n1.comments}
+    assert assignment.find_submission_notebook_comments('p2', 'foo', 'hacker123') == {}
+
+
 # Test average scores
 
 def test_average_assignment_score(assignment):
@@ -956,6 +1201,119 @@ def test_notebook_submission_dicts(assignment):
     assert a == b
 
 
+def test_notebook_submission_dicts_sort_and_filter(assignment):
+    for student_id in ['hacker123', 'bitdiddle', 'louisreasoner']:
+        assignment.add_student(student_id)
+        assignment.add_submission('foo', student_id)
+    assignment.find_submission_notebook('p1', 'foo', 'bitdiddle').flagged = True
+    assignment.find_grade("test1", "p1", "foo", "hacker123").manual_score = 1
+    assignment.find_grade("test1", "p1", "foo", "louisreasoner").manual_score = 0.5
+    assignment.db.commit()
+
+    def students(**kwargs):
+        return [x["student"] for x in assignment.notebook_submission_dicts("p1", "foo", **kwargs)]
+
+    assert students(sort="student") == ['bitdiddle', 'hacker123', 'louisreasoner']
+    assert students(sort="-student") == ['louisreasoner', 'hacker123', 'bitdiddle']
+    assert students(sort="-score") == ['hacker123', 'louisreasoner', 'bitdiddle']
+    assert students(sort="student", limit=2) == ['bitdiddle', 'hacker123']
+    assert students(sort="student", limit=2, offset=2) == ['louisreasoner']
+    assert students(flagged=True) == ['bitdiddle']
+    assert students(sort="student", flagged=False) == ['hacker123', 'louisreasoner']
+    assert students(student_prefix="h") == ['hacker123']
+    assert students(student_prefix="%") == []
+
+    nb = assignment.find_submission_notebook('p1', 'foo', 'hacker123')
+    assert students(sort="student", exclude_ids=[nb.id]) == ['bitdiddle', 'louisreasoner']
+    assert students(sort="student", exclude_ids=[nb.id], limit=1, offset=1) == ['louisreasoner']
+
+    with pytest.raises(ValueError):
+        students(sort="foo")
+
+
+def test_submission_dicts_sort_and_filter(assignment):
+    for student_id in ['hacker123', 'bitdiddle', 'louisreasoner']:
+        assignment.add_student(student_id)
+        assignment.add_submission('foo', student_id)
+    for submission in assignment.find_assignment('foo').submissions:
+        submission.timestamp = None
+    assignment.find_submission('foo', 'bitdiddle').timestamp = datetime(2020, 1, 1)
+    assignment.db.commit()
+
+    def students(**kwargs):
+        return [x["student"] for x in assignment.submission_dicts("foo", **kwargs)]
+
+    assert students() == ['bitdiddle', 'hacker123', 'louisreasoner']
+    # submissions without a timestamp come first
+    assert students(sort="timestamp") == ['hacker123', 'louisreasoner', 'bitdiddle']
+    assert students(sort="-timestamp") == ['bitdiddle', 'hacker123', 'louisreasoner']
+    assert students(sort="-student", offset=1) == ['hacker123', 'bitdiddle']
+    assert students(needs_manual_grade=True) == ['bitdiddle', 'hacker123', 'louisreasoner']
+    assert students(needs_manual_grade=False) == []
+    assert students(student_prefix="louis") == ['louisreasoner']
+    assert students(exclude_students=['hacker123']) == ['bitdiddle', 'louisreasoner']
+    assert students(exclude_students=['bitdiddle'], limit=1) == ['hacker123']
+
+    # more excluded students than SQLite allows parameters in a statement
+    exclude = ['student{}'.format(i) for i in range(50000)] + ['hacker123']
+    assert students(exclude_students=exclude, limit=1, offset=1) == ['louisreasoner']
+    # the temporary table of excluded students is dropped again
+    assert students(exclude_students=exclude) == ['bitdiddle', 'louisreasoner']
+
+
+def test_grade_matrix(FiveStudents):
+    gb = FiveStudents
+    gb.add_assignment('a2', duedate='2020-01-01 00:00:00')
+    gb.add_student('s6')
+    submission = gb.find_submission('a1', 's1')
+    submission.timestamp = datetime(2020, 1, 1)
+    gb.find_grade('grade_code1', 'n1', 'a1', 's2').manual_score = 0
+    gb.db.commit()
+    gb.db.query(api.SubmittedAssignment)\
+        .filter(api.SubmittedAssignment.id == submission.id)\
+        .update({api.SubmittedAssignment.late_submission_penalty: 3})
+    gb.db.commit()
+
+    with gb.count_queries() as counter:
+        grades = list(gb.grade_matrix())
+    assert counter.count == 1
+    assert len(grades) == 12
+
+    for grade in grades:
+        try:
+            submission = gb.find_submission(grade['assignment'], grade['student_id'])
+        except MissingEntry:
+            assert not grade['submitted']
+            assert grade['timestamp'] is None
+            assert grade['raw_score'] == grade['score'] == 0
+        else:
+            assert grade['submitted']
+            assert grade['timestamp'] == submission.timestamp
+            assert grade['raw_score'] == submission.score
+            assert grade['late_submission_penalty'] == submission.late_submission_penalty
+            assert grade['score'] == submission.score - submission.late_submission_penalty
+        assignment = gb.find_assignment(grade['assignment'])
+        assert grade['duedate'] == assignment.duedate
+        assert grade['max_score'] == assignment.max_score
+
+    assert grades[0]['assignment'] == 'a1'
+    assert grades[0]['student_id'] == 's1'
+    assert grades[0]['score'] == 330
+    assert grades[1]['score'] == 332
+
+    grades = list(gb.grade_matrix(assignments=['a1'], students=['s1', 's6']))
+    assert [(x['assignment'], x['student_id'], x['submitted']) for x in grades] == [
+        ('a1', 's1', True), ('a1', 's6', False)]
+
+    # more assignments and students than SQLite allows parameters in a statement
+    assignments = ['a{}'.format(i) for i in range(1, 50000)]
+    students = ['s{}'.format(i) for i in range(1, 50000)]
+    grades = list(gb.grade_matrix(assignments=assignments, students=students))
+    assert len(grades) == 12
+    assert grades[0]['student_id'] == 's1'
+    assert list(gb.grade_matrix(assignments=assignments, students=students)) == grades
+
+
 def test_submission_dicts(assignment):
     assignment.add_student('hacker123')
     assignment.add_student('bitdiddle')
@@ -1224,6 +1582,44 @@ def test_average_notebook_with_score(assignmentWithSubmissionWithMarks):
     assert assignmentWithSubmissionWithMarks.average_notebook_task_score('p1', 'foo') == sum(assignmentWithSubmissionWithMarks.usedgrades_task) / 2.0
 
 
+def test_score_stats(assignmentWithSubmissionWithMarks):
+    gb = assignmentWithSubmissionWithMarks
+    with gb.count_queries() as counter:
+        stats = gb.score_stats()
+    assert counter.count == 1
+    assert sorted(stats) == ['foo', 'foo2']
+
+    for assignment in gb.assignments:
+        x = stats[assignment.name]
+        assert x["num_submissions"] == assignment.num_submissions
+        assert x["average_score"] == pytest.approx(gb.average_assignment_score(assignment.name))
+        assert x["average_code_score"] == pytest.approx(gb.average_assignment_code_score(assignment.name))
+        assert x["average_written_score"] == pytest.approx(gb.average_assignment_written_score(assignment.name))
+        assert x["average_task_score"] == pytest.approx(gb.average_assignment_task_score(assignment.name))
+        assert x["max_score"] == assignment.max_score
+        assert x["max_code_score"] == assignment.max_code_score
+        assert x["max_written_score"] == assignment.max_written_score
+        assert x["max_task_score"] == assignment.max_task_score
+
+    for assignment in ['foo', 'foo2']:
+        with gb.count_queries() as counter:
+            stats = gb.score_stats(assignment)
+        assert counter.count == 1
+        assert sorted(stats) == ['p1', 'p2']
+
+        for notebook in gb.find_assignment(assignment).notebooks:
+            x = stats[notebook.name]
+            assert x["num_submissions"] == notebook.num_submissions
+            assert x["average_score"] == pytest.approx(gb.average_notebook_score(notebook.name, assignment))
+            assert x["average_code_score"] == pytest.approx(gb.average_notebook_code_score(notebook.name, assignment))
+            assert x["average_written_score"] == pytest.approx(gb.average_notebook_written_score(notebook.name, assignment))
+            assert x["average_task_score"] == pytest.approx(gb.average_notebook_task_score(notebook.name, assignment))
+            assert x["max_score"] == notebook.max_score
+            assert x["max_code_score"] == notebook.max_code_score
+            assert x["max_written_score"] == notebook.max_written_score
+            assert x["max_task_score"] == notebook.max_task_score
+
+
 def test_student_dicts(assignmentWithSubmissionWithMarks):
     assign = assignmentWithSubmissionWithMarks
     students = assign.student_dicts()
@@ -1260,6 +1656,150 @@ def test_submission_max_score_multiple_notebooks(FiveNotebooks):
         assert n.max_score == 555
 
 
+def test_score_aggregates(assignmentWithSubmissionWithMarks):
+    gb = assignmentWithSubmissionWithMarks
+    assert gb.check_score_aggregates() == []
+
+    # changing a grade updates the scores of the submission right away
+    submission = gb.find_submission('foo', 'bitdiddle')
+    notebook = gb.find_submission_notebook('p1', 'foo', 'bitdiddle')
+    score = submission.score
+    grade = gb.find_grade("grade_code1", "p1", "foo", "bitdiddle")
+    grade.manual_score = grade.score + 1
+    gb.db.flush()
+    assert notebook.score == score + 1
+    assert notebook.code_score == sum(gb.usedgrades_code) + 1
+    assert submission.score == score + 1
+    gb.db.commit()
+    assert gb.find_student('bitdiddle').score == score + 1
+    assert gb.check_score_aggregates() == []
+
+    # and changing the max score of a cell updates the max scores
+    max_score = submission.max_score
+    max_code_score = gb.find_notebook('p1', 'foo').max_code_score
+    gb.update_or_create_grade_cell('grade_code1', 'p1', 'foo', max_score=5)
+    assert gb.find_notebook('p1', 'foo').max_code_score == max_code_score + 4
+    assert gb.find_assignment('foo').max_score == max_score + 4
+    assert gb.find_submission('foo', 'bitdiddle').max_score == max_score + 4
+    assert gb.check_score_aggregates() == []
+
+
+def test_rebuild_score_aggregates(assignmentWithSubmissionWithMarks):
+    gb = assignmentWithSubmissionWithMarks
+    submission = gb.find_submission('foo', 'hacker123')
+    score = submission.score
+    gb.db.execute(
+        "UPDATE submitted_assignment SET score = score + 1 WHERE id = '{}'".format(submission.id))
+    gb.db.commit()
+
+    errors = gb.check_score_aggregates()
+    assert errors == [('submitted_assignment', submission.id, 'score', score + 1, score)]
+
+    gb.rebuild_score_aggregates()
+    assert gb.check_score_aggregates() == []
+    assert gb.find_submission('foo', 'hacker123').score == score
+
+
+def test_submission_dicts_stored_scores(assignmentWithSubmissionWithMarks):
+    # the listings read the stored scores rather than computing them
+    gb = assignmentWithSubmissionWithMarks
+    submission = gb.find_submission('foo', 'hacker123')
+    notebook = gb.find_submission_notebook('p1', 'foo', 'hacker123')
+    gb.db.execute(
+        "UPDATE submitted_assignment SET score = 100 WHERE id = '{}'".format(submission.id))
+    gb.db.execute(
+        "UPDATE submitted_notebook SET code_score = 100 WHERE id = '{}'".format(notebook.id))
+    gb.db.commit()
+
+    submissions = {x["student"]: x for x in gb.submission_dicts("foo")}
+    assert submissions["hacker123"]["score"] == 100
+    submissions = {x["student"]: x for x in gb.notebook_submission_dicts("p1", "foo")}
+    assert submissions["hacker123"]["code_score"] == 100
+
+
+def test_session_events(assignment):
+    # only the sessions of gradebooks update the score aggregates, not every
+    # session in the process
+    assert not event.contains(Session, "after_flush", api._update_score_aggregates)
+    assert event.contains(assignment._engine.session_factory, "after_flush", api._update_score_aggregates)
+
+
+def test_version(assignment):
+    gb = assignment
+    version = gb.version()
+    assert gb.version() == version
+
+    # reading doesn't change the version
+    gb.find_assignment('foo').notebooks
+    gb.db.commit()
+    assert gb.version() == version
+
+    gb.add_student('hacker123')
+    assert gb.version() != version
+    version = gb.version()
+
+    grade = gb.add_submission('foo', 'hacker123').notebooks[0].grades[0]
+    assert gb.version() != version
+    version = gb.version()
+
+    grade.manual_score = 1
+    gb.db.commit()
+    assert gb.version() != version
+    version = gb.version()
+
+    gb.add_student('bitdiddle')
+    version = gb.version()
+    gb.add_submissions('foo', ['bitdiddle'])
+    assert gb.version() != version
+    version = gb.version()
+
+    gb.remove_submission('foo', 'bitdiddle')
+    assert gb.version() != version
+
+
+def test_version_shared(tmpdir):
+    db_url = "sqlite:///" + str(tmpdir.join("gradebook.db"))
+    with api.Gradebook(db_url) as gb:
+        version = gb.version()
+
+    # changes made elsewhere (e.g. by another process) are seen as well
+    with api.Gradebook(db_url) as gb:
+        gb.add_student('hacker123')
+
+    with api.Gradebook(db_url) as gb:
+        assert gb.version() != version
+        version = gb.version()
+
+    # including by another process, which doesn't change the version of this
+    # process
+    ctx = multiprocessing.get_context("fork")
+    writer = ctx.Process(target=_write_students, args=(db_url, 1))
+    writer.start()
+    writer.join()
+    with api.Gradebook(db_url) as gb:
+        assert gb.version() != version
+
+
+@pytest.mark.parametrize("pragmas", [None, api.sqlite_concurrency_pragmas()])
+def test_version_sqlite(tmpdir, pragmas):
+    # SQLite databases aren't written to just to change their version, and
+    # every commit of another process is seen, even if it is quicker than the
+    # resolution of modification times
+    db_url = "sqlite:///" + str(tmpdir.join("gradebook.db"))
+    with api.Gradebook(db_url, sqlite_pragmas=pragmas) as gb:
+        gb.add_student('hacker123')
+        versions = set([gb.version()])
+        for i in range(10):
+            other = api._DatabaseEngine(gb._engine.db_url)
+            other.sqlite_pragmas = pragmas
+            with other.engine.begin() as connection:
+                connection.execute(api.Student.__table__.update().values(first_name=str(i)))
+            other.dispose()
+            versions.add(gb.version())
+        assert len(versions) == 11
+        assert gb.db.query(api.GradebookVersion.version).scalar() == 0
+
+
 def test_notebook_submission_dicts_multiple_students(FiveStudents):
     assign = FiveStudents
     notebook = assign.find_notebook("n1", "a1")
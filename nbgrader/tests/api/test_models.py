@@ -12,7 +12,9 @@ from ... import api
 @pytest.fixture
 def db(request):
     engine = create_engine("sqlite:///:memory:")
-    db = scoped_session(sessionmaker(autoflush=True, bind=engine))
+    session_factory = sessionmaker(autoflush=True, bind=engine)
+    api.register_session_events(session_factory)
+    db = scoped_session(session_factory)
     api.Base.query = db.query_property()
     api.Base.metadata.create_all(bind=engine)
 
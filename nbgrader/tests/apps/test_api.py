@@ -9,6 +9,7 @@ from traitlets.config import Config
 from datetime import datetime
 
 from ...apps.api import NbGraderAPI
+from ...exchange import ExchangeList
 from ...coursedir import CourseDirectory
 from ...utils import rmtree, get_username, parse_utc
 from .. import run_nbgrader
@@ -57,6 +58,65 @@ class TestNbGraderAPI(BaseTestApp):
         api.course_id = None
         assert api.get_released_assignments() == set([])
 
+    @notwindows
+    def test_get_released_assignments_cached(self, api, exchange, course_dir, monkeypatch):
+        listings = []
+        start = ExchangeList.start
+
+        def counting_start(self):
+            listings.append(self.coursedir.assignment_id)
+            return start(self)
+
+        monkeypatch.setattr(ExchangeList, "start", counting_start)
+        assert api.get_released_assignments() == set([])
+        assert api.get_released_assignments() == set([])
+        assert len(listings) == 1
+
+        # releasing through the API invalidates the cache
+        self._copy_file(join("files", "test.ipynb"), join(course_dir, "source", "ps1", "p1.ipynb"))
+        api.generate_assignment("ps1")
+        assert api.release_assignment("ps1")["success"]
+        del listings[:]
+        assert api.get_released_assignments() == {"ps1"}
+        assert len(listings) == 1
+
+        # releasing elsewhere changes the outbound directory
+        self._copy_file(join("files", "test.ipynb"), join(course_dir, "release", "ps2", "p1.ipynb"))
+        run_nbgrader(["release_assignment", "ps2", "--course", "abc101", "--Exchange.root={}".format(exchange)])
+        assert api.get_released_assignments() == {"ps1", "ps2"}
+        assert api.get_released_assignments() == {"ps1", "ps2"}
+        assert len(listings) == 2
+
+        # after the TTL, the assignments are listed again
+        api.released_assignments_ttl = 0
+        assert api.get_released_assignments() == {"ps1", "ps2"}
+        assert len(listings) == 3
+
+    @notwindows
+    def test_invalidate(self, api, exchange, course_dir):
+        assert api.exchange_is_functional
+
+        # the exchange is only checked again when the API is invalidated
+        os.rmdir(exchange)
+        assert api.exchange_is_functional
+        api.invalidate()
+        assert not api.exchange_is_functional
+
+        os.mkdir(exchange)
+        api.invalidate()
+        assert api.exchange_is_functional
+
+    def test_refresh_exchange(self, api, exchange, course_dir):
+        assert api.exchange_is_functional
+
+        os.rmdir(exchange)
+        api.refresh_exchange()
+        assert not api.exchange_is_functional
+
+        os.mkdir(exchange)
+        api.refresh_exchange()
+        assert api.exchange_is_functional
+
     @windows
     def test_get_released_assignments_windows(self, api, exchange, course_dir):
         assert api.get_released_assignments() == set([])
@@ -122,6 +182,18 @@ class TestNbGraderAPI(BaseTestApp):
         self._make_file(join(course_dir, "submitted", "foo", "ps1", "timestamp.txt"), contents=timestamp.isoformat())
         assert api.get_autograded_students("ps1") == set([])
 
+    def test_get_ungraded_students(self, api, course_dir, db):
+        self._empty_notebook(join(course_dir, "source", "ps1", "problem1.ipynb"))
+        run_nbgrader(["generate_assignment", "ps1", "--db", db])
+        assert api.get_ungraded_students("ps1") == set([])
+
+        for student_id in ["bar", "foo"]:
+            self._empty_notebook(join(course_dir, "submitted", student_id, "ps1", "problem1.ipynb"))
+        assert api.get_ungraded_students("ps1") == {"bar", "foo"}
+
+        run_nbgrader(["autograde", "ps1", "--student", "foo", "--no-execute", "--force", "--db", db])
+        assert api.get_ungraded_students("ps1") == {"bar"}
+
     def test_get_assignment(self, api, course_dir, db, exchange):
         keys = set([
             'average_code_score', 'average_score', 'average_written_score',
@@ -305,6 +377,28 @@ class TestNbGraderAPI(BaseTestApp):
         target["max_written_score"] = 1
         assert n1 == target
 
+    def test_get_assignment_analytics(self, api, course_dir, db):
+        assert api.get_assignment_analytics("ps1") is None
+
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "source", "ps1", "p1.ipynb"))
+        run_nbgrader(["generate_assignment", "ps1", "--db", db])
+        a = api.get_assignment_analytics("ps1")
+        assert a["num_submissions"] == 0
+        assert a["total"]["max_score"] == 0
+
+        self._copy_file(join("files", "submitted-changed.ipynb"), join(course_dir, "submitted", "foo", "ps1", "p1.ipynb"))
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "submitted", "bar", "ps1", "p1.ipynb"))
+        run_nbgrader(["autograde", "ps1", "--no-execute", "--force", "--db", db])
+        a = api.get_assignment_analytics("ps1", bins=7)
+        assert a["num_submissions"] == 2
+        assert a["total"]["max_score"] == 7
+        scores = [api.get_submission("ps1", x)["score"] for x in ["foo", "bar"]]
+        assert a["total"]["mean"] == sum(scores) / 2
+        assert len(a["total"]["histogram"]["counts"]) == 7
+        assert [x["name"] for x in a["notebooks"]] == ["p1"]
+        assert len(a["cells"]) == 4
+        assert all(x["notebook"] == "p1" for x in a["cells"])
+
     def test_get_submission(self, api, course_dir, db):
         keys = set([
             "id", "name", "student", "last_name", "first_name", "score",
@@ -438,6 +532,64 @@ class TestNbGraderAPI(BaseTestApp):
         s1, = api.get_submissions("ps1")
         assert s1 == api.get_submission("ps1", "foo")
 
+    def test_get_submissions_paged(self, api, course_dir, db):
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "source", "ps1", "p1.ipynb"))
+        run_nbgrader(["generate_assignment", "ps1", "--db", db])
+
+        for student_id in ["bar", "baz", "foo"]:
+            self._copy_file(join("files", "submitted-changed.ipynb"), join(course_dir, "submitted", student_id, "ps1", "p1.ipynb"))
+        run_nbgrader(["autograde", "ps1", "--no-execute", "--force", "--db", db])
+        self._copy_file(join("files", "submitted-changed.ipynb"), join(course_dir, "submitted", "abc", "ps1", "p1.ipynb"))
+
+        submissions = api.get_submissions("ps1")
+        assert [x["student"] for x in submissions] == ["abc", "bar", "baz", "foo"]
+
+        # the submission that needs to be autograded is sorted in among the
+        # others
+        pages = [api.get_submissions("ps1", sort="-student", limit=3, offset=i) for i in range(0, 6, 3)]
+        assert [[x["student"] for x in page] for page in pages] == [["foo", "baz", "bar"], ["abc"]]
+        assert pages[0][0] == submissions[3]
+        assert pages[1][0] == submissions[0]
+        page = api.get_submissions("ps1", sort="student", limit=2, offset=1)
+        assert page == submissions[1:3]
+
+        page = api.get_submissions("ps1", sort="student", offset=1, needs_manual_grade=True)
+        assert [x["student"] for x in page] == ["baz", "foo"]
+        assert api.get_submissions("ps1", needs_manual_grade=False) == [submissions[0]]
+        assert api.get_submissions("ps1", student_prefix="ba") == submissions[1:3]
+
+        with pytest.raises(ValueError):
+            api.get_submissions("ps1", sort="foo")
+
+    def test_get_versions(self, api, course_dir, db):
+        api.directory_cache_ttl = 0
+        versions = [api.get_assignments_version(), api.get_submissions_version("ps1"), api.get_students_version()]
+        assert versions == [api.get_assignments_version(), api.get_submissions_version("ps1"), api.get_students_version()]
+
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "source", "ps1", "p1.ipynb"))
+        run_nbgrader(["generate_assignment", "ps1", "--db", db])
+        assert api.get_assignments_version() != versions[0]
+        versions = [api.get_assignments_version(), api.get_submissions_version("ps1"), api.get_students_version()]
+
+        # new submissions change all the versions
+        self._copy_file(join("files", "submitted-changed.ipynb"), join(course_dir, "submitted", "foo", "ps1", "p1.ipynb"))
+        self._make_file(join(course_dir, "submitted", "foo", "ps1", "timestamp.txt"), contents=datetime.now().isoformat())
+        assert api.get_assignments_version() != versions[0]
+        assert api.get_submissions_version("ps1") != versions[1]
+        assert api.get_students_version() != versions[2]
+        versions = [api.get_assignments_version(), api.get_submissions_version("ps1"), api.get_students_version()]
+
+        run_nbgrader(["autograde", "ps1", "--no-execute", "--force", "--db", db])
+        assert api.get_submissions_version("ps1") != versions[1]
+        version = api.get_submissions_version("ps1")
+        assert api.get_submissions_version("ps2") != version
+
+        # as do changes to the database
+        with api.gradebook as gb:
+            gb.update_or_create_student("foo", first_name="A")
+        assert api.get_students_version() != versions[2]
+        assert api.get_submissions_version("ps1") != version
+
     def test_filter_existing_notebooks(self, api, course_dir, db):
         self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "source", "ps1", "p1.ipynb"))
         self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "source", "ps1", "p2.ipynb"))
@@ -511,6 +663,29 @@ class TestNbGraderAPI(BaseTestApp):
                 notebooks[i]["index"] = i
                 assert s[i] == notebooks[i]
 
+    def test_get_notebook_submissions_paged(self, api, course_dir, db):
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "source", "ps1", "p1.ipynb"))
+        run_nbgrader(["generate_assignment", "ps1", "--db", db])
+
+        for student_id in ["bar", "baz", "foo"]:
+            self._copy_file(join("files", "submitted-changed.ipynb"), join(course_dir, "submitted", student_id, "ps1", "p1.ipynb"))
+        run_nbgrader(["autograde", "ps1", "--no-execute", "--force", "--db", db])
+        os.remove(join(course_dir, "autograded", "baz", "ps1", "p1.ipynb"))
+
+        submissions = api.get_notebook_submissions("ps1", "p1")
+        assert [x["index"] for x in submissions] == [0, 1]
+
+        page = api.get_notebook_submissions("ps1", "p1", sort="-student", limit=1)
+        assert [x["student"] for x in page] == ["foo"]
+        page = api.get_notebook_submissions("ps1", "p1", sort="-student", limit=1, offset=1)
+        assert [x["student"] for x in page] == ["bar"]
+        assert api.get_notebook_submissions("ps1", "p1", sort="-student", offset=2) == []
+
+        page = api.get_notebook_submissions("ps1", "p1", student_prefix="fo")
+        assert page == [x for x in submissions if x["student"] == "foo"]
+        assert api.get_notebook_submissions("ps1", "p1", flagged=True) == []
+        assert api.get_notebook_submissions("ps1", "p1", flagged=False) == submissions
+
     def test_get_student(self, api, course_dir, db):
         assert api.get_student("foo") is None
 
@@ -719,6 +894,43 @@ class TestNbGraderAPI(BaseTestApp):
         result = api.autograde("ps1", "foo")
         assert result["success"]
 
+    def test_actions_coursedir(self, api, course_dir, monkeypatch):
+        # the actions don't change the course directory of the API, which may
+        # be used by other threads while they run
+        apps = []
+
+        def capture_log(app):
+            apps.append(app)
+            assert api.coursedir.assignment_id == ""
+            assert api.coursedir.student_id == "*"
+            return {"success": True}
+
+        monkeypatch.setattr("nbgrader.apps.api.capture_log", capture_log)
+        api.autograde("ps1", "foo")
+        api.generate_feedback("ps1")
+
+        assert [(x.coursedir.assignment_id, x.coursedir.student_id) for x in apps] == [("ps1", "foo"), ("ps1", "*")]
+        assert all(x.coursedir is not api.coursedir for x in apps)
+        assert all(x.coursedir.root == course_dir for x in apps)
+
+    def test_actions_jobs(self, api, monkeypatch):
+        # submissions are not processed in parallel worker processes, which
+        # would fork the (multithreaded) process using the API
+        api.config.BaseConverter.jobs = 2
+        apps = []
+
+        def capture_log(app):
+            apps.append(app)
+            return {"success": True}
+
+        monkeypatch.setattr("nbgrader.apps.api.capture_log", capture_log)
+        api.generate_assignment("ps1")
+        api.autograde("ps1", "foo")
+        api.generate_feedback("ps1")
+
+        assert len(apps) == 3
+        assert all(x.jobs == 1 for x in apps)
+
     def test_generate_feedback(self, api, course_dir, db):
         self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "source", "ps1", "p1.ipynb"))
         api.generate_assignment("ps1")
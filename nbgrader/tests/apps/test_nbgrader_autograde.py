@@ -5,10 +5,12 @@ import os
 import sys
 import json
 import pytest
+import sqlite3
 
 from os.path import join
 from textwrap import dedent
-from nbformat import current_nbformat
+from nbformat import current_nbformat, read as read_nb, write as write_nb
+from nbformat.v4 import new_notebook, new_code_cell
 
 from ...api import Gradebook, MissingEntry
 from ...utils import remove
@@ -94,6 +96,233 @@ class TestNbGraderAutograde(BaseTestApp):
             assert comment1.comment == None
             assert comment2.comment == None
 
+    def test_grade_two_pass(self, db, course_dir):
+        """Can files be graded with the sanitized notebook written to disk in between?"""
+        with open("nbgrader_config.py", "a") as fh:
+            fh.write("""c.CourseDirectory.db_assignments = [dict(name='ps1', duedate='2015-02-02 14:58:23.948203 America/Los_Angeles')]\n""")
+            fh.write("""c.CourseDirectory.db_students = [dict(id="foo"), dict(id="bar")]\n""")
+            fh.write("""c.Autograde.in_memory_pipeline = False""")
+
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "source", "ps1", "p1.ipynb"))
+        run_nbgrader(["generate_assignment", "ps1", "--db", db])
+
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "submitted", "foo", "ps1", "p1.ipynb"))
+        self._copy_file(join("files", "submitted-changed.ipynb"), join(course_dir, "submitted", "bar", "ps1", "p1.ipynb"))
+        run_nbgrader(["autograde", "ps1", "--db", db])
+
+        assert os.path.isfile(join(course_dir, "autograded", "foo", "ps1", "p1.ipynb"))
+        assert os.path.isfile(join(course_dir, "autograded", "bar", "ps1", "p1.ipynb"))
+
+        with Gradebook(db) as gb:
+            notebook = gb.find_submission_notebook("p1", "ps1", "foo")
+            assert notebook.score == 1
+            assert notebook.needs_manual_grade == False
+
+            notebook = gb.find_submission_notebook("p1", "ps1", "bar")
+            assert notebook.score == 2
+            assert notebook.needs_manual_grade == True
+
+    def test_grade_sqlite_concurrency(self, db, course_dir):
+        """Can files be graded with the SQLite concurrency settings enabled?"""
+        with open("nbgrader_config.py", "a") as fh:
+            fh.write("""c.CourseDirectory.db_assignments = [dict(name='ps1', duedate='2015-02-02 14:58:23.948203 America/Los_Angeles')]\n""")
+            fh.write("""c.CourseDirectory.db_students = [dict(id="foo"), dict(id="bar")]\n""")
+            fh.write("""c.CourseDirectory.db_sqlite_concurrency = True""")
+
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "source", "ps1", "p1.ipynb"))
+        run_nbgrader(["generate_assignment", "ps1", "--db", db])
+
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "submitted", "foo", "ps1", "p1.ipynb"))
+        self._copy_file(join("files", "submitted-changed.ipynb"), join(course_dir, "submitted", "bar", "ps1", "p1.ipynb"))
+        run_nbgrader(["autograde", "ps1", "--db", db, "--jobs", "2"])
+
+        conn = sqlite3.connect(db[len("sqlite:///"):])
+        try:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        finally:
+            conn.close()
+
+        with Gradebook(db) as gb:
+            notebook = gb.find_submission_notebook("p1", "ps1", "foo")
+            assert notebook.score == 1
+
+            notebook = gb.find_submission_notebook("p1", "ps1", "bar")
+            assert notebook.score == 2
+
+    def test_grade_parallel(self, db, course_dir):
+        """Can files be graded with several worker processes?"""
+        with open("nbgrader_config.py", "a") as fh:
+            fh.write("""c.CourseDirectory.db_assignments = [dict(name='ps1', duedate='2015-02-02 14:58:23.948203 America/Los_Angeles')]\n""")
+            fh.write("""c.CourseDirectory.db_students = [dict(id="foo"), dict(id="bar"), dict(id="baz")]""")
+
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "source", "ps1", "p1.ipynb"))
+        run_nbgrader(["generate_assignment", "ps1", "--db", db])
+
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "submitted", "foo", "ps1", "p1.ipynb"))
+        self._copy_file(join("files", "submitted-changed.ipynb"), join(course_dir, "submitted", "bar", "ps1", "p1.ipynb"))
+        self._copy_file(join("files", "submitted-changed.ipynb"), join(course_dir, "submitted", "baz", "ps1", "p1.ipynb"))
+        run_nbgrader(["autograde", "ps1", "--db", db, "--jobs", "2"])
+
+        assert os.path.isfile(join(course_dir, "autograded", "foo", "ps1", "p1.ipynb"))
+        assert os.path.isfile(join(course_dir, "autograded", "bar", "ps1", "p1.ipynb"))
+        assert os.path.isfile(join(course_dir, "autograded", "baz", "ps1", "p1.ipynb"))
+
+        with Gradebook(db) as gb:
+            notebook = gb.find_submission_notebook("p1", "ps1", "foo")
+            assert notebook.score == 1
+            assert notebook.needs_manual_grade == False
+
+            notebook = gb.find_submission_notebook("p1", "ps1", "bar")
+            assert notebook.score == 2
+            assert notebook.needs_manual_grade == True
+
+            notebook = gb.find_submission_notebook("p1", "ps1", "baz")
+            assert notebook.score == 2
+            assert notebook.needs_manual_grade == True
+
+    def test_grade_parallel_all_stored(self, db, course_dir):
+        """Are the grades of all submissions stored when the workers write to
+        the gradebook at the same time?"""
+        students = ["student{}".format(i) for i in range(8)]
+        with open("nbgrader_config.py", "a") as fh:
+            fh.write("""c.CourseDirectory.db_assignments = [dict(name='ps1', duedate='2015-02-02 14:58:23.948203 America/Los_Angeles')]\n""")
+            fh.write("""c.CourseDirectory.db_students = [{}]""".format(
+                ", ".join("dict(id='{}')".format(x) for x in students)))
+
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "source", "ps1", "p1.ipynb"))
+        run_nbgrader(["generate_assignment", "ps1", "--db", db])
+
+        for i, student in enumerate(students):
+            name = "submitted-changed.ipynb" if i % 2 else "submitted-unchanged.ipynb"
+            self._copy_file(join("files", name), join(course_dir, "submitted", student, "ps1", "p1.ipynb"))
+        run_nbgrader(["autograde", "ps1", "--db", db, "--jobs", "2"])
+
+        with Gradebook(db) as gb:
+            for i, student in enumerate(students):
+                notebook = gb.find_submission_notebook("p1", "ps1", student)
+                assert notebook.score == (2 if i % 2 else 1)
+                assert notebook.needs_manual_grade == bool(i % 2)
+
+    @pytest.mark.parametrize("jobs", ["1", "2"])
+    def test_grade_kernel_pool(self, db, course_dir, jobs):
+        """Are notebooks executed in the right directory by pre-started kernels?"""
+        with open("nbgrader_config.py", "a") as fh:
+            fh.write("""c.CourseDirectory.db_assignments = [dict(name='ps1', duedate='2015-02-02 14:58:23.948203 America/Los_Angeles')]\n""")
+            fh.write("""c.CourseDirectory.db_students = [dict(id="foo"), dict(id="bar")]\n""")
+            fh.write("""c.Execute.kernel_pool_size = 2\n""")
+
+        self._empty_notebook(join(course_dir, "source", "ps1", "p1.ipynb"))
+        run_nbgrader(["generate_assignment", "ps1", "--db", db])
+
+        for student in ["foo", "bar"]:
+            nb = new_notebook()
+            nb.cells.append(new_code_cell("print(open('data.csv').read())"))
+            path = join(course_dir, "submitted", student, "ps1", "p1.ipynb")
+            self._empty_notebook(path)
+            with io.open(path, mode="w", encoding="utf-8") as fh:
+                write_nb(nb, fh, 4)
+            self._make_file(join(course_dir, "submitted", student, "ps1", "data.csv"), "data for {}\n".format(student))
+
+        run_nbgrader(["autograde", "ps1", "--db", db, "--jobs", jobs])
+
+        for student in ["foo", "bar"]:
+            with io.open(join(course_dir, "autograded", student, "ps1", "p1.ipynb"), mode="r", encoding="utf-8") as fh:
+                nb = read_nb(fh, 4)
+            assert nb.cells[0].outputs[0].text == "data for {}\n\n".format(student)
+            assert nb.cells[0].execution_count == 1
+
+    def test_grade_cache(self, db, course_dir):
+        """Are unchanged notebooks restored from the autograde cache?"""
+        with open("nbgrader_config.py", "a") as fh:
+            fh.write("""c.CourseDirectory.db_assignments = [dict(name='ps1', duedate='2015-02-02 14:58:23.948203 America/Los_Angeles')]\n""")
+            fh.write("""c.CourseDirectory.db_students = [dict(id="foo"), dict(id="bar")]""")
+
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "source", "ps1", "p1.ipynb"))
+        run_nbgrader(["generate_assignment", "ps1", "--db", db])
+
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "submitted", "foo", "ps1", "p1.ipynb"))
+        self._copy_file(join("files", "submitted-changed.ipynb"), join(course_dir, "submitted", "bar", "ps1", "p1.ipynb"))
+
+        # the cache is not used by default
+        run_nbgrader(["autograde", "ps1", "--db", db])
+        cache_dir = join(course_dir, ".nbgrader_cache", "autograde")
+        assert not os.path.exists(cache_dir)
+
+        run_nbgrader(["autograde", "ps1", "--db", db, "--force", "--cache"])
+        cached = [join(d, f) for d, _, files in os.walk(cache_dir) for f in files]
+        assert len(cached) == 2
+
+        # tamper with the cached notebooks and the grades, which should both
+        # be restored from the cache when re-running
+        for path in cached:
+            with io.open(path, mode="r", encoding="utf-8") as fh:
+                nb = read_nb(fh, 4)
+            nb.metadata["cached"] = True
+            with io.open(path, mode="w", encoding="utf-8") as fh:
+                write_nb(nb, fh, 4)
+
+        with Gradebook(db) as gb:
+            notebook = gb.find_submission_notebook("p1", "ps1", "bar")
+            for grade in notebook.grades:
+                grade.auto_score = None
+            gb.db.commit()
+
+        run_nbgrader(["autograde", "ps1", "--db", db, "--force", "--cache"])
+
+        for student in ["foo", "bar"]:
+            with io.open(join(course_dir, "autograded", student, "ps1", "p1.ipynb"), mode="r", encoding="utf-8") as fh:
+                nb = read_nb(fh, 4)
+            assert nb.metadata["cached"]
+
+        with Gradebook(db) as gb:
+            notebook = gb.find_submission_notebook("p1", "ps1", "foo")
+            assert notebook.score == 1
+            notebook = gb.find_submission_notebook("p1", "ps1", "bar")
+            assert notebook.score == 2
+
+        # a changed submission is autograded again
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "submitted", "bar", "ps1", "p1.ipynb"))
+        run_nbgrader(["autograde", "ps1", "--db", db, "--force", "--cache", "--student", "bar"])
+
+        with io.open(join(course_dir, "autograded", "bar", "ps1", "p1.ipynb"), mode="r", encoding="utf-8") as fh:
+            nb = read_nb(fh, 4)
+        assert "cached" not in nb.metadata
+
+        with Gradebook(db) as gb:
+            notebook = gb.find_submission_notebook("p1", "ps1", "bar")
+            assert notebook.score == 1
+
+    def test_grade_cache_budget(self, db, course_dir):
+        """Are the least recently used notebooks evicted from the autograde cache?"""
+        with open("nbgrader_config.py", "a") as fh:
+            fh.write("""c.CourseDirectory.db_assignments = [dict(name='ps1', duedate='2015-02-02 14:58:23.948203 America/Los_Angeles')]\n""")
+            fh.write("""c.CourseDirectory.db_students = [dict(id="foo"), dict(id="bar")]""")
+
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "source", "ps1", "p1.ipynb"))
+        run_nbgrader(["generate_assignment", "ps1", "--db", db])
+
+        self._copy_file(join("files", "submitted-unchanged.ipynb"), join(course_dir, "submitted", "foo", "ps1", "p1.ipynb"))
+        self._copy_file(join("files", "submitted-changed.ipynb"), join(course_dir, "submitted", "bar", "ps1", "p1.ipynb"))
+
+        cache_dir = join(course_dir, ".nbgrader_cache", "autograde")
+        run_nbgrader(["autograde", "ps1", "--db", db, "--cache", "--student", "foo"])
+        run_nbgrader(["autograde", "ps1", "--db", db, "--cache", "--student", "bar"])
+        cached = sorted(
+            (join(d, f) for d, _, files in os.walk(cache_dir) for f in files),
+            key=lambda x: os.stat(x).st_mtime)
+        assert len(cached) == 2
+
+        # the notebook of foo is the least recently used one
+        os.utime(cached[0], (0, 0))
+        budget = os.path.getsize(cached[1])
+        run_nbgrader(["autograde", "ps1", "--db", db, "--cache", "--force", "--student", "bar",
+                      "--Autograde.cache_budget={}".format(budget)])
+        assert not os.path.exists(cached[0])
+        assert os.path.exists(cached[1])
+
+        run_nbgrader(["autograde", "ps1", "--db", db, "--cache", "--force", "--Autograde.cache_budget=0"])
+        assert [f for _, _, files in os.walk(cache_dir) for f in files] == []
+
     def test_student_id_exclude(self, db, course_dir):
         """Does --CourseDirectory.student_id_exclude=X exclude students?"""
         with open("nbgrader_config.py", "a") as fh:
@@ -776,6 +1005,24 @@ class TestNbGraderAutograde(BaseTestApp):
         assert not os.path.exists(join(course_dir, "autograded", "bar", "ps1"))
         assert os.path.exists(join(course_dir, "autograded", "foo", "ps1"))
 
+    def test_handle_failure_parallel(self, course_dir):
+        with open("nbgrader_config.py", "a") as fh:
+            fh.write("""c.CourseDirectory.db_assignments = [dict(name='ps1', duedate='2015-02-02 14:58:23.948203 America/Los_Angeles')]\n""")
+            fh.write("""c.CourseDirectory.db_students = [dict(id="foo"), dict(id="bar")]""")
+
+        self._empty_notebook(join(course_dir, "source", "ps1", "p1.ipynb"))
+        self._empty_notebook(join(course_dir, "source", "ps1", "p2.ipynb"))
+        run_nbgrader(["generate_assignment", "ps1"])
+
+        self._empty_notebook(join(course_dir, "submitted", "bar", "ps1", "p1.ipynb"))
+        self._copy_file(join("files", "test.ipynb"), join(course_dir, "submitted", "bar", "ps1", "p2.ipynb"))
+        self._empty_notebook(join(course_dir, "submitted", "foo", "ps1", "p1.ipynb"))
+        self._empty_notebook(join(course_dir, "submitted", "foo", "ps1", "p2.ipynb"))
+        run_nbgrader(["autograde", "ps1", "--jobs", "2"], retcode=1)
+
+        assert not os.path.exists(join(course_dir, "autograded", "bar", "ps1"))
+        assert os.path.exists(join(course_dir, "autograded", "foo", "ps1"))
+
     def test_handle_failure_single_notebook(self, course_dir):
         with open("nbgrader_config.py", "a") as fh:
             fh.write("""c.CourseDirectory.db_assignments = [dict(name='ps1', duedate='2015-02-02 14:58:23.948203 America/Los_Angeles')]\n""")
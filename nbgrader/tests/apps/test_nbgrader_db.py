@@ -3,10 +3,12 @@ import datetime
 import shutil
 import os
 
+from subprocess import check_call
 from textwrap import dedent
 from os.path import join
 
 from ...api import Gradebook, MissingEntry
+from ...dbutil import _temp_alembic_ini
 from .. import run_nbgrader
 from .base import BaseTestApp
 
@@ -376,6 +378,30 @@ class TestNbGraderDb(BaseTestApp):
             assert assignment.duedate == datetime.datetime(2017, 1, 8, 16, 31, 22)
             assignment = gb.find_assignment("bar")
             assert assignment.duedate is None
+
+    def test_scores(self, db):
+        run_nbgrader(["db", "assignment", "add", "foo", "--db", db])
+        run_nbgrader(["db", "student", "add", "foo", "--db", db])
+        with Gradebook(db) as gb:
+            gb.add_notebook("p1", "foo")
+            gb.add_grade_cell("test1", "p1", "foo", max_score=2, cell_type="code")
+            gb.add_submission("foo", "foo")
+            gb.find_grade("test1", "p1", "foo", "foo").auto_score = 1
+            gb.db.commit()
+
+        run_nbgrader(["db", "scores", "--db", db])
+
+        with Gradebook(db) as gb:
+            gb.db.execute("UPDATE submitted_notebook SET score = 0")
+            gb.db.commit()
+
+        run_nbgrader(["db", "scores", "--db", db], retcode=1)
+        run_nbgrader(["db", "scores", "--rebuild", "--db", db])
+        run_nbgrader(["db", "scores", "--db", db])
+
+        with Gradebook(db) as gb:
+            assert gb.find_submission("foo", "foo").score == 1
+
     def test_upgrade_nodb(self, temp_cwd):
         # test upgrading without a database
         run_nbgrader(["db", "upgrade"])
@@ -405,6 +431,58 @@ class TestNbGraderDb(BaseTestApp):
         # check that nbgrader assign passes
         run_nbgrader(["assign", "ps1"])
 
+    def test_upgrade_adds_indexes(self, course_dir):
+        # replace the gradebook with an old version
+        self._copy_file(join("files", "gradebook.db"), join(course_dir, "gradebook.db"))
+
+        # upgrade the database
+        run_nbgrader(["db", "upgrade"])
+
+        with Gradebook("sqlite:///" + join(course_dir, "gradebook.db")) as gb:
+            indexes = set(name for name, in gb.db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'"))
+        assert indexes.issuperset([
+            'ix_base_cell_notebook_id',
+            'ix_submitted_assignment_student_id',
+            'ix_submitted_notebook_assignment_id',
+            'ix_grade_notebook_id',
+            'ix_comment_notebook_id'])
+
+    def test_upgrade_stores_scores(self, course_dir):
+        db = "sqlite:///" + join(course_dir, "gradebook.db")
+        with Gradebook(db) as gb:
+            gb.add_assignment("ps1")
+            gb.add_student("foo")
+            gb.add_notebook("p1", "ps1")
+            gb.add_grade_cell("code", "p1", "ps1", max_score=2, cell_type="code")
+            gb.add_grade_cell("written", "p1", "ps1", max_score=3, cell_type="markdown")
+            gb.add_task_cell("task", "p1", "ps1", max_score=4, cell_type="markdown")
+            gb.add_submission("ps1", "foo")
+            gb.find_grade("code", "p1", "ps1", "foo").auto_score = 1
+            gb.find_grade("written", "p1", "ps1", "foo").manual_score = 2
+            gb.find_grade("written", "p1", "ps1", "foo").extra_credit = 0.5
+            gb.find_grade("task", "p1", "ps1", "foo").manual_score = 3
+            gb.db.commit()
+
+        # go back to the revision before the scores were stored
+        with _temp_alembic_ini(db) as alembic_ini:
+            check_call(["alembic", "-c", alembic_ini, "downgrade", "9fd8e9c0b2f1"])
+
+        run_nbgrader(["db", "upgrade"])
+        run_nbgrader(["db", "scores"])
+
+        with Gradebook(db) as gb:
+            assignment = gb.find_assignment("ps1")
+            assert assignment.max_score == 9
+            assert assignment.max_code_score == 2
+            assert assignment.max_written_score == 3
+            assert assignment.max_task_score == 4
+            submission = gb.find_submission("ps1", "foo")
+            assert submission.score == 6.5
+            assert submission.code_score == 1
+            assert submission.written_score == 2.5
+            assert submission.task_score == 3
+
     def test_upgrade_old_db(self, course_dir):
         # add assignment files
         self._copy_file(join("files", "test.ipynb"), join(course_dir, "source", "ps1", "p1.ipynb"))
@@ -0,0 +1,38 @@
+import pytest
+
+from nbformat.v4 import new_notebook, new_code_cell
+from ...preprocessors import Execute
+from ...preprocessors.execute import shutdown_kernel_pools
+from .base import BaseTestPreprocessor
+
+
+@pytest.fixture
+def preprocessor(request):
+    request.addfinalizer(shutdown_kernel_pools)
+    return Execute(kernel_pool_size=1)
+
+
+class TestExecute(BaseTestPreprocessor):
+
+    def test_kernel_pool(self, preprocessor, tmpdir):
+        """Are notebooks run by the pre-started kernels, in their directory?"""
+        pool = preprocessor._get_kernel_pool("python3")
+        acquired = []
+
+        def acquire(acquire=pool.acquire):
+            acquired.append(acquire())
+            return acquired[-1]
+        pool.acquire = acquire
+
+        for i in range(2):
+            path = tmpdir.mkdir("nb{}".format(i))
+            nb = new_notebook(metadata={"kernelspec": {"name": "python3", "display_name": "Python 3"}})
+            nb.cells.append(new_code_cell("import os, ipykernel\nprint(ipykernel.get_connection_file())\nprint(os.getcwd())"))
+
+            nb, resources = preprocessor.preprocess(nb, {"metadata": {"path": str(path)}})
+            connection_file, cwd = nb.cells[0].outputs[0].text.splitlines()
+
+            assert len(acquired) == i + 1
+            assert connection_file == acquired[i].connection_file
+            assert cwd == str(path)
+            assert not acquired[i].is_alive()
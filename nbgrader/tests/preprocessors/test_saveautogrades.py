@@ -59,6 +59,43 @@ class TestSaveAutoGrades(BaseTestPreprocessor):
         assert grade_cell.manual_score == None
         assert not grade_cell.needs_manual_grade
 
+    def test_number_of_queries(self, preprocessors, gradebook, resources):
+        """Does the number of queries not depend on the number of cells?"""
+        nb = new_notebook()
+        for i in range(10):
+            cell = create_grade_and_solution_cell("hello", "code", "foo{}".format(i), 1)
+            cell.metadata.nbgrader['checksum'] = compute_checksum(cell)
+            nb.cells.append(cell)
+        preprocessors[0].preprocess(nb, resources)
+        gradebook.add_submission("ps0", "bar")
+
+        preprocessors[1].preprocess(nb, resources)
+        # one query each to fetch the grades and comments, one (batched)
+        # update each to save them, and three queries to update the scores
+        # of the submission
+        assert preprocessors[1].num_queries <= 7
+
+        for i in range(10):
+            comment = gradebook.find_comment("foo{}".format(i), "test", "ps0", "bar")
+            assert comment.auto_comment == "No response."
+
+    def test_grade_shared_gradebook(self, preprocessors, gradebook, resources):
+        """Is an already open gradebook passed in the resources used, and left open?"""
+        cell = create_grade_cell("hello", "code", "foo", 1)
+        cell.metadata.nbgrader['checksum'] = compute_checksum(cell)
+        nb = new_notebook()
+        nb.cells.append(cell)
+        preprocessors[0].preprocess(nb, resources)
+        gradebook.add_submission("ps0", "bar")
+
+        resources['nbgrader']['gradebook'] = gradebook
+        preprocessors[1].preprocess(nb, resources)
+        assert preprocessors[1].gradebook is gradebook
+
+        grade_cell = gradebook.find_grade("foo", "test", "ps0", "bar")
+        assert grade_cell.auto_score == 1
+        assert not grade_cell.needs_manual_grade
+
     def test_grade_incorrect_code(self, preprocessors, gradebook, resources):
         """Is a failing code cell correctly graded?"""
         cell = create_grade_cell("hello", "code", "foo", 1)
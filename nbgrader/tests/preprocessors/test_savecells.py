@@ -5,7 +5,7 @@ from nbformat import validate
 from nbformat.v4 import new_notebook
 
 from ...preprocessors import SaveCells
-from ...api import Gradebook
+from ...api import Gradebook, sqlite_concurrency_pragmas
 from ...utils import compute_checksum
 from .base import BaseTestPreprocessor
 from .. import (
@@ -309,3 +309,12 @@ class TestSaveCells(BaseTestPreprocessor):
         validate(nb)
         notebook = gradebook.find_notebook("test", "ps0")
         assert json.loads(notebook.kernelspec) == kernelspec
+
+    def test_sqlite_pragmas(self, preprocessor, gradebook, resources):
+        resources["nbgrader"]["db_sqlite_pragmas"] = sqlite_concurrency_pragmas()
+        nb = new_notebook()
+        nb, resources = preprocessor.preprocess(nb, resources)
+
+        # write-ahead logging is stored in the database file
+        assert gradebook.db.execute("PRAGMA journal_mode").scalar() == "wal"
+        assert gradebook.find_notebook("test", "ps0")
@@ -0,0 +1,135 @@
+import pytest
+import numpy as np
+
+from .. import analytics
+from ..api import Gradebook, MissingEntry
+
+
+@pytest.fixture
+def gradebook(request):
+    gb = Gradebook("sqlite:///:memory:")
+    request.addfinalizer(gb.close)
+
+    gb.add_assignment("ps1")
+    gb.add_notebook("p1", "ps1")
+    gb.add_notebook("p2", "ps1")
+    gb.add_grade_cell("b", "p1", "ps1", max_score=2, cell_type="code")
+    gb.add_grade_cell("a", "p1", "ps1", max_score=1, cell_type="code")
+    gb.add_task_cell("task", "p2", "ps1", max_score=4, cell_type="markdown")
+    gb.add_solution_cell("a", "p1", "ps1")
+
+    # rows are students, columns are p1/a, p1/b and p2/task
+    scores = {
+        "s1": [1, 2, 4],
+        "s2": [1, 1, 3],
+        "s3": [0, 1, 1],
+        "s4": [0, 0, 0],
+    }
+    for student in scores:
+        gb.add_student(student)
+    gb.add_submissions("ps1", list(scores))
+    for student, (a, b, task) in scores.items():
+        gb.find_grade("a", "p1", "ps1", student).auto_score = a
+        gb.find_grade("b", "p1", "ps1", student).auto_score = b
+        gb.find_grade("task", "p2", "ps1", student).manual_score = task
+    gb.db.commit()
+
+    gb.scores = np.array([scores[s] for s in sorted(scores)], dtype=float)
+    return gb
+
+
+class TestAnalytics(object):
+
+    def test_load_grades(self, gradebook):
+        with gradebook.count_queries() as counter:
+            grades = analytics.load_grades(gradebook, "ps1")
+        assert counter.count == 2
+
+        assert list(grades.students) == ["s1", "s2", "s3", "s4"]
+        assert list(grades.notebooks) == ["p1", "p2"]
+        assert list(grades.cells) == ["a", "b", "task"]
+        assert list(grades.cell_notebooks) == [0, 0, 1]
+        assert list(grades.max_scores) == [1, 2, 4]
+        assert (grades.scores == gradebook.scores).all()
+        assert grades.notebook_scores.tolist() == [[3, 4], [2, 3], [1, 1], [0, 0]]
+        assert list(grades.notebook_max_scores) == [3, 4]
+        assert list(grades.total_scores) == [7, 5, 2, 0]
+
+    def test_load_grades_missing(self, gradebook):
+        with pytest.raises(MissingEntry):
+            analytics.load_grades(gradebook, "ps2")
+
+        gradebook.add_assignment("ps2")
+        grades = analytics.load_grades(gradebook, "ps2")
+        assert grades.scores.shape == (0, 0)
+
+    def test_describe(self):
+        scores = np.array([[0, 1], [1, 2], [2, 2], [2, 5]], dtype=float)
+        stats = analytics.describe(scores, np.array([2, 4]), bins=4, percentiles=[0, 50, 100])
+
+        assert stats["mean"].tolist() == [1.25, 2.5]
+        assert stats["std"] == pytest.approx(np.std(scores, axis=0))
+        assert stats["min"].tolist() == [0, 1]
+        assert stats["max"].tolist() == [2, 5]
+        assert stats["percentiles"].tolist() == [[0, 1], [1.5, 2], [2, 5]]
+        # the maximum score and extra credit end up in the last bin
+        assert stats["histogram"].tolist() == [[1, 0, 1, 2], [0, 1, 2, 1]]
+
+    def test_describe_empty(self):
+        stats = analytics.describe(np.zeros((0, 2)), np.array([1, 1]), bins=3)
+        assert np.isnan(stats["mean"]).all()
+        assert stats["percentiles"].shape == (len(analytics.DEFAULT_PERCENTILES), 2)
+        assert stats["histogram"].tolist() == [[0, 0, 0], [0, 0, 0]]
+
+    def test_item_statistics(self):
+        scores = np.array([[1, 2, 4], [1, 1, 3], [0, 1, 1], [0, 0, 0], [1, 1, 1]], dtype=float)
+        stats = analytics.item_statistics(scores, np.array([1, 2, 0]))
+
+        assert stats["difficulty"][:2].tolist() == [0.6, 0.5]
+        assert np.isnan(stats["difficulty"][2])
+
+        for i in range(3):
+            rest = scores.sum(axis=1) - scores[:, i]
+            expected = np.corrcoef(scores[:, i], rest)[0, 1]
+            assert stats["point_biserial"][i] == pytest.approx(expected)
+
+    def test_item_statistics_constant(self):
+        scores = np.array([[1, 0], [1, 1]], dtype=float)
+        stats = analytics.item_statistics(scores, np.array([1, 1]))
+        assert stats["difficulty"].tolist() == [1, 0.5]
+        assert np.isnan(stats["point_biserial"]).all()
+
+    def test_assignment_analytics(self, gradebook):
+        result = analytics.assignment_analytics(gradebook, "ps1", bins=2, percentiles=[50])
+
+        assert result["assignment"] == "ps1"
+        assert result["num_submissions"] == 4
+
+        total = result["total"]
+        assert total["name"] == "ps1"
+        assert total["max_score"] == 7
+        assert total["mean"] == 3.5
+        assert total["min"] == 0
+        assert total["max"] == 7
+        assert total["percentiles"] == {"50": 3.5}
+        assert total["histogram"] == {"counts": [2, 2], "edges": [0, 3.5, 7]}
+
+        assert [x["name"] for x in result["notebooks"]] == ["p1", "p2"]
+        assert [x["max_score"] for x in result["notebooks"]] == [3, 4]
+        assert [x["mean"] for x in result["notebooks"]] == [1.5, 2]
+
+        cells = result["cells"]
+        assert [(x["notebook"], x["name"]) for x in cells] == [("p1", "a"), ("p1", "b"), ("p2", "task")]
+        assert [x["difficulty"] for x in cells] == [0.5, 0.5, 0.5]
+        assert all(x["point_biserial"] > 0 for x in cells)
+
+    def test_assignment_analytics_no_submissions(self, gradebook):
+        gradebook.add_assignment("ps2")
+        gradebook.add_notebook("p1", "ps2")
+        gradebook.add_grade_cell("a", "p1", "ps2", max_score=1, cell_type="code")
+
+        result = analytics.assignment_analytics(gradebook, "ps2")
+        assert result["num_submissions"] == 0
+        assert result["total"]["mean"] is None
+        assert result["notebooks"] == []
+        assert result["cells"] == []
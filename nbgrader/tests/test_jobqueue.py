@@ -0,0 +1,179 @@
+import os
+import json
+import threading
+import pytest
+
+from ..server_extensions.formgrader.jobqueue import JobQueue, JobQueueFull
+
+
+@pytest.fixture
+def queue(tmpdir):
+    return JobQueue(directory=str(tmpdir.join("jobs")))
+
+
+def action(log, success=True):
+    def run():
+        return {"success": success, "log": log}
+    return run
+
+
+def blocked():
+    # a step that runs until the test releases it
+    started = threading.Event()
+    release = threading.Event()
+
+    def run():
+        started.set()
+        release.wait(10)
+        return {"success": True, "log": "blocked"}
+
+    return run, started, release
+
+
+def test_submit(queue):
+    job = queue.submit("autograde", lambda: [(None, action("done"))], assignment_id="ps1", student_id="foo")
+    assert job.future.result(10) == {"success": True, "log": "done"}
+
+    job = queue.get(job.id)
+    assert job.status == "finished"
+    assert job.to_dict()["assignment_id"] == "ps1"
+    assert job.to_dict()["student_id"] == "foo"
+    assert job.steps == job.completed == 1
+    assert queue.jobs() == [job]
+    assert queue.get("missing") is None
+
+    with open(os.path.join(queue.directory, job.id + ".json")) as fh:
+        assert json.load(fh) == job.to_dict()
+
+
+def test_batch(queue):
+    def steps():
+        return [("bar", action("a")), ("baz", action("b", success=False)), ("foo", action("c"))]
+
+    result = queue.submit("autograde_ungraded", steps, assignment_id="ps1").future.result(10)
+    assert not result["success"]
+    assert result["log"] == "[bar]\na\n[baz]\nb\n[foo]\nc"
+
+    def fail():
+        raise RuntimeError("oops")
+
+    result = queue.submit("autograde_ungraded", lambda: [("bar", fail), ("baz", action("b"))]).future.result(10)
+    assert not result["success"]
+    assert result["log"] == "[baz]\nb"
+    assert result["error"].startswith("[bar]\n")
+    assert "oops" in result["error"]
+
+
+def test_cancel_queued(queue):
+    run, started, release = blocked()
+    first = queue.submit("collect", lambda: [(None, run)])
+    assert started.wait(10)
+
+    ran = []
+    second = queue.submit("collect", lambda: [(None, lambda: ran.append(True))])
+    assert queue.get(second.id).status == "queued"
+    assert queue.cancel(second.id).status == "cancelled"
+    assert second.future.result(10) == {"success": False, "error": "The job was cancelled."}
+
+    release.set()
+    assert first.future.result(10)["success"]
+    assert ran == []
+    assert queue.cancel("missing") is None
+
+
+def test_cancel_running(queue):
+    run, started, release = blocked()
+    ran = []
+    job = queue.submit("autograde_ungraded", lambda: [("bar", run), ("foo", lambda: ran.append(True))])
+    assert started.wait(10)
+
+    assert queue.cancel(job.id).cancel_requested
+    assert job.status == "running"
+    release.set()
+
+    result = job.future.result(10)
+    assert not result["success"]
+    assert result["log"] == "[bar]\nblocked"
+    assert job.status == "cancelled"
+    assert job.completed == 1
+    assert ran == []
+
+
+def test_persistent(queue, tmpdir):
+    done = queue.submit("collect", lambda: [(None, action("done"))])
+    done.future.result(10)
+
+    run, started, release = blocked()
+    running = queue.submit("collect", lambda: [(None, run)])
+    assert started.wait(10)
+
+    # a new queue, e.g. after the server was restarted, knows about the jobs
+    # and sees that the running one was interrupted
+    other = JobQueue(directory=queue.directory)
+    assert [x.id for x in other.jobs()] == [done.id, running.id]
+    assert other.get(done.id).to_dict() == done.to_dict()
+    assert other.get(running.id).status == "interrupted"
+    assert other.get(running.id).future.result(10) == {"success": False}
+
+    release.set()
+    running.future.result(10)
+
+
+def test_max_queued(queue):
+    queue.max_queued = 1
+    run, started, release = blocked()
+    queue.submit("collect", lambda: [(None, run)])
+    assert started.wait(10)
+
+    queued = queue.submit("collect", lambda: [(None, action("done"))])
+    with pytest.raises(JobQueueFull):
+        queue.submit("collect", lambda: [(None, action("done"))])
+
+    release.set()
+    queued.future.result(10)
+
+
+def test_max_workers(queue):
+    ps1, ps1_started, ps1_release = blocked()
+    ps2, ps2_started, ps2_release = blocked()
+    first = queue.submit("autograde", lambda: [(None, ps1)], assignment_id="ps1", student_id="foo")
+    second = queue.submit("autograde", lambda: [(None, ps2)], assignment_id="ps2", student_id="foo")
+    assert ps1_started.wait(10)
+    assert ps2_started.wait(10)
+
+    # jobs for an assignment that already has a running job wait for it
+    third = queue.submit("autograde", lambda: [(None, action("done"))], assignment_id="ps1", student_id="bar")
+    ps2_release.set()
+    assert second.future.result(10)["success"]
+    assert queue.get(third.id).status == "queued"
+    assert not third.future.done()
+
+    ps1_release.set()
+    assert first.future.result(10)["success"]
+    assert third.future.result(10) == {"success": True, "log": "done"}
+
+
+def test_max_finished(queue):
+    queue.max_finished = 2
+    jobs = [queue.submit("collect", lambda: [(None, action("done"))]) for _ in range(3)]
+    for job in jobs:
+        job.future.result(10)
+
+    assert [x.id for x in queue.jobs()] == [x.id for x in jobs[1:]]
+    assert sorted(os.listdir(queue.directory)) == sorted(x.id + ".json" for x in jobs[1:])
+
+
+def test_broken_step(queue):
+    # a step that does not return a result still finishes the job
+    job = queue.submit("collect", lambda: [(None, lambda: None)])
+    result = job.future.result(10)
+    assert not result["success"]
+    assert "AttributeError" in result["error"]
+    assert queue.get(job.id).status == "finished"
+
+
+def test_directory_per_course(tmpdir):
+    foo = JobQueue(course_root=str(tmpdir.join("foo")))
+    bar = JobQueue(course_root=str(tmpdir.join("bar")))
+    assert foo.directory != bar.directory
+    assert foo.directory == JobQueue(course_root=str(tmpdir.join("foo"))).directory
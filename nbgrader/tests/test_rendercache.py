@@ -0,0 +1,147 @@
+import os
+import pytest
+
+from ..server_extensions.formgrader import rendercache
+from ..server_extensions.formgrader.rendercache import RenderCache
+
+
+@pytest.fixture
+def notebook(tmpdir):
+    path = str(tmpdir.join("notebook.ipynb"))
+    with open(path, "w") as fh:
+        fh.write("{}")
+    return path
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return RenderCache(directory=str(tmpdir.join("cache")))
+
+
+def test_key(cache, notebook):
+    key = cache.key(notebook, "formgrade", {"index": 0})
+    assert key == cache.key(notebook, "formgrade", {"index": 0})
+    assert key != cache.key(notebook, "formgrade", {"index": 1})
+    assert key != cache.key(notebook, "other", {"index": 0})
+
+    with open(notebook, "w") as fh:
+        fh.write('{"cells": []}')
+    assert key != cache.key(notebook, "formgrade", {"index": 0})
+
+    assert cache.key(notebook + ".missing", "formgrade", {}) is None
+
+
+def test_key_templates(tmpdir, notebook):
+    templates = tmpdir.mkdir("templates")
+    templates.join("formgrade.tpl").write("a")
+    cache = RenderCache(directory=str(tmpdir.join("cache")), template_paths=[str(templates)])
+    key = cache.key(notebook, "formgrade", {})
+
+    # editing a template renders the pages again
+    os.utime(str(templates.join("formgrade.tpl")), (1, 1))
+    assert key != cache.key(notebook, "formgrade", {})
+
+
+def test_key_version(cache, notebook, monkeypatch):
+    key = cache.key(notebook, "formgrade", {})
+    monkeypatch.setattr(rendercache, "__version__", "0.0.0")
+    assert key != cache.key(notebook, "formgrade", {})
+
+
+def test_clear_outdated(cache, monkeypatch):
+    cache.set("a", "<html>a</html>")
+    cache.clear_outdated()
+    assert cache.get("a") is None
+
+    # pages of the same version are kept
+    cache.set("a", "<html>a</html>")
+    RenderCache(directory=cache.directory).clear_outdated()
+    assert RenderCache(directory=cache.directory).get("a") == "<html>a</html>"
+
+    monkeypatch.setattr(rendercache, "__version__", "0.0.0")
+    RenderCache(directory=cache.directory).clear_outdated()
+    assert RenderCache(directory=cache.directory).get("a") is None
+
+
+def test_get_and_set(cache, notebook):
+    key = cache.key(notebook, "formgrade", {})
+    assert cache.get(key) is None
+    cache.set(key, u"<html>é</html>")
+    assert cache.get(key) == u"<html>é</html>"
+    assert os.path.isfile(os.path.join(cache.directory, key + ".html"))
+
+    # a missing notebook is never cached
+    cache.set(None, "<html></html>")
+    assert cache.get(None) is None
+
+
+def test_persists_on_disk(cache, tmpdir):
+    cache.set("a", "<html>a</html>")
+    cache = RenderCache(directory=cache.directory)
+    assert cache.get("a") == "<html>a</html>"
+
+
+def test_memory_budget(tmpdir):
+    cache = RenderCache(directory=str(tmpdir.join("cache")), memory_budget=10, disk_budget=0)
+    cache.set("a", "aaaa")
+    cache.set("b", "bbbb")
+    assert cache.get("a") == "aaaa"
+
+    # "b" is the least recently used page, so it gets evicted
+    cache.set("c", "cccc")
+    assert cache.get("a") == "aaaa"
+    assert cache.get("b") is None
+    assert cache.get("c") == "cccc"
+
+    # pages larger than the budget are not kept at all
+    cache.set("d", "d" * 11)
+    assert cache.get("d") is None
+    assert cache.get("a") == "aaaa"
+
+
+def test_disk_budget(tmpdir):
+    cache = RenderCache(directory=str(tmpdir.join("cache")), memory_budget=0, disk_budget=10)
+    cache.set("a", "aaaa")
+    cache.set("b", "bbbb")
+    assert cache.get("a") == "aaaa"
+
+    cache.set("c", "cccc")
+    assert sorted(os.listdir(cache.directory)) == ["a.html", "c.html"]
+    assert cache.get("b") is None
+    assert cache.get("c") == "cccc"
+
+
+def test_clear(cache):
+    cache.set("a", "aaaa")
+    cache.clear()
+    assert cache.get("a") is None
+    assert os.listdir(cache.directory) == []
+
+
+def test_prefetch(cache):
+    cache.prefetch("a", lambda: "aaaa")
+    cache._executor.shutdown(wait=True)
+    assert cache.get("a") == "aaaa"
+
+    # pages that are already cached are not rendered again
+    cache = RenderCache(directory=cache.directory)
+    cache.prefetch("a", lambda: "bbbb")
+    assert cache._executor is None
+    assert cache.get("a") == "aaaa"
+
+
+def test_prefetch_error(cache):
+    def render():
+        raise RuntimeError("oops")
+
+    cache.prefetch("a", render)
+    cache._executor.shutdown(wait=True)
+    assert cache.get("a") is None
+    assert cache._pending == set()
+
+
+def test_prefetch_disabled(tmpdir):
+    cache = RenderCache(directory=str(tmpdir.join("cache")), prefetch_workers=0)
+    cache.prefetch("a", lambda: "aaaa")
+    assert cache._executor is None
+    assert cache.get("a") is None
@@ -0,0 +1,107 @@
+import random
+
+from ..server_extensions.formgrader.submissionindex import SubmissionIndex, SubmissionOrdering
+
+
+def _neighbor(ids, submission_id, offset):
+    # how the formgrader used to find neighbors, by sorting the submissions
+    # and searching for the current one
+    ids = sorted(set(ids) | set([submission_id]))
+    ix = ids.index(submission_id) + offset
+    if 0 <= ix < len(ids):
+        return ids[ix]
+    return None
+
+
+def test_ordering():
+    rng = random.Random(42)
+    ids = ["{:03d}".format(i) for i in range(0, 200, 2)]
+    incorrect = rng.sample(ids, 20)
+    ordering = SubmissionOrdering(rng.sample(ids, len(ids)), incorrect)
+
+    assert ordering.ids == ids
+    assert ordering.indices == dict((x, i) for i, x in enumerate(ids))
+
+    for submission_id in ids:
+        assert ordering.next(submission_id) == _neighbor(ids, submission_id, 1)
+        assert ordering.prev(submission_id) == _neighbor(ids, submission_id, -1)
+        assert ordering.next_incorrect(submission_id) == _neighbor(incorrect, submission_id, 1)
+        assert ordering.prev_incorrect(submission_id) == _neighbor(incorrect, submission_id, -1)
+
+    # submissions that are not part of the ordering are placed by their id
+    for submission_id in ["", "001", "051", "199", "999"]:
+        assert ordering.next(submission_id) == _neighbor(ids, submission_id, 1)
+        assert ordering.prev(submission_id) == _neighbor(ids, submission_id, -1)
+        assert ordering.next_incorrect(submission_id) == _neighbor(incorrect, submission_id, 1)
+        assert ordering.prev_incorrect(submission_id) == _neighbor(incorrect, submission_id, -1)
+
+
+def test_ordering_empty():
+    ordering = SubmissionOrdering([], [])
+    assert ordering.next("a") is None
+    assert ordering.prev("a") is None
+    assert ordering.next_incorrect("a") is None
+    assert ordering.prev_incorrect("a") is None
+
+
+class TestSubmissionIndex(object):
+
+    def _build(self, ids):
+        calls = []
+
+        def build():
+            calls.append(1)
+            return ids, []
+        return build, calls
+
+    def test_get(self):
+        index = SubmissionIndex()
+        build, calls = self._build(["a", "b"])
+
+        ordering = index.get("ps1", "p1", build)
+        assert ordering.ids == ["a", "b"]
+        assert index.get("ps1", "p1", build) is ordering
+        assert len(calls) == 1
+
+        index.get("ps1", "p2", build)
+        assert len(calls) == 2
+
+    def test_max_age(self):
+        index = SubmissionIndex(max_age=0)
+        build, calls = self._build(["a", "b"])
+        index.get("ps1", "p1", build)
+        index.get("ps1", "p1", build)
+        assert len(calls) == 2
+
+    def test_version(self):
+        index = SubmissionIndex()
+        build, calls = self._build(["a", "b"])
+        index.get("ps1", "p1", build, version="1")
+        index.get("ps1", "p1", build, version="1")
+        assert len(calls) == 1
+
+        # the gradebook changed since the ordering was built
+        index.get("ps1", "p1", build, version="2")
+        assert len(calls) == 2
+
+    def test_invalidate(self):
+        index = SubmissionIndex()
+        build, calls = self._build(["a", "b"])
+        for key in [("ps1", "p1"), ("ps1", "p2"), ("ps2", "p1")]:
+            index.get(key[0], key[1], build)
+        assert len(calls) == 3
+
+        index.invalidate("ps1", "p1")
+        index.get("ps1", "p1", build)
+        index.get("ps1", "p2", build)
+        assert len(calls) == 4
+
+        index.invalidate("ps1")
+        index.get("ps1", "p1", build)
+        index.get("ps1", "p2", build)
+        index.get("ps2", "p1", build)
+        assert len(calls) == 6
+
+        index.invalidate()
+        index.get("ps2", "p1", build)
+        assert len(calls) == 7
@@ -437,3 +437,45 @@ def test_get_username():
     assert utils.get_username() == os.environ["USER"]
     # Can't test get_username's support for JUPYTERHUB_USER, as
     # this would require actually running the tests as 'jovyan'.
+
+
+def test_directory_cache(temp_cwd):
+    os.makedirs(join("foo", "bar"))
+    with open(join("foo", "baz.txt"), "w") as fh:
+        fh.write("baz")
+
+    cache = utils.DirectoryCache()
+    assert cache.listdir("foo", 60) == {"bar": True, "baz.txt": False}
+    assert cache.exists(join("foo", "baz.txt"), 60)
+    assert cache.isdir(join("foo", "bar"), 60)
+    assert not cache.isdir(join("foo", "baz.txt"), 60)
+    assert not cache.exists(join("foo", "qux.txt"), 60)
+    assert cache.listdir("missing", 60) == {}
+
+    # the listing is reused until the ttl has passed
+    with open(join("foo", "qux.txt"), "w") as fh:
+        fh.write("qux")
+    assert not cache.exists(join("foo", "qux.txt"), 60)
+
+    # and after that, it is only read again if the directory changed
+    os.utime("foo", (0, 0))
+    assert cache.exists(join("foo", "qux.txt"), 0)
+    os.remove(join("foo", "qux.txt"))
+    os.utime("foo", (0, 0))
+    assert cache.exists(join("foo", "qux.txt"), 0)
+    os.utime("foo", (1, 1))
+    assert not cache.exists(join("foo", "qux.txt"), 0)
+
+
+def test_directory_cache_invalidate(temp_cwd):
+    os.makedirs(join("foo", "bar"))
+    cache = utils.DirectoryCache()
+    assert cache.listdir(join("foo", "bar"), 60) == {}
+    assert cache.listdir("foo", 60) == {"bar": True}
+
+    with open(join("foo", "bar", "baz.txt"), "w") as fh:
+        fh.write("baz")
+    os.makedirs(join("foo", "qux"))
+    cache.invalidate(join("foo", "bar"))
+    assert cache.listdir(join("foo", "bar"), 60) == {"baz.txt": False}
+    assert cache.listdir("foo", 60) == {"bar": True, "qux": True}
@@ -10,6 +10,8 @@ import logging
 import traceback
 import contextlib
 import fnmatch
+import threading
+import time
 
 from setuptools.archive_util import unpack_archive
 from setuptools.archive_util import unpack_tarfile
@@ -340,6 +342,64 @@ def find_all_notebooks(path):
     return notebooks
 
 
+class DirectoryCache(object):
+    """A cache of directory listings, for checking whether many files exist
+    without a filesystem call for every one of them (which is slow on e.g.
+    NFS). Each directory is listed once; after `ttl` seconds, its
+    modification time is checked and it is listed again if it has changed.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listings = {}
+
+    def listdir(self, path, ttl):
+        """Return a dictionary mapping the names of the entries in a directory
+        to whether they are directories. The dictionary is empty if the
+        directory does not exist, and must not be modified."""
+        path = os.path.abspath(path)
+        now = time.time()
+        with self._lock:
+            listing = self._listings.get(path)
+        if listing is not None and now - listing[0] < ttl:
+            return listing[2]
+
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime, entries = None, {}
+        else:
+            if listing is not None and listing[1] == mtime:
+                entries = listing[2]
+            else:
+                entries = dict((x.name, x.is_dir()) for x in os.scandir(path))
+
+        with self._lock:
+            self._listings[path] = (now, mtime, entries)
+        return entries
+
+    def exists(self, path, ttl):
+        """Whether a file or directory exists."""
+        dirname, basename = os.path.split(os.path.abspath(path))
+        return basename in self.listdir(dirname, ttl)
+
+    def isdir(self, path, ttl):
+        """Whether a directory exists."""
+        dirname, basename = os.path.split(os.path.abspath(path))
+        return self.listdir(dirname, ttl).get(basename, False)
+
+    def invalidate(self, path):
+        """Forget the listings of a directory, its parent and everything in
+        it, e.g. after files have been written to it."""
+        path = os.path.abspath(path)
+        with self._lock:
+            for key in list(self._listings):
+                if key == path or key.startswith(path + os.sep):
+                    del self._listings[key]
+            self._listings.pop(os.path.dirname(path), None)
+
+
 def full_split(path):
     rest, last = os.path.split(path)
     if last == path:
@@ -558,3 +618,19 @@ def make_unique_key(course_id, assignment_id, notebook_id, student_id, timestamp
     return "+".join([
         course_id, assignment_id, notebook_id, student_id, timestamp])
 
+
+
+def sqlite_concurrency_pragmas(busy_timeout=30000, cache_size=-64000):
+    """The SQLite PRAGMAs that allow the gradebook to be read while another
+    process is writing to it: write-ahead logging, waiting up to
+    ``busy_timeout`` milliseconds for locks to be released, less frequent
+    syncing to disk, and a larger page cache (``cache_size`` pages, or KiB
+    if negative).
+
+    """
+    return {
+        "journal_mode": "WAL",
+        "busy_timeout": int(busy_timeout),
+        "synchronous": "NORMAL",
+        "cache_size": int(cache_size),
+    }
@@ -103,7 +103,8 @@ setup_args = dict(
         "requests",
         "jsonschema",
         "alembic",
-        "fuzzywuzzy"
+        "fuzzywuzzy",
+        "numpy"
     ]
 )
 
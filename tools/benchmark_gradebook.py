@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Time the gradebook queries used by the formgrader on a synthetic
+gradebook, with and without the indexes on the foreign keys.
+
+Usage:
+
+    python tools/benchmark_gradebook.py [STUDENTS] [REPEAT]
+
+STUDENTS defaults to 1000, and REPEAT (the number of times each query is
+run, of which the best time is reported) to 5.
+
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import timeit
+
+from nbgrader.api import Gradebook, Base
+
+NOTEBOOKS = 3
+CELLS = 10
+
+
+def create_gradebook(db_url, num_students):
+    with Gradebook(db_url) as gb:
+        gb.add_assignment("ps1")
+        for i in range(NOTEBOOKS):
+            notebook = "p{}".format(i + 1)
+            gb.add_notebook(notebook, "ps1")
+            for j in range(CELLS):
+                cell = "cell{}".format(j + 1)
+                gb.add_grade_cell(cell, notebook, "ps1", max_score=1, cell_type="code")
+                gb.add_solution_cell(cell, notebook, "ps1")
+
+        for i in range(num_students):
+            student = "student{}".format(i + 1)
+            gb.add_student(student)
+            submission = gb.add_submission("ps1", student)
+            for notebook in submission.notebooks:
+                for grade in notebook.grades:
+                    grade.auto_score = i % 2
+            gb.db.commit()
+
+
+def time_queries(db_url, repeat):
+    with Gradebook(db_url) as gb:
+        timings = {}
+        timings["submission_dicts"] = min(timeit.repeat(
+            lambda: gb.submission_dicts("ps1"), number=1, repeat=repeat))
+        timings["notebook_submission_dicts"] = min(timeit.repeat(
+            lambda: gb.notebook_submission_dicts("p1", "ps1"), number=1, repeat=repeat))
+        return timings
+
+
+def drop_indexes(db_url):
+    with Gradebook(db_url) as gb:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(bind=gb.engine)
+
+
+def main(num_students, repeat):
+    tempdir = tempfile.mkdtemp()
+    try:
+        db_url = "sqlite:///" + os.path.join(tempdir, "gradebook.db")
+        print("Creating a gradebook with {} students...".format(num_students))
+        create_gradebook(db_url, num_students)
+
+        with_indexes = time_queries(db_url, repeat)
+        drop_indexes(db_url)
+        without_indexes = time_queries(db_url, repeat)
+
+        print("{:<28}{:>12}{:>12}{:>10}".format(
+            "query", "no indexes", "indexes", "speedup"))
+        for name in sorted(with_indexes):
+            print("{:<28}{:>11.3f}s{:>11.3f}s{:>9.1f}x".format(
+                name, without_indexes[name], with_indexes[name],
+                without_indexes[name] / with_indexes[name]))
+
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3:
+        print(__doc__)
+        sys.exit(1)
+
+    num_students = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    main(num_students, repeat)